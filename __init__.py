@@ -8,3 +8,4 @@ __version__ = "1.2.2"
 
 from .lib.config import parse_options
 from .lib.clients.index import create_iaas_client
+from .lib.workflow import Step, Workflow, create_backup_workflow, create_restore_workflow
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of attribute accesses and method calls on a client, with and without abort checkpoints.
+
+The clients used to check on every attribute access (in __getattribute__) whether the accessed attribute is one of
+the abortable methods. This benchmark compares a client reinstating that check with the current client, whose
+abortable methods check for a scheduled abortion themselves and whose other attributes are accessed as usual.
+
+Usage (from the root of the repository):
+
+    python3 benchmarks/attribute_access.py --number 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.clients.BaseClient import BaseClient  # noqa: E402
+
+CONFIGURATION = {
+    'credhub_url': None,
+    'type': 'online',
+    'backup_guid': 'backup-guid',
+    'instance_id': 'vm-id',
+    'secret': 'secret',
+    'job_name': 'service-job-name',
+    'trigger': 'on-demand-or-scheduled',
+    'container': 'backup-container'
+}
+
+
+class Client(BaseClient):
+    def get_container(self):
+        return self.CONTAINER
+
+    def create_directory(self, directory):
+        return directory
+
+
+class GetattributeClient(Client):
+    # The abort check as it was before the abort checkpoints
+    def __getattribute__(self, attr):
+        method = object.__getattribute__(self, attr)
+        methods_allow_aborting = [
+            'get_persistent_volume_for_instance', 'copy_snapshot', 'create_snapshot', 'create_volume',
+            'create_attachment', 'get_mountpoint', 'copy_directory', 'delete_directory', 'create_directory',
+            'format_device', 'mount_device', 'create_and_encrypt_tarball_of_directory', 'create_tarball_of_directory',
+            'encrypt_file', 'upload_to_blobstore', 'unmount_device', 'delete_attachment', 'delete_volume',
+            'delete_snapshot', 'download_from_blobstore', 'decrypt_and_extract_tarball_of_directory',
+            'extract_tarball_of_directory', 'decrypt_file'
+        ]
+        if isinstance(method, types.MethodType) and attr in methods_allow_aborting and \
+                object.__getattribute__(self, '_BaseClient__ABORT'):
+            object.__getattribute__(self, '_BaseClient__abort')()
+        else:
+            return method
+
+
+STATEMENTS = [
+    ('attribute', 'client.CONTAINER'),
+    ('method', 'client.get_container()'),
+    ('abortable method', 'client.create_directory("/tmp")')
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=1000000, help='executions per statement (default: 1000000)')
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_directory:
+        os.environ['SF_BACKUP_RESTORE_LOG_DIRECTORY'] = log_directory
+        os.environ['SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY'] = log_directory
+        clients = [
+            ('__getattribute__', GetattributeClient('backup', CONFIGURATION, '/var/vcap/store', log_directory, None,
+                                                    None)),
+            ('checkpoints', Client('backup', CONFIGURATION, '/var/vcap/store', log_directory, None, None))
+        ]
+        print('{:<18} {:>18} {:>18}'.format('', *[name for name, client in clients]))
+        for name, statement in STATEMENTS:
+            timings = [timeit.timeit(statement, globals={'client': client}, number=options.number) /
+                       options.number * 1e9 for client_name, client in clients]
+            print('{:<18} {:>15.1f} ns {:>15.1f} ns'.format(name, *timings))
+
+
+if __name__ == '__main__':
+    main()
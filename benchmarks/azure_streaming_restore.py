@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Benchmark of the streaming restore of AzureClient against a local stand-in for the Azure blob service.
+
+The stand-in server answers the few blob service requests the client sends. Every request is delayed by a fixed
+latency and every connection is throttled, which mimics the per-connection throughput limits of the real service.
+The blob is piped into `sha256sum` (standing in for the gpg/tar subprocess) once with a single sequential stream
+and once with parallel range reads.
+
+Usage (from the root of the repository):
+
+    python3 benchmarks/azure_streaming_restore.py --size 256 --latency 0.02 --bandwidth 32 --connections 8
+"""
+import argparse
+import email.utils
+import functools
+import hashlib
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from azure.storage.blob import BlockBlobService  # noqa: E402
+from lib.clients.AzureClient import AzureClient  # noqa: E402
+
+CONTAINER = 'backup-container'
+BLOB = 'backup.tar.gz.gpg'
+WRITE_SIZE = 64 * 1024
+
+
+class BlobServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    blobs = {}
+    latency = 0.0
+    bandwidth = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None, send_body=True):
+        time.sleep(self.latency)
+        self.send_response(status)
+        self.send_header('ETag', '"0x8D0000000000000"')
+        self.send_header('Last-Modified', email.utils.formatdate(usegmt=True))
+        self.send_header('x-ms-blob-type', 'BlockBlob')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not send_body:
+            return
+        for offset in range(0, len(body), WRITE_SIZE):
+            chunk = body[offset:offset + WRITE_SIZE]
+            self.wfile.write(chunk)
+            if self.bandwidth:
+                time.sleep(len(chunk) / self.bandwidth)
+
+    def _blob_name(self):
+        return self.path.split('?')[0].lstrip('/').split('/', 1)[-1]
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_HEAD(self):
+        if 'restype=container' in self.path:
+            return self._send(200)
+        blob = self.blobs.get(self._blob_name())
+        if blob is None:
+            return self._send(404)
+        self._send(200, blob, send_body=False)
+
+    def do_GET(self):
+        if 'restype=container' in self.path:
+            return self._send(200)
+        blob = self.blobs.get(self._blob_name())
+        if blob is None:
+            return self._send(404)
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('x-ms-range') or self.headers.get('Range') or '')
+        if not match:
+            return self._send(200, blob)
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(blob) - 1
+        end = min(end, len(blob) - 1)
+        self._send(206, blob[start:end + 1], {'Content-Range': 'bytes {}-{}/{}'.format(start, end, len(blob))})
+
+    def do_PUT(self):
+        self.blobs[self._blob_name()] = self._read_body()
+        self._send(201)
+
+    def do_DELETE(self):
+        self.blobs.pop(self._blob_name(), None)
+        self._send(202)
+
+
+def create_client(server_address, log_directory):
+    os.environ['SF_BACKUP_RESTORE_LOG_DIRECTORY'] = log_directory
+    os.environ['SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY'] = log_directory
+    configuration = {
+        'credhub_url': None,
+        'type': 'online',
+        'container': CONTAINER,
+        'client_id': 'client-id',
+        'client_secret': 'client-secret',
+        'tenant_id': 'tenant-id',
+        'resource_group': 'resource-group',
+        'storageAccount': 'account',
+        'storageAccessKey': 'a2V5',
+        'subscription_id': 'subscription-id'
+    }
+    blob_service = functools.partial(BlockBlobService, custom_domain='{}:{}'.format(*server_address),
+                                     protocol='http')
+    with mock.patch('lib.clients.AzureClient.ServicePrincipalCredentials'), \
+            mock.patch('lib.clients.AzureClient.BlockBlobService', blob_service):
+        return AzureClient('blob_operation', configuration, '/var/vcap/store', '/tmp', None, None)
+
+
+def run(name, pipe_blob, expected_digest, size):
+    process = subprocess.Popen('sha256sum', stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    start_time = time.time()
+    pipe_blob(process)
+    process.stdin.close()
+    digest = process.stdout.read().split()[0].decode()
+    process.wait()
+    duration = time.time() - start_time
+    assert digest == expected_digest, '{}: the restored data differs from the blob'.format(name)
+    print('{:<12} {:8.2f}s {:8.1f} MiB/s'.format(name, duration, size / (1024 * 1024) / duration))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=256, help='size of the blob in MiB (default: 256)')
+    parser.add_argument('--latency', type=float, default=0.02, help='latency per request in s (default: 0.02)')
+    parser.add_argument('--bandwidth', type=float, default=32,
+                        help='bandwidth per connection in MiB/s, 0 for unlimited (default: 32)')
+    parser.add_argument('--connections', type=int, default=8, help='parallel range reads (default: 8)')
+    parser.add_argument('--range-size', type=int, default=16, help='size of the range reads in MiB (default: 16)')
+    options = parser.parse_args()
+
+    blob = os.urandom(options.size * 1024 * 1024)
+    BlobServiceHandler.blobs[BLOB] = blob
+    BlobServiceHandler.latency = options.latency
+    BlobServiceHandler.bandwidth = options.bandwidth * 1024 * 1024 if options.bandwidth else None
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BlobServiceHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as log_directory:
+        client = create_client(server.server_address, log_directory)
+        client.transfer_configuration['download_range_size'] = options.range_size
+        expected_digest = hashlib.sha256(blob).hexdigest()
+
+        def sequential(process):
+            client.block_blob_service.get_blob_to_stream(CONTAINER, BLOB, process.stdin, max_connections=1)
+
+        def parallel(process):
+            client._download_from_blobstore_and_pipe_to_process(process, BLOB, 65536,
+                                                                max_connections=options.connections)
+
+        print('blob: {} MiB, latency: {}s, bandwidth per connection: {} MiB/s'.format(
+            options.size, options.latency, options.bandwidth or 'unlimited'))
+        run('sequential', sequential, expected_digest, len(blob))
+        run('parallel', parallel, expected_digest, len(blob))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
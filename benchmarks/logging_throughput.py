@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Benchmark of the agent logger: latency of a log call on the calling thread and throughput until the messages are
+written, with the records written by the calling thread (synchronous) or by the background thread (queued).
+
+Every mode runs in a fresh interpreter, which logs the given number of INFO messages of the given size to stdout
+(redirected to /dev/null) and a log file in a temporary directory, like the clients do (rotated every 5 MB). The throughput counts the time
+until the last message is written, i.e. including the time the background thread needs to empty the queue.
+
+Usage (from the root of the repository):
+
+    python3 benchmarks/logging_throughput.py --messages 100000 --size 200
+    python3 benchmarks/logging_throughput.py --queue_size 100
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Run in a fresh interpreter: logs the messages and reports the timings on stderr
+LOG_MESSAGES = '''
+import json, sys, time
+from lib.logger import init_logger, Logger
+
+class Client:
+    def last_operation(self, stage, state=None):
+        pass
+
+messages, size, queue_size, path = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+listener = init_logger(path, backup_count=1000, queue_size=queue_size)
+logger = Logger(Client())
+message = 'Uploaded part of blob "backup/tarball" ' + 'x' * size
+latencies = []
+started = time.perf_counter()
+for number in range(messages):
+    call_started = time.perf_counter()
+    logger.info(message)
+    latencies.append(time.perf_counter() - call_started)
+logged = time.perf_counter()
+if listener:
+    listener.stop()
+written = time.perf_counter()
+latencies.sort()
+sys.stderr.write(json.dumps({'logged': logged - started, 'written': written - started,
+                             'p50': latencies[len(latencies) // 2], 'p99': latencies[len(latencies) * 99 // 100],
+                             'max': latencies[-1]}) + '\\n')
+'''
+
+
+def measure(messages, size, queue_size, directory):
+    path = os.path.join(directory, 'benchmark-{}.log'.format(queue_size))
+    result = subprocess.run([sys.executable, '-c', LOG_MESSAGES, str(messages), str(size), str(queue_size), path],
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    timings = json.loads(result.stderr.strip().splitlines()[-1])
+    timings['lines'] = 0
+    for name in os.listdir(directory):
+        if name.startswith(os.path.basename(path)):
+            with open(os.path.join(directory, name)) as log_file:
+                timings['lines'] += sum(1 for _ in log_file)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the agent logger')
+    parser.add_argument('--messages', type=int, default=50000, help='the number of messages logged')
+    parser.add_argument('--size', type=int, default=100, help='the number of characters added to every message')
+    parser.add_argument('--queue_size', type=int, default=10000, help='the size of the queue of the queued mode')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    for name, queue_size in [('synchronous', 0), ('queued', args.queue_size)]:
+        timings = measure(args.messages, args.size, queue_size, directory)
+        print('{:<12} call p50 {:6.1f} us  p99 {:7.1f} us  max {:8.1f} us  |  {:9.0f} messages/s logged, '
+              '{:9.0f} messages/s written, {} of {} written'.format(
+                  name, timings['p50'] * 1e6, timings['p99'] * 1e6, timings['max'] * 1e6,
+                  args.messages / timings['logged'], args.messages / timings['written'], timings['lines'],
+                  args.messages))
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Benchmark of the cold start of the IaaS clients: import time of the provider modules and time to the first API call.
+
+Every measurement runs in a fresh interpreter. The import time is taken from `python -X importtime -c 'import
+lib.clients.<Provider>Client'`, which also lists the largest third-party packages imported by the module. The time to
+the first API call is the time from starting the interpreter until the client, created for the given operation with
+dummy credentials, resolves or connects to the first host; the process exits right there, so no request leaves the
+machine.
+
+Usage (from the root of the repository):
+
+    python3 benchmarks/startup.py --operation blob_operation --repeat 5
+    python3 benchmarks/startup.py --provider gcp --provider openstack --operation backup
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PROVIDERS = ['aws', 'azure', 'gcp', 'openstack', 'ali']
+
+CONFIGURATION = {
+    'credhub_url': None,
+    'type': 'online',
+    'backup_guid': 'backup-guid',
+    'instance_id': 'vm-id',
+    'secret': 'secret',
+    'job_name': 'service-job-name',
+    'trigger': 'on-demand-or-scheduled',
+    'container': 'backup-container',
+    'max_retries': 0
+}
+
+CREDENTIALS = {
+    'aws': {'access_key_id': 'key-id', 'secret_access_key': 'secret', 'region_name': 'eu-central-1'},
+    'azure': {'client_id': 'client-id', 'client_secret': 'secret', 'tenant_id': 'tenant-id',
+              'subscription_id': 'subscription-id', 'resource_group': 'resource-group',
+              'storageAccount': 'account', 'storageAccessKey': 'a2V5'},
+    'gcp': {'projectId': 'project-id'},
+    'openstack': {'username': 'user', 'password': 'secret', 'auth_url': 'https://keystone.example.com/v3',
+                  'user_domain_name': 'domain', 'tenant_id': 'tenant-id', 'tenant_name': 'tenant'},
+    'ali': {'access_key_id': 'key-id', 'secret_access_key': 'secret', 'region_name': 'eu-central-1',
+            'endpoint': 'https://oss-eu-central-1.aliyuncs.com'}
+}
+
+# Run in a fresh interpreter: creates the client and exits on its first name resolution or connection
+FIRST_API_CALL = '''
+import importlib, json, os, socket, sys, time
+started = float(sys.argv[1])
+
+def first_api_call(*args, **kwargs):
+    sys.stdout.write(json.dumps({'seconds': time.time() - started, 'modules': len(sys.modules)}) + '\\n')
+    sys.stdout.flush()
+    os._exit(0)
+
+socket.getaddrinfo = first_api_call
+socket.socket.connect = first_api_call
+iaas = sys.argv[2].title() + 'Client'
+client_class = getattr(importlib.import_module('lib.clients.' + iaas), iaas)
+client_class(sys.argv[3], json.loads(sys.argv[4]), '/var/vcap/store', [sys.argv[5]], 1, 10)
+sys.stdout.write(json.dumps({'error': 'The client was created without any API call.'}) + '\\n')
+'''
+
+
+def gcp_credentials():
+    # The service account credentials are parsed, so they need a well-formed private key
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption()).decode('utf-8')
+    return json.dumps({'type': 'service_account', 'project_id': 'project-id', 'private_key_id': 'key-id',
+                       'private_key': pem, 'client_email': 'backup@project-id.iam.gserviceaccount.com',
+                       'client_id': 'client-id', 'token_uri': 'https://oauth2.googleapis.com/token'})
+
+
+def configuration_of(provider):
+    configuration = dict(CONFIGURATION, iaas=provider, **CREDENTIALS[provider])
+    if provider == 'gcp':
+        configuration['credentials'] = gcp_credentials()
+    return configuration
+
+
+def measure_import(provider):
+    module = 'lib.clients.{}Client'.format(provider.title())
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    total = 0
+    packages = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)', line)
+        if not match:
+            continue
+        cumulative, name = int(match.group(2)), match.group(4)
+        if name == module:
+            total = cumulative
+        package = name.split('.')[0]
+        if package not in sys.stdlib_module_names and package != 'lib':
+            packages[package] = max(packages.get(package, 0), cumulative)
+    return total / 1e6, sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+def measure_first_api_call(provider, operation, configuration, directory):
+    env = dict(os.environ, SF_BACKUP_RESTORE_LOG_DIRECTORY=directory,
+               SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY=directory)
+    result = subprocess.run([sys.executable, '-c', FIRST_API_CALL, str(time.time()), provider, operation,
+                             json.dumps(configuration), directory], cwd=ROOT, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    lines = result.stdout.strip().splitlines()
+    answer = json.loads(lines[-1]) if lines else {}
+    if 'seconds' not in answer:
+        raise Exception(answer.get('error') or result.stderr.strip().splitlines()[-1])
+    return answer['seconds'], answer['modules']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the cold start of the IaaS clients')
+    parser.add_argument('--provider', action='append', choices=PROVIDERS,
+                        help='a provider to measure (repeatable, default: all)')
+    parser.add_argument('--operation', default='blob_operation', choices=['backup', 'restore', 'blob_operation'],
+                        help='the operation the client is created for (default: blob_operation)')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of measurements, the median is reported')
+    parser.add_argument('--top', type=int, default=5, help='the number of largest imported packages listed')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    for provider in args.provider or PROVIDERS:
+        imports = [measure_import(provider) for _ in range(args.repeat)]
+        import_time = statistics.median(seconds for seconds, packages in imports)
+        packages = ', '.join('{} {:.0f} ms'.format(package, microseconds / 1e3)
+                             for package, microseconds in imports[-1][1][:args.top])
+        print('{:<10} import {:7.1f} ms  ({})'.format(provider, import_time * 1e3, packages))
+        try:
+            configuration = configuration_of(provider)
+            calls = [measure_first_api_call(provider, args.operation, configuration, directory)
+                     for _ in range(args.repeat)]
+            print('{:<10} first API call of {} after {:7.1f} ms with {} modules loaded'.format(
+                '', args.operation, statistics.median(seconds for seconds, modules in calls) * 1e3, calls[-1][1]))
+        except Exception as error:
+            print('{:<10} first API call of {} not measured: {}'.format('', args.operation, error))
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
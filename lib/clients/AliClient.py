@@ -1,8 +1,9 @@
 import oss2
 from oss2.headers import RequestHeader
+from oss2.models import PartInfo
+from functools import cached_property
 from .BaseClient import BaseClient
-from aliyunsdkcore.request import CommonRequest
-from aliyunsdkcore.client import AcsClient
+from ..utils.lazy_import import LazyAttribute
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
@@ -10,24 +11,21 @@ from .. import constants
 
 import json
 
+# The compute SDK is only imported once the compute client is used (not by blob operations)
+CommonRequest = LazyAttribute('aliyunsdkcore.request', 'CommonRequest')
+AcsClient = LazyAttribute('aliyunsdkcore.client', 'AcsClient')
+
 class AliClient(BaseClient):
     def __init__(self, operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time,
                  poll_maximum_time):
         super(AliClient, self).__init__(operation_name, configuration, directory_persistent, directory_work_list,
                                         poll_delay_time, poll_maximum_time)
-        if configuration['credhub_url'] is None:
-            self.__setCredentials(
-                configuration['access_key_id'], configuration['secret_access_key'], configuration['region_name'])
-        else:
-            credentials = self._get_credentials_from_credhub(configuration)
-            self.__setCredentials(
-                credentials['access_key_id'], credentials['secret_access_key'], credentials['region_name'])
+        self.__readCredentials(configuration)
         self.endpoint = configuration['endpoint']
         self.max_retries = (configuration.get('max_retries') if
                             type(configuration.get('max_retries'))
                             == int else 10)
-        # +-> Create compute and storage clients
-        self.compute_client = self.create_compute_client()
+        # +-> Create the storage client (the compute client is created on first use)
         self.storage_client = self.create_storage_client()
 
         # +-> Check whether the given container exists
@@ -47,6 +45,15 @@ class AliClient(BaseClient):
                 self.last_operation(msg, 'failed')
                 raise Exception(msg)
 
+    def __readCredentials(self, configuration):
+        if configuration['credhub_url'] is None:
+            self.__setCredentials(
+                configuration['access_key_id'], configuration['secret_access_key'], configuration['region_name'])
+        else:
+            credentials = self._get_credentials_from_credhub(configuration)
+            self.__setCredentials(
+                credentials['access_key_id'], credentials['secret_access_key'], credentials['region_name'])
+
     def __setCredentials(self, access_key_id, secret_access_key, region_name):
         self.__aliCredentials = {
             'access_key_id': access_key_id,
@@ -54,6 +61,20 @@ class AliClient(BaseClient):
             'region_name': region_name
         }
 
+    def refresh_credentials(self, configuration):
+        self.__readCredentials(configuration)
+        self.storage_client = self.create_storage_client()
+        container = self.get_container()
+        if not container:
+            raise Exception('Could not find or access the given container.')
+        self.container = container
+        # The compute client is created again on next use
+        self.__dict__.pop('compute_client', None)
+
+    @cached_property
+    def compute_client(self):
+        return self.create_compute_client()
+
     def create_compute_client(self):
         try:
             credentials = self.__aliCredentials
@@ -143,6 +164,52 @@ class AliClient(BaseClient):
                 self.logger.error(message)
                 raise Exception(message)
 
+    def _upload_stream_to_blobstore(self, stream, blob_target_name):
+        log_prefix = '[OSS] [UPLOAD]'
+        part_size = (1 << 27) # 128 MiB part size
+
+        if self.container:
+            self.logger.info(
+                '{} Started to stream the tarball to the object storage.'.format(log_prefix))
+            upload_id = None
+            try:
+                requestHeader = RequestHeader()
+                requestHeader.set_server_side_encryption("AES256")
+                upload_id = self.container.init_multipart_upload(
+                    blob_target_name, headers=requestHeader).upload_id
+                parts = []
+                data = stream.read(part_size)
+                # An empty stream still needs one (empty) part to complete the upload
+                while data or not parts:
+                    part_number = len(parts) + 1
+                    result = self.container.upload_part(
+                        blob_target_name, upload_id, part_number, data)
+                    parts.append(PartInfo(part_number, result.etag))
+                    data = stream.read(part_size)
+                self.container.complete_multipart_upload(
+                    blob_target_name, upload_id, parts)
+                self.logger.info('{} SUCCESS: blob_target_name={}, container={}, parts={}'
+                                 .format(log_prefix, blob_target_name, self.CONTAINER, len(parts)))
+                return True
+            except Exception as error:
+                message = '{} ERROR: blob_target_name={}, container={}\n{}'.format(
+                    log_prefix, blob_target_name, self.CONTAINER, error)
+                self.logger.error(message)
+                if upload_id:
+                    try:
+                        self.container.abort_multipart_upload(blob_target_name, upload_id)
+                    except Exception as abort_error:
+                        self.logger.error('{} ERROR: Could not abort multipart upload {}\n{}'.format(
+                            log_prefix, upload_id, abort_error))
+                raise Exception(message)
+
+    def _get_blob_size(self, blob_name):
+        return self.container.head_object(blob_name).content_length
+
+    def _get_blob_range(self, blob_name, offset, length):
+        # The end of the range is inclusive
+        return self.container.get_object(blob_name, byte_range=(offset, offset + length - 1)).read()
+
     def _download_from_blobstore(self, blob_to_download_name, blob_download_target_path):
         log_prefix = '[OSS] [DOWNLOAD]'
 
@@ -150,8 +217,13 @@ class AliClient(BaseClient):
             self.logger.info('{} Started to download the tarball to target{}.'
                              .format(log_prefix, blob_download_target_path))
             try:
-                self.container.get_object_to_file(
-                    blob_to_download_name, blob_download_target_path)
+                blob_size = self._get_blob_size(blob_to_download_name)
+                if self._use_ranged_download(blob_size):
+                    with open(blob_download_target_path, 'wb') as downloaded_file:
+                        self._download_blob_in_ranges(blob_to_download_name, blob_size, downloaded_file.write)
+                else:
+                    self.container.get_object_to_file(
+                        blob_to_download_name, blob_download_target_path)
                 self.logger.info('{} SUCCESS: blob_to_download={}, blob_target_name={}, container={}'.format(
                     log_prefix, blob_to_download_name, blob_download_target_path, self.CONTAINER))
                 return True
@@ -161,6 +233,11 @@ class AliClient(BaseClient):
                 self.logger.error(message)
                 raise Exception(message)
 
+    def _download_from_blobstore_and_pipe_to_process(self, process, blob_to_download_name, segment_size):
+        blob_size = self._get_blob_size(blob_to_download_name)
+        self._download_blob_in_ranges(blob_to_download_name, blob_size, process.stdin.write)
+        return True
+
     def _create_snapshot(self, volume_id, description='Service-Fabrik: Automated backup'):
         log_prefix = '[SNAPSHOT] [CREATE]'
         snapshot = None
@@ -178,10 +255,11 @@ class AliClient(BaseClient):
             snapshot_creation_operation = self.compute_client.do_action_with_exception(snpshot_creation_request)
             snapshot_details_json = json.loads(snapshot_creation_operation.decode('utf-8'))
             snapshot_id = snapshot_details_json['SnapshotId']
-            self._wait('Waiting for snapshot {} to get ready...'.format(snapshot_name),
-                       (lambda snapshot_id: self._is_snapshot_ready(snapshot_id)),
-                       None,
-                       snapshot_id)
+            self._wait_batched(self._get_snapshot_lists, snapshot_id,
+                               self._is_snapshot_list_ready,
+                               'Waiting for snapshot {} to get ready...'.format(snapshot_name),
+                               resource_type='snapshot.create',
+                               ignore_errors=True)
 
             snapshot = self._get_snapshot(snapshot_id)
             if snapshot.status == 'accomplished':
@@ -205,16 +283,26 @@ class AliClient(BaseClient):
         return snapshot
 
     def _get_snapshot_list(self, snapshot_id):
+        return self._get_snapshot_lists([snapshot_id])[snapshot_id]
+
+    def _get_snapshot_lists(self, snapshot_ids):
+        # One DescribeSnapshots request for all given snapshots (up to 100), grouped by snapshot id
         region_id = self.__aliCredentials['region_name']
         get_snapshot_req_params = {
-            'PageSize' : 10,
+            'PageSize' : max(10, len(snapshot_ids)),
             'RegionId' : region_id,
-            'SnapshotIds' : [snapshot_id]
+            'SnapshotIds' : snapshot_ids
         }
         get_snapshot_request = self._get_common_compute_request('DescribeSnapshots', get_snapshot_req_params)
         snapshot_details = self.compute_client.do_action_with_exception(get_snapshot_request)
         snapshot_details_json = json.loads(snapshot_details.decode('utf-8'))
-        return snapshot_details_json['Snapshots']['Snapshot']
+        snapshot_list = snapshot_details_json['Snapshots']['Snapshot']
+        if len(snapshot_ids) == 1:
+            return {snapshot_ids[0]: snapshot_list}
+        snapshot_lists = {snapshot_id: [] for snapshot_id in snapshot_ids}
+        for snapshot in snapshot_list:
+            snapshot_lists.setdefault(snapshot['SnapshotId'], []).append(snapshot)
+        return snapshot_lists
     
     def _get_snapshot(self, snapshot_id):
         try:
@@ -244,15 +332,18 @@ class AliClient(BaseClient):
         # Hence handling at our part
         # Retries for failures also
         try:
-            snapshot_list = self._get_snapshot_list(snapshot_id)
-            if len(snapshot_list) > 1 or (len(snapshot_list) == 1 and snapshot_list[0]['Status'] in ('accomplished','failed')):
-                return True
-            return False
+            return self._is_snapshot_list_ready(self._get_snapshot_list(snapshot_id))
         except Exception as error:
             self.logger.error(
                 '[ALI] ERROR: Unable to get snapshot details for snapshot id {}.\n{}'.format(snapshot_id, error))
             return False
 
+    @staticmethod
+    def _is_snapshot_list_ready(snapshot_list):
+        snapshot_list = snapshot_list or []
+        return len(snapshot_list) > 1 or \
+            (len(snapshot_list) == 1 and snapshot_list[0]['Status'] in ('accomplished', 'failed'))
+
     def _delete_snapshot(self, snapshot_id):
         log_prefix = '[SNAPSHOT] [DELETE]'
         try:
@@ -267,10 +358,10 @@ class AliClient(BaseClient):
             snpshot_deletion_request = self._get_common_compute_request('DeleteSnapshot', snapshot_deletion_req_params)
             snapshot_deletion_operation = self.compute_client.do_action_with_exception(snpshot_deletion_request)
 
-            self._wait('Waiting for snapshot {} to be deleted...'.format(snapshot_id),
-                       lambda snapshot_id: len(self._get_snapshot_list(snapshot_id)) == 0,
-                       None,
-                       snapshot_id)
+            self._wait_batched(self._get_snapshot_lists, snapshot_id,
+                               lambda snapshot_list: not snapshot_list,
+                               'Waiting for snapshot {} to be deleted...'.format(snapshot_id),
+                               resource_type='snapshot.delete')
             
             self._remove_snapshot(snapshot_id)
             self.logger.info(
@@ -314,12 +405,15 @@ class AliClient(BaseClient):
             return []
 
     def get_persistent_volume_for_instance(self, instance_id):
-        device = self.shell(
-            'cat {} | grep {}'.format(self.FILE_MOUNTS, self.DIRECTORY_PERSISTENT)).split(' ')[0][:8]
+        disk = self.device_inventory.get_disk_of(
+            self.device_inventory.get_mount_device(self.DIRECTORY_PERSISTENT))
+        if not disk:
+            return None
+        device = disk.path
         # --> /dev/vdb on machine will be /dev/xvdb on AliCloud for "I/O Optimized" instances
         # --> https://www.alibabacloud.com/help/doc-detail/25426.htm
         device = device.replace('/v', '/xv')
-        for volume in self.get_attached_volumes_for_instance(instance_id):
+        for volume in self._get_attached_volumes(instance_id):
             if volume.device == device:
                 self._add_volume_device(volume.id, device)
                 return volume
@@ -334,30 +428,42 @@ class AliClient(BaseClient):
         # Returns True if multiple volumes with same id are found
         # Retries for failures also
         try:
-            volume_list = self._get_volume_list(disk_id)
-            if len(volume_list) > 1:
-                return True
-            if len(volume_list) == 1 and volume_list[0]['Status'] in ('Available', 'In_use'):
-                if attached_vol and volume_list[0]['Status'] != 'In_use':
-                    return False
-                return True
-            return False
+            return self._is_volume_list_ready(self._get_volume_list(disk_id), attached_vol)
         except Exception as error:
             self.logger.error(
                 '[ALI] ERROR: Unable to get volume details for volume id {}.\n{}'.format(disk_id, error))
             return False
 
+    @staticmethod
+    def _is_volume_list_ready(volume_list, attached_vol=False):
+        volume_list = volume_list or []
+        if len(volume_list) > 1:
+            return True
+        if len(volume_list) == 1 and volume_list[0]['Status'] in ('Available', 'In_use'):
+            return not attached_vol or volume_list[0]['Status'] == 'In_use'
+        return False
+
     def _get_volume_list(self, volume_id):
+        return self._get_volume_lists([volume_id])[volume_id]
+
+    def _get_volume_lists(self, volume_ids):
+        # One DescribeDisks request for all given disks (up to 100), grouped by disk id
         region_id = self.__aliCredentials['region_name']
         get_volume_req_params = {
-            'PageSize' : 10,
+            'PageSize' : max(10, len(volume_ids)),
             'RegionId' : region_id,
-            'DiskIds' : [volume_id]
+            'DiskIds' : volume_ids
         }
         get_volume_request = self._get_common_compute_request('DescribeDisks', get_volume_req_params)
         volume_details = self.compute_client.do_action_with_exception(get_volume_request)
         volume_details_json = json.loads(volume_details.decode('utf-8'))
-        return volume_details_json['Disks']['Disk']
+        volume_list = volume_details_json['Disks']['Disk']
+        if len(volume_ids) == 1:
+            return {volume_ids[0]: volume_list}
+        volume_lists = {volume_id: [] for volume_id in volume_ids}
+        for volume in volume_list:
+            volume_lists.setdefault(volume['DiskId'], []).append(volume)
+        return volume_lists
 
     def _get_volume(self, volume_id):
         try:
@@ -399,10 +505,11 @@ class AliClient(BaseClient):
             volume_details_json = json.loads(disk_creation_operation.decode('utf-8'))
             disk_id = volume_details_json['DiskId']
 
-            self._wait('Waiting for volume {} to get ready...'.format(disk_name),
-                       (lambda disk_id: self._is_volume_ready(disk_id)),
-                       None,
-                       disk_id)
+            self._wait_batched(self._get_volume_lists, disk_id,
+                               self._is_volume_list_ready,
+                               'Waiting for volume {} to get ready...'.format(disk_name),
+                               resource_type='volume.create',
+                               ignore_errors=True)
 
             volume = self._get_volume(disk_id)
             if volume.status in ('Available', 'In_use'):
@@ -431,10 +538,10 @@ class AliClient(BaseClient):
             volume_deletion_request = self._get_common_compute_request('DeleteDisk', volume_deletion_req_params)
             volume_deletion_operation = self.compute_client.do_action_with_exception(volume_deletion_request)
 
-            self._wait('Waiting for disk {} to be deleted...'.format(volume_id),
-                       lambda volume_id: len(self._get_volume_list(volume_id)) == 0,
-                       None,
-                       volume_id)
+            self._wait_batched(self._get_volume_lists, volume_id,
+                               lambda volume_list: not volume_list,
+                               'Waiting for disk {} to be deleted...'.format(volume_id),
+                               resource_type='volume.delete')
             self._remove_volume(volume_id)
             self.logger.info(
                 '{} SUCCESS: volume-id={}'.format(
@@ -481,10 +588,11 @@ class AliClient(BaseClient):
             attachment_request = self._get_common_compute_request('AttachDisk', attachment_req_params)
             attachment_creation_operation = self.compute_client.do_action_with_exception(attachment_request)
             
-            self._wait('Waiting for volume {} to get ready...'.format(volume_id),
-                       (lambda volume_id: self._is_volume_ready(volume_id, True)),
-                       None,
-                       volume_id)
+            self._wait_batched(self._get_volume_lists, volume_id,
+                               lambda volume_list: self._is_volume_list_ready(volume_list, True),
+                               'Waiting for volume {} to get ready...'.format(volume_id),
+                               resource_type='attachment.create',
+                               ignore_errors=True)
             
             # Raise exception if device returned in None,
             # as it might mean that disk was not attached properly
@@ -530,10 +638,11 @@ class AliClient(BaseClient):
             delete_attachment_request = self._get_common_compute_request('DetachDisk', delete_attachment_req_params)
             attachment_deletion_operation = self.compute_client.do_action_with_exception(delete_attachment_request)
             
-            self._wait('Waiting for attachment of volume {} to be deleted...'.format(volume_id),
-                       (lambda disk_id: self._is_volume_ready(volume_id)),
-                       None,
-                       volume_id)
+            self._wait_batched(self._get_volume_lists, volume_id,
+                               self._is_volume_list_ready,
+                               'Waiting for attachment of volume {} to be deleted...'.format(volume_id),
+                               resource_type='attachment.delete',
+                               ignore_errors=True)
             
             self._remove_volume_device(volume_id)
             self._remove_attachment(volume_id, instance_id)
@@ -1,9 +1,20 @@
+import os
+import time
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 from botocore.config import Config
 from .BaseClient import BaseClient
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
+from ..constants import MIB
+
+# Limits of S3 multipart uploads
+S3_MAX_PARTS = 10000
+S3_MIN_PART_SIZE = 5 * MIB
+S3_MAX_PART_SIZE = 5 * 1024 * MIB
 
 
 class AwsClient(BaseClient):
@@ -11,14 +22,15 @@ class AwsClient(BaseClient):
                  poll_maximum_time):
         super(AwsClient, self).__init__(operation_name, configuration, directory_persistent, directory_work_list,
                                         poll_delay_time, poll_maximum_time)
-        if configuration['credhub_url'] is None:
-            self.__setCredentials(
-                configuration['access_key_id'], configuration['secret_access_key'], configuration['region_name'])
-        else:
-            self.logger.info('fetching creds from credhub')
-            credentials = self._get_credentials_from_credhub(configuration)
-            self.__setCredentials(
-                credentials['access_key_id'], credentials['secret_access_key'], credentials['region_name'])
+        # +-> Check whether the configured part size is accepted by S3
+        part_size = self.transfer_configuration['upload_part_size'] * MIB
+        if not S3_MIN_PART_SIZE <= part_size <= S3_MAX_PART_SIZE:
+            msg = 'The upload part size must be between {} and {} MiB.'.format(S3_MIN_PART_SIZE // MIB,
+                                                                               S3_MAX_PART_SIZE // MIB)
+            self.last_operation(msg, 'failed')
+            raise Exception(msg)
+
+        self.__readCredentials(configuration)
 
         self.max_retries = (configuration.get('max_retries') if
                             type(configuration.get('max_retries'))
@@ -29,6 +41,7 @@ class AwsClient(BaseClient):
             self.ec2 = self.create_ec2_resource()
             self.ec2.client = self.create_ec2_client()
             self.formatted_tags = self.format_tags()
+            self.__root_device_names = {}
 
         # add config for s3
         self.s3_config = Config(retries={'max_attempts': self.max_retries})
@@ -50,6 +63,16 @@ class AwsClient(BaseClient):
                 self.last_operation(msg, 'failed')
                 raise Exception(msg)
 
+    def __readCredentials(self, configuration):
+        if configuration['credhub_url'] is None:
+            self.__setCredentials(
+                configuration['access_key_id'], configuration['secret_access_key'], configuration['region_name'])
+        else:
+            self.logger.info('fetching creds from credhub')
+            credentials = self._get_credentials_from_credhub(configuration)
+            self.__setCredentials(
+                credentials['access_key_id'], credentials['secret_access_key'], credentials['region_name'])
+
     def __setCredentials(self, access_key_id, secret_access_key, region_name):
         self.__awsCredentials = {
             'access_key_id': access_key_id,
@@ -57,6 +80,23 @@ class AwsClient(BaseClient):
             'region_name': region_name
         }
 
+    def refresh_credentials(self, configuration):
+        self.__readCredentials(configuration)
+        if self.OPERATION != 'blob_operation':
+            self.ec2 = self.create_ec2_resource()
+            self.ec2.client = self.create_ec2_client()
+        self.s3 = self.create_s3_resource()
+        self.s3.client = self.create_s3_client()
+        container = self.get_container()
+        if not container:
+            raise Exception('Could not find or access the given container.')
+        self.container = container
+
+    def reconfigure(self, configuration):
+        super(AwsClient, self).reconfigure(configuration)
+        if self.OPERATION != 'blob_operation':
+            self.formatted_tags = self.format_tags()
+
     def format_tags(self):
         return [{'Key': key, 'Value': value} for key, value in self.tags.items()]
 
@@ -124,50 +164,82 @@ class AwsClient(BaseClient):
         except:
             return None
 
+    def _get_root_device_name(self, instance_id):
+        # The root device of an instance does not change, hence it is looked up once
+        if instance_id not in self.__root_device_names:
+            instance = self.ec2.Instance(instance_id)
+            instance.load()
+            self.__root_device_names[instance_id] = instance.root_device_name
+        return self.__root_device_names[instance_id]
+
     def get_attached_volumes_for_instance(self, instance_id):
-        instance = self.ec2.Instance(instance_id)
+        # One request (per page) for all volumes with their sizes instead of one per attached volume
         try:
-            return [Volume(details['VolumeId'], 'none', self.ec2.Volume(details['VolumeId']).size, details['Device'])
-                    for volumes in instance.volumes.all()
-                    for details in volumes.attachments]
+            volumes = []
+            parameters = {'Filters': [{'Name': 'attachment.instance-id', 'Values': [instance_id]}]}
+            while True:
+                response = self.ec2.client.describe_volumes(**parameters)
+                volumes += [Volume(volume['VolumeId'], 'none', volume['Size'], attachment['Device'])
+                            for volume in response['Volumes']
+                            for attachment in volume['Attachments'] if attachment['InstanceId'] == instance_id]
+                if not response.get('NextToken'):
+                    return volumes
+                parameters['NextToken'] = response['NextToken']
         except:
             return []
 
     def has_nvme_persistent_volume(self):
-        device = self.shell(
-            'cat /proc/mounts | grep {}'.format(self.DIRECTORY_PERSISTENT))
+        device = self.device_inventory.get_mount_device(self.DIRECTORY_PERSISTENT)
         nvme_dev_pattern = '/dev/nvme'
-        if nvme_dev_pattern in device:
+        if device and nvme_dev_pattern in device:
             return True
         else:
             return False    
 
+    def _get_volume_id_of_nvme_disk(self, disk):
+        # The serial number of an EBS NVMe device is the volume id without hyphen, e.g. vol0123456789abcdef0
+        if not disk.serial or not disk.serial.startswith('vol'):
+            return None
+        return 'vol-' + disk.serial[3:].lstrip('-')
+
     def get_persistent_volume_for_instance(self, instance_id):
         if self.has_nvme_persistent_volume() == True:
-            device = self.shell('cat /proc/mounts | grep {}'.format(self.DIRECTORY_PERSISTENT)).split(' ')[0][:14]
-            vol_id = self.shell("nvme id-ctrl -v {} | egrep -wo 'vol.*'".format(device))
-            vol_id = "vol-" + vol_id.split("vol")[1]
-            vol_id = vol_id.rstrip("\n")
+            disk = self.device_inventory.get_disk_of(
+                self.device_inventory.get_mount_device(self.DIRECTORY_PERSISTENT))
+            device = disk.path
+            vol_id = self._get_volume_id_of_nvme_disk(disk)
             self.logger.info('Found volume id {} for device {}'.format(vol_id, device))
-            for volume in self.get_attached_volumes_for_instance(instance_id):
+            for volume in self._get_attached_volumes(instance_id):
                 if volume.id == vol_id:
                     self._add_volume_device(volume.id, device)
                     return volume
             return None
         else:
-            device = self.shell(
-                'cat /proc/mounts | grep {}'.format(self.DIRECTORY_PERSISTENT)).split(' ')[0][:9]
+            disk = self.device_inventory.get_disk_of(
+                self.device_inventory.get_mount_device(self.DIRECTORY_PERSISTENT))
+            if not disk:
+                return None
+            device = disk.path
             # http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/device_naming.html
             # --> /dev/xvdk on machine will be /dev/sdk on AWS
             device = device.replace('xv', 's')
 
-            for volume in self.get_attached_volumes_for_instance(instance_id):
+            for volume in self._get_attached_volumes(instance_id):
                 if volume.device == device:
                     self._add_volume_device(volume.id, device)
                     return volume
 
             return None
 
+    # Filters (unlike SnapshotIds/VolumeIds) do not fail the whole request if one of the resources does not exist
+    def _describe_snapshots(self, snapshot_ids):
+        response = self.ec2.client.describe_snapshots(Filters=[{'Name': 'snapshot-id', 'Values': snapshot_ids}])
+        return {snapshot['SnapshotId']: snapshot for snapshot in response['Snapshots']}
+
+    def _describe_volumes(self, volume_ids):
+        response = self.ec2.client.describe_volumes(Filters=[{'Name': 'volume-id', 'Values': volume_ids}])
+        return {volume['VolumeId']: volume for volume in response['Volumes']}
+
     def _create_snapshot(self, volume_id, description='Service-Fabrik: Automated backup'):
         log_prefix = '[SNAPSHOT] [CREATE]'
         snapshot = None
@@ -179,13 +251,13 @@ class AwsClient(BaseClient):
                 Description=description
             )
 
-            self._wait('Waiting for snapshot {} to get ready...'.format(snapshot.id),
-                       lambda snap: snap.state == 'completed',
-                       snapshot.reload,
-                       snapshot)
+            status = self._wait_batched(self._describe_snapshots, snapshot.id,
+                                        lambda snap: snap is not None and snap['State'] == 'completed',
+                                        'Waiting for snapshot {} to get ready...'.format(snapshot.id),
+                                        resource_type='snapshot.create')
 
             snapshot = Snapshot(
-                snapshot.id, snapshot.volume_size, snapshot.start_time, snapshot.state)
+                snapshot.id, status['VolumeSize'], status['StartTime'], status['State'])
             self._add_snapshot(snapshot.id)
 
             self.ec2.create_tags(
@@ -208,6 +280,70 @@ class AwsClient(BaseClient):
 
         return snapshot
 
+    def _create_snapshots(self, volume_ids, description='Service-Fabrik: Automated backup'):
+        # CreateSnapshots takes crash-consistent snapshots of the volumes attached to an instance at the same point
+        # in time. The attached volumes which were not asked for are excluded.
+        log_prefix = '[SNAPSHOT] [CREATE] [GROUP]'
+        # The boot volume is excluded by ExcludeBootVolume; ExcludeDataVolumeIds rejects it
+        root_device_name = self._get_root_device_name(self.INSTANCE_ID)
+        attached_volume_ids = [volume.id for volume in self._get_attached_volumes(self.INSTANCE_ID)
+                               if volume.device != root_device_name]
+        if not set(volume_ids) <= set(attached_volume_ids):
+            self.logger.info('{} Volumes {} are not all attached to instance {}, snapshotting them one by one.'.format(
+                log_prefix, volume_ids, self.INSTANCE_ID))
+            return super(AwsClient, self)._create_snapshots(volume_ids, description)
+
+        self.logger.info('{} START for volume ids {} of instance {} with tags {}'.format(
+            log_prefix, volume_ids, self.INSTANCE_ID, self.formatted_tags))
+        snapshot_ids = []
+        try:
+            response = self.ec2.client.create_snapshots(
+                InstanceSpecification={
+                    'InstanceId': self.INSTANCE_ID,
+                    'ExcludeBootVolume': True,
+                    'ExcludeDataVolumeIds': [volume_id for volume_id in attached_volume_ids
+                                             if volume_id not in volume_ids]
+                },
+                Description=description,
+                TagSpecifications=[{'ResourceType': 'snapshot', 'Tags': self.formatted_tags}]
+            )
+            snapshot_ids_by_volume = {snapshot['VolumeId']: snapshot['SnapshotId']
+                                      for snapshot in response['Snapshots']}
+            snapshot_ids = list(snapshot_ids_by_volume.values())
+            # Registered right away, so that an abortion or a failed wait cleans up all snapshots of the group
+            for snapshot_id in snapshot_ids:
+                self._add_snapshot(snapshot_id)
+            missing_volume_ids = [volume_id for volume_id in volume_ids if volume_id not in snapshot_ids_by_volume]
+            if missing_volume_ids:
+                raise Exception('No snapshots were created for volumes {}.'.format(missing_volume_ids))
+
+            # The waits share one describe request per tick
+            with ThreadPoolExecutor(max_workers=len(volume_ids)) as executor:
+                futures = [executor.submit(self._wait_batched, self._describe_snapshots,
+                                           snapshot_ids_by_volume[volume_id],
+                                           lambda snap: snap is not None and snap['State'] == 'completed',
+                                           'Waiting for snapshot {} to get ready...'.format(
+                                               snapshot_ids_by_volume[volume_id]),
+                                           resource_type='snapshot.create')
+                           for volume_id in volume_ids]
+            snapshots = []
+            for volume_id, future in zip(volume_ids, futures):
+                status = future.result()
+                snapshots.append(Snapshot(snapshot_ids_by_volume[volume_id], status['VolumeSize'],
+                                          status['StartTime'], status['State']))
+
+            self.logger.info('{} SUCCESS: snapshot-ids={}, volume-ids={} with tags {}'.format(
+                log_prefix, [snapshot.id for snapshot in snapshots], volume_ids, self.formatted_tags))
+        except Exception as error:
+            message = '{} ERROR: volume-ids={} and tags={}\n{}'.format(
+                log_prefix, volume_ids, self.formatted_tags, error)
+            self.logger.error(message)
+            for snapshot_id in snapshot_ids:
+                self.delete_snapshot(snapshot_id)
+            raise Exception(message)
+
+        return snapshots
+
     def _copy_snapshot(self, snapshot_id):
         log_prefix = '[SNAPSHOT] [COPY]'
         snapshot = None
@@ -221,13 +357,13 @@ class AwsClient(BaseClient):
             )
             new_snapshot = self.ec2.Snapshot(snapshot['SnapshotId'])
 
-            self._wait('Waiting for snapshot {} to get ready...'.format(new_snapshot.id),
-                       lambda snap: snap.state == 'completed',
-                       new_snapshot.reload,
-                       new_snapshot)
+            status = self._wait_batched(self._describe_snapshots, new_snapshot.id,
+                                        lambda snap: snap is not None and snap['State'] == 'completed',
+                                        'Waiting for snapshot {} to get ready...'.format(new_snapshot.id),
+                                        resource_type='snapshot.copy')
 
             snapshot = Snapshot(
-                new_snapshot.id, new_snapshot.volume_size, new_snapshot.start_time, new_snapshot.state)
+                new_snapshot.id, status['VolumeSize'], status['StartTime'], status['State'])
             self.logger.info('{} SUCCESS: snapshot-id={}, unencrypted-snapshot_id={}'.format(
                 log_prefix, snapshot.id, snapshot_id))
             self.output_json['snapshotId'] = snapshot.id
@@ -258,10 +394,10 @@ class AwsClient(BaseClient):
                 SnapshotId=snapshot_id
             )
 
-            self._wait('Waiting for snapshot {} to be deleted...'.format(snapshot_id),
-                       lambda id: not self._get_snapshot(id),
-                       None,
-                       snapshot_id)
+            self._wait_batched(self._describe_snapshots, snapshot_id,
+                               lambda snap: snap is None,
+                               'Waiting for snapshot {} to be deleted...'.format(snapshot_id),
+                               resource_type='snapshot.delete')
 
             self._remove_snapshot(snapshot_id)
             self.logger.info(
@@ -292,12 +428,12 @@ class AwsClient(BaseClient):
 
             volume = self.ec2.create_volume(**kwargs)
 
-            self._wait('Waiting for volume {} to get ready...'.format(volume.id),
-                       lambda vol: vol.state == 'available',
-                       volume.reload,
-                       volume)
+            status = self._wait_batched(self._describe_volumes, volume.id,
+                                        lambda vol: vol is not None and vol['State'] == 'available',
+                                        'Waiting for volume {} to get ready...'.format(volume.id),
+                                        resource_type='volume.create')
 
-            volume = Volume(volume.id, 'none', volume.size)
+            volume = Volume(volume.id, 'none', status['Size'])
             self._add_volume(volume.id)
 
             self.ec2.create_tags(
@@ -327,10 +463,10 @@ class AwsClient(BaseClient):
                 VolumeId=volume_id
             )
 
-            self._wait('Waiting for volume {} to be deleted...'.format(volume_id),
-                       lambda id: not self._get_volume(id),
-                       None,
-                       volume_id)
+            self._wait_batched(self._describe_volumes, volume_id,
+                               lambda vol: vol is None,
+                               'Waiting for volume {} to be deleted...'.format(volume_id),
+                               resource_type='volume.delete')
 
             self._remove_volume(volume_id)
             self.logger.info(
@@ -347,7 +483,7 @@ class AwsClient(BaseClient):
             raise Exception(message)
 
     def _refresh_devices_list(self,instance_id):
-        for volume in self.get_attached_volumes_for_instance(instance_id):
+        for volume in self._get_attached_volumes(instance_id):
             device = volume.device.replace('xv', 's')
             self._add_volume_device(volume.id, device)
 
@@ -364,10 +500,11 @@ class AwsClient(BaseClient):
                 Device=device
             )
 
-            self._wait('Waiting for attachment of volume {} to get ready...'.format(volume_id),
-                       lambda vol: vol.attachments[0]['State'] == 'attached',
-                       volume.reload,
-                       volume)
+            self._wait_batched(self._describe_volumes, volume_id,
+                               lambda vol: bool(vol and vol['Attachments'] and
+                                                vol['Attachments'][0]['State'] == 'attached'),
+                               'Waiting for attachment of volume {} to get ready...'.format(volume_id),
+                               resource_type='attachment.create')
 
             self._add_volume_device(volume_id, device)
             attachment = Attachment(0, volume_id, instance_id)
@@ -406,10 +543,10 @@ class AwsClient(BaseClient):
                 Force=True
             )
 
-            self._wait('Waiting for attachment of volume {} to be removed...'.format(volume_id),
-                       lambda vol: len(vol.attachments) == 0,
-                       volume.reload,
-                       volume)
+            self._wait_batched(self._describe_volumes, volume_id,
+                               lambda vol: vol is not None and len(vol['Attachments']) == 0,
+                               'Waiting for attachment of volume {} to be removed...'.format(volume_id),
+                               resource_type='attachment.delete')
 
             self._remove_volume_device(volume_id)
             self._remove_attachment(volume_id, instance_id)
@@ -431,15 +568,10 @@ class AwsClient(BaseClient):
         pass
 
     def get_nvme_mountpoint(self, volume_id):
-        device_list = self.shell("lsblk --noheadings --raw -p -o NAME,TYPE | awk '$2 == \"part\" {print $1}'")
-        device_list = device_list.split("\n")
-        for device in device_list:
-            vol_id = self.shell("nvme id-ctrl -v {} | egrep -wo 'vol.*'".format(device))
-            vol_id = "vol-" + vol_id.split("vol")[1]
-            vol_id = vol_id.rstrip("\n")
-            if vol_id == volume_id:
-                return device
-        
+        for disk in self.device_inventory.get_disks():
+            if disk.partitions and self._get_volume_id_of_nvme_disk(disk) == volume_id:
+                return disk.partitions[0]
+
         return None
         
     def get_mountpoint(self, volume_id, partition=None):
@@ -456,6 +588,88 @@ class AwsClient(BaseClient):
             device += partition
         return device
 
+    def _get_upload_part_size(self, blob_size):
+        # S3 accepts at most 10,000 parts per upload, hence large blobs need larger parts than configured
+        part_size = self.transfer_configuration['upload_part_size'] * MIB
+        minimum_part_size = -(-blob_size // S3_MAX_PARTS)
+        if minimum_part_size > part_size:
+            part_size = -(-minimum_part_size // MIB) * MIB
+        if part_size > S3_MAX_PART_SIZE:
+            raise Exception('The blob of {} bytes exceeds the maximum size of multipart uploads.'.format(blob_size))
+        return part_size
+
+    def _get_stream_upload_part_size(self, part_number):
+        # The size of a stream is not known in advance: the part size doubles every 1,000 parts, so that the
+        # 10,000 parts can hold much more than the first 1,000 parts. The parts are kept in memory until they
+        # are uploaded, hence they grow at most to upload_buffer_size (about 4.9 TiB per stream by default).
+        part_size = self.transfer_configuration['upload_part_size'] * MIB * 2 ** ((part_number - 1) // 1000)
+        maximum_part_size = max(self.transfer_configuration['upload_buffer_size'],
+                                self.transfer_configuration['upload_part_size']) * MIB
+        return min(part_size, maximum_part_size, S3_MAX_PART_SIZE)
+
+    def _upload_part(self, blob_target_name, upload_id, part_number, data):
+        start_time = time.time()
+        response = self.s3.client.upload_part(Bucket=self.CONTAINER, Key=blob_target_name, UploadId=upload_id,
+                                              PartNumber=part_number, Body=data)
+        duration = max(time.time() - start_time, 0.001)
+        self.logger.info('[S3] [UPLOAD] Part {} of {} uploaded: {:.1f} MiB in {:.2f}s ({:.1f} MiB/s)'.format(
+            part_number, blob_target_name, len(data) / MIB, duration, len(data) / MIB / duration))
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def _multipart_upload(self, blob_target_name, read_part, get_part_size):
+        """Upload the parts returned by read_part(part_number) in parallel until it returns no more data.
+
+        The parts are read one after the other, at most upload_max_concurrency parts are uploaded at the same time.
+        A part is only read if it fits into upload_buffer_size MiB together with the parts being uploaded, which
+        bounds the memory used. The upload is aborted if any part fails, so that no orphaned parts are billed.
+        """
+        max_concurrency = self.transfer_configuration['upload_max_concurrency']
+        max_buffered_size = self.transfer_configuration['upload_buffer_size'] * MIB
+        upload_id = self.s3.client.create_multipart_upload(
+            Bucket=self.CONTAINER, Key=blob_target_name)['UploadId']
+        try:
+            # Part number -> size of the parts being read or uploaded
+            buffered_parts = {}
+            buffer_released = threading.Condition()
+            failed = threading.Event()
+
+            def release_part(part_number, future):
+                if future.exception():
+                    failed.set()
+                with buffer_released:
+                    del buffered_parts[part_number]
+                    buffer_released.notify()
+
+            def fits_into_buffer(part_size):
+                # A part larger than the buffer is read once all other parts are uploaded
+                return not buffered_parts or (len(buffered_parts) < max_concurrency and
+                                              sum(buffered_parts.values()) + part_size <= max_buffered_size)
+
+            futures = []
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                part_number = 1
+                while not failed.is_set():
+                    part_size = get_part_size(part_number)
+                    with buffer_released:
+                        buffer_released.wait_for(lambda: fits_into_buffer(part_size))
+                        buffered_parts[part_number] = part_size
+                    self.cancellation_token.raise_if_cancelled()
+                    data = read_part(part_number)
+                    if not data:
+                        with buffer_released:
+                            del buffered_parts[part_number]
+                        break
+                    future = executor.submit(self._upload_part, blob_target_name, upload_id, part_number, data)
+                    future.add_done_callback(functools.partial(release_part, part_number))
+                    futures.append(future)
+                    part_number += 1
+            parts = [future.result() for future in futures]
+            self.s3.client.complete_multipart_upload(Bucket=self.CONTAINER, Key=blob_target_name,
+                                                     UploadId=upload_id, MultipartUpload={'Parts': parts})
+        except Exception:
+            self.s3.client.abort_multipart_upload(Bucket=self.CONTAINER, Key=blob_target_name, UploadId=upload_id)
+            raise
+
     def _upload_to_blobstore(self, blob_to_upload_path, blob_target_name):
         log_prefix = '[S3] [UPLOAD]'
 
@@ -463,8 +677,17 @@ class AwsClient(BaseClient):
             self.logger.info(
                 '{} Started to upload the tarball to the object storage.'.format(log_prefix))
             try:
-                self.container.upload_file(
-                    blob_to_upload_path, blob_target_name)
+                blob_size = os.path.getsize(blob_to_upload_path)
+                if blob_size < self.transfer_configuration['upload_multipart_threshold'] * MIB:
+                    self.container.upload_file(
+                        blob_to_upload_path, blob_target_name)
+                else:
+                    part_size = self._get_upload_part_size(blob_size)
+                    self.logger.info('{} Uploading {} bytes in parts of {} MiB with up to {} parallel uploads.'.format(
+                        log_prefix, blob_size, part_size // MIB, self.transfer_configuration['upload_max_concurrency']))
+                    with open(blob_to_upload_path, 'rb') as blob_file:
+                        self._multipart_upload(blob_target_name, lambda part_number: blob_file.read(part_size),
+                                               lambda part_number: part_size)
                 self.logger.info('{} SUCCESS: blob_to_upload={}, blob_target_name={}, container={}'
                                  .format(log_prefix, blob_to_upload_path, blob_target_name, self.CONTAINER))
                 return True
@@ -474,6 +697,49 @@ class AwsClient(BaseClient):
                 self.logger.error(message)
                 raise Exception(message)
 
+    def _upload_stream_to_blobstore(self, stream, blob_target_name):
+        log_prefix = '[S3] [UPLOAD]'
+
+        def read_part(part_number):
+            part_size = self._get_stream_upload_part_size(part_number)
+            chunks = []
+            while part_size > 0:
+                chunk = stream.read(part_size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                part_size -= len(chunk)
+            return b''.join(chunks)
+
+        if self.container:
+            self.logger.info(
+                '{} Started to stream the tarball to the object storage.'.format(log_prefix))
+            try:
+                first_part = read_part(1)
+                if len(first_part) < self._get_stream_upload_part_size(1):
+                    # The whole stream fits into a single part
+                    self.s3.client.put_object(Bucket=self.CONTAINER, Key=blob_target_name, Body=first_part)
+                else:
+                    pending_parts = [first_part]
+                    self._multipart_upload(blob_target_name, lambda part_number: pending_parts.pop()
+                                           if pending_parts else read_part(part_number),
+                                           self._get_stream_upload_part_size)
+                self.logger.info('{} SUCCESS: blob_target_name={}, container={}'
+                                 .format(log_prefix, blob_target_name, self.CONTAINER))
+                return True
+            except Exception as error:
+                message = '{} ERROR: blob_target_name={}, container={}\n{}'.format(
+                    log_prefix, blob_target_name, self.CONTAINER, error)
+                self.logger.error(message)
+                raise Exception(message)
+
+    def _get_blob_size(self, blob_name):
+        return self.s3.client.head_object(Bucket=self.CONTAINER, Key=blob_name)['ContentLength']
+
+    def _get_blob_range(self, blob_name, offset, length):
+        return self.s3.client.get_object(Bucket=self.CONTAINER, Key=blob_name,
+                                         Range='bytes={}-{}'.format(offset, offset + length - 1))['Body'].read()
+
     def _download_from_blobstore(self, blob_to_download_name, blob_download_target_path):
         log_prefix = '[S3] [DOWNLOAD]'
 
@@ -481,8 +747,13 @@ class AwsClient(BaseClient):
             self.logger.info('{} Started to download the tarball to target{}.'
                              .format(log_prefix, blob_download_target_path))
             try:
-                self.container.download_file(
-                    blob_to_download_name, blob_download_target_path)
+                blob_size = self._get_blob_size(blob_to_download_name)
+                if self._use_ranged_download(blob_size):
+                    with open(blob_download_target_path, 'wb') as downloaded_file:
+                        self._download_blob_in_ranges(blob_to_download_name, blob_size, downloaded_file.write)
+                else:
+                    self.container.download_file(
+                        blob_to_download_name, blob_download_target_path)
                 self.logger.info('{} SUCCESS: blob_to_download={}, blob_target_name={}, container={}'.format(
                     log_prefix, blob_to_download_name, self.CONTAINER, blob_download_target_path))
                 return True
@@ -493,6 +764,11 @@ class AwsClient(BaseClient):
                 raise Exception(message)
 
     def _download_from_blobstore_and_pipe_to_process(self, process, blob_to_download_name, segment_size):
+        blob_size = self._get_blob_size(blob_to_download_name)
+        if self._use_ranged_download(blob_size):
+            self._download_blob_in_ranges(blob_to_download_name, blob_size, process.stdin.write)
+            return True
+
         s3_object_body = self.s3.Object(
             self.CONTAINER, blob_to_download_name).get()['Body']
         chunk = s3_object_body.read(segment_size)
@@ -1,39 +1,24 @@
 from azure.common.credentials import ServicePrincipalCredentials
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.compute.models import StorageAccountTypes
-from azure.mgmt.compute.models import SnapshotStorageAccountTypes
 from azure.storage.blob import BlockBlobService
 from msrestazure.azure_exceptions import CloudError
-from azure.mgmt.compute.models import DiskCreateOption
-from azure.mgmt.compute.models import DiskCreateOptionTypes
-import glob
 from .BaseClient import BaseClient
+from ..utils.lazy_import import LazyAttribute
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
 
+# The compute SDK is only imported once the compute client is created (not by blob operations)
+ComputeManagementClient = LazyAttribute('azure.mgmt.compute', 'ComputeManagementClient')
+StorageAccountTypes = LazyAttribute('azure.mgmt.compute.models', 'StorageAccountTypes')
+DiskCreateOption = LazyAttribute('azure.mgmt.compute.models', 'DiskCreateOption')
+DiskCreateOptionTypes = LazyAttribute('azure.mgmt.compute.models', 'DiskCreateOptionTypes')
 
 class AzureClient(BaseClient):
     def __init__(self, operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time,
                  poll_maximum_time):
         super(AzureClient, self).__init__(operation_name, configuration, directory_persistent, directory_work_list,
                                           poll_delay_time, poll_maximum_time)
-        if configuration['credhub_url'] is None:
-            self.__setCredentials(
-                configuration['client_id'], configuration['client_secret'], configuration['tenant_id'])
-            self.resource_group = configuration['resource_group']
-            self.storage_account_name = configuration['storageAccount']
-            self.storage_account_key = configuration['storageAccessKey']
-            self.subscription_id = configuration['subscription_id']
-        else:
-            self.logger.info('fetching creds from credhub')
-            azure_config = self._get_credentials_from_credhub(configuration)
-            self.__setCredentials(
-                azure_config['client_id'], azure_config['client_secret'], azure_config['tenant_id'])
-            self.resource_group = azure_config['resource_group']
-            self.storage_account_name = azure_config['storageAccount']
-            self.storage_account_key = azure_config['storageAccessKey']
-            self.subscription_id = azure_config['subscription_id']
+        self.__readCredentials(configuration)
 
         self.block_blob_service = BlockBlobService(
             account_name=self.storage_account_name, account_key=self.storage_account_key)
@@ -67,6 +52,19 @@ class AzureClient(BaseClient):
         #list of regions where ZRS is supported
         self.zrs_supported_regions = ['westeurope', 'centralus','southeastasia', 'eastus2', 'northeurope', 'francecentral']
 
+    def __readCredentials(self, configuration):
+        if configuration['credhub_url'] is None:
+            azure_config = configuration
+        else:
+            self.logger.info('fetching creds from credhub')
+            azure_config = self._get_credentials_from_credhub(configuration)
+        self.__setCredentials(
+            azure_config['client_id'], azure_config['client_secret'], azure_config['tenant_id'])
+        self.resource_group = azure_config['resource_group']
+        self.storage_account_name = azure_config['storageAccount']
+        self.storage_account_key = azure_config['storageAccessKey']
+        self.subscription_id = azure_config['subscription_id']
+
     def __setCredentials(self, client_id, client_secret, tenant_id):
         self.__azureCredentials = ServicePrincipalCredentials(
             client_id=client_id,
@@ -74,6 +72,16 @@ class AzureClient(BaseClient):
             tenant=tenant_id
         )
 
+    def refresh_credentials(self, configuration):
+        self.__readCredentials(configuration)
+        self.block_blob_service = BlockBlobService(
+            account_name=self.storage_account_name, account_key=self.storage_account_key)
+        if (not self.get_container()) or (not self.access_container()):
+            raise Exception('Could not find or access the given container.')
+        if self.OPERATION != 'blob_operation':
+            self.compute_client = ComputeManagementClient(
+                self.__azureCredentials, self.subscription_id)
+
     def get_container(self):
         try:
             container_props = self.block_blob_service.get_container_properties(
@@ -143,17 +151,12 @@ class AzureClient(BaseClient):
         '''
         host_number = None
         try:
-            device_persistent_volume = self.shell(
-                'cat {} | grep {}'
-                .format(self.FILE_MOUNTS, self.DIRECTORY_PERSISTENT)).split(' ')[0][5:-1]
-            device_paths = glob.glob(
-                '/sys/bus/scsi/devices/*:*:*:*/block/{}'.format(device_persistent_volume))
-            if len(device_paths) > 1:
-                raise Exception('Invalid device paths for device {}'.format(
-                    device_persistent_volume))
-            # Success: Go only one device path
-            host_number = device_paths[0][22:-len(
-                '/block/{}'.format(device_persistent_volume))].split(':')[0]
+            device_persistent_volume = self.device_inventory.get_disk_of(
+                self.device_inventory.get_mount_device(self.DIRECTORY_PERSISTENT))
+            if not device_persistent_volume or not device_persistent_volume.scsi_address:
+                raise Exception('Invalid device {} of the persistent volume'.format(
+                    device_persistent_volume and device_persistent_volume.path))
+            host_number = str(device_persistent_volume.scsi_address[0])
         except Exception as error:
             self.logger.error(
                 '[ERROR] [SCSI HOST NUMBER] [DATA VOLUME] Error while determining SCSI host number'
@@ -178,15 +181,12 @@ class AzureClient(BaseClient):
             self.availability_zones = instance.zones
             volume_list = []
             for disk in instance.storage_profile.data_disks:
-                device = None
-                device_path = glob.glob(
-                    self.DEVICE_PATH_TEMPLATE.format(self.scsi_host_number, disk.lun))
-                if len(device_path) != 1:
+                devices = self.device_inventory.get_disks_at_scsi_address(self.scsi_host_number, disk.lun)
+                if len(devices) != 1:
                     raise Exception(
                         'Expected number of device path not matching 1 != {} fo lun {}'.format(
-                            len(device_path), disk.lun))
-                device = '/dev/{}'.format(self.shell(
-                    'ls {}'.format(device_path[0])).rstrip())
+                            len(devices), disk.lun))
+                device = devices[0].path
 
                 volume_list.append(
                     Volume(disk.name, 'none', disk.disk_size_gb, device))
@@ -199,9 +199,9 @@ class AzureClient(BaseClient):
 
     def get_persistent_volume_for_instance(self, instance_id):
         try:
-            device = self.shell(
-                'cat {} | grep {}'.format(self.FILE_MOUNTS, self.DIRECTORY_PERSISTENT)).split(' ')[0][:8]
-            for volume in self.get_attached_volumes_for_instance(instance_id):
+            device = self.device_inventory.get_disk_of(
+                self.device_inventory.get_mount_device(self.DIRECTORY_PERSISTENT)).path
+            for volume in self._get_attached_volumes(instance_id):
                 if volume.device == device:
                     self._add_volume_device(volume.id, device)
                     return volume
@@ -257,10 +257,12 @@ class AzureClient(BaseClient):
                     }
                 )
 
-            self._wait('Waiting for snapshot {} to get ready...'.format(snapshot_name),
-                       lambda operation: operation.done() is True,
-                       None,
-                       snapshot_creation_operation)
+            self._wait_natively(snapshot_creation_operation.wait,
+                                'Waiting for snapshot {} to get ready...'.format(snapshot_name),
+                                lambda operation: operation.done() is True,
+                                None,
+                                snapshot_creation_operation,
+                                resource_type='snapshot.create')
 
             snapshot_info = snapshot_creation_operation.result()
             self.logger.info(
@@ -292,10 +294,12 @@ class AzureClient(BaseClient):
             snapshot_deletion_operation = self.compute_client.snapshots.delete(
                 self.resource_group, snapshot_id)
             # TODO: can be implemented the following wait as 'operation.done() is True'
-            self._wait('Waiting for snapshot {} to be deleted...'.format(snapshot_id),
-                       lambda id: not self._get_snapshot(id),
-                       None,
-                       snapshot_id)
+            self._wait_natively(snapshot_deletion_operation.wait,
+                                'Waiting for snapshot {} to be deleted...'.format(snapshot_id),
+                                lambda id: not self._get_snapshot(id),
+                                None,
+                                snapshot_id,
+                                resource_type='snapshot.delete')
             snapshot_delete_response = snapshot_deletion_operation.result()
             self._remove_snapshot(snapshot_id)
             self.logger.info(
@@ -353,10 +357,12 @@ class AzureClient(BaseClient):
                     }
                 )
 
-            self._wait('Waiting for volume {} to get ready...'.format(disk_name),
-                       lambda operation: operation.done() is True,
-                       None,
-                       disk_creation_operation)
+            self._wait_natively(disk_creation_operation.wait,
+                                'Waiting for volume {} to get ready...'.format(disk_name),
+                                lambda operation: operation.done() is True,
+                                None,
+                                disk_creation_operation,
+                                resource_type='volume.create')
 
             disk = disk_creation_operation.result()
             volume = Volume(disk.name, 'none', disk.disk_size_gb)
@@ -380,10 +386,12 @@ class AzureClient(BaseClient):
             disk_deletion_operation = self.compute_client.disks.delete(
                 self.resource_group, volume_id)
 
-            self._wait('Waiting for volume {} to be deleted...'.format(volume_id),
-                       lambda operation: operation.done() is True,
-                       None,
-                       disk_deletion_operation)
+            self._wait_natively(disk_deletion_operation.wait,
+                                'Waiting for volume {} to be deleted...'.format(volume_id),
+                                lambda operation: operation.done() is True,
+                                None,
+                                disk_deletion_operation,
+                                resource_type='volume.delete')
             delete_response = disk_deletion_operation.result()
             self._remove_volume(volume_id)
             self.logger.info(
@@ -418,8 +426,8 @@ class AzureClient(BaseClient):
                 if disk.lun == next_lun:
                     next_lun += 1
 
-            existing_devices_path = glob.glob(
-                self.DEVICE_PATH_TEMPLATE.format(self.scsi_host_number, next_lun))
+            existing_devices_path = [device.path for device in
+                                     self.device_inventory.get_disks_at_scsi_address(self.scsi_host_number, next_lun)]
             virtual_machine.storage_profile.data_disks.append({
                 'lun': next_lun,
                 'name': volume.name,
@@ -435,21 +443,25 @@ class AzureClient(BaseClient):
                 virtual_machine
             )
 
-            self._wait('Waiting for attachment of volume {} to get ready...'.format(volume_id),
-                       lambda operation: operation.done() is True,
-                       None,
-                       disk_attach_operation)
+            self._wait_natively(disk_attach_operation.wait,
+                                'Waiting for attachment of volume {} to get ready...'.format(volume_id),
+                                lambda operation: operation.done() is True,
+                                None,
+                                disk_attach_operation,
+                                resource_type='attachment.create')
 
             updated_vm = disk_attach_operation.result()
-            all_devices_path = glob.glob(
-                self.DEVICE_PATH_TEMPLATE.format(self.scsi_host_number, next_lun))
-            new_devices_path = list(set(all_devices_path) -
-                                    set(existing_devices_path))
+            new_devices_path = self._wait_for_device(volume_id, lambda: list(
+                set(device.path for device in
+                    self.device_inventory.get_disks_at_scsi_address(self.scsi_host_number, next_lun)) -
+                set(existing_devices_path)))
+            if not new_devices_path:
+                raise Exception(
+                    'Found no new device for lun {} while attaching volume!'.format(next_lun))
             if len(new_devices_path) > 1:
                 raise Exception(
                     'Found more than one new devices while attaching volume!')
-            device = '/dev/{}'.format(self.shell(
-                'ls {}'.format(new_devices_path[0])).rstrip())
+            device = new_devices_path[0]
             self._add_volume_device(volume_id, device)
             attachment = Attachment(0, volume_id, instance_id)
             self._add_attachment(volume_id, instance_id)
@@ -498,10 +510,12 @@ class AzureClient(BaseClient):
                 virtual_machine
             )
 
-            self._wait('Waiting for attachment of volume {} to be removed...'.format(volume_id),
-                       lambda operation: operation.done() is True,
-                       None,
-                       disk_detach_operation)
+            self._wait_natively(disk_detach_operation.wait,
+                                'Waiting for attachment of volume {} to be removed...'.format(volume_id),
+                                lambda operation: operation.done() is True,
+                                None,
+                                disk_detach_operation,
+                                resource_type='attachment.delete')
 
             updated_vm = disk_detach_operation.result()
             self._remove_volume_device(volume_id)
@@ -553,6 +567,28 @@ class AzureClient(BaseClient):
             self.logger.error(message)
             raise Exception(message)
 
+    def _upload_stream_to_blobstore(self, stream, blob_target_name, max_connections=2):
+        log_prefix = '[AZURE STORAGE CONTAINER] [UPLOAD]'
+        self.logger.info(
+            '{} Started to stream the tarball to the object storage.'.format(log_prefix))
+        try:
+            self.block_blob_service.MAX_BLOCK_SIZE = self.max_block_size
+            # The stream is not seekable, hence the byte buffer upload path which reads block after block
+            self.block_blob_service.create_blob_from_stream(
+                self.CONTAINER,
+                blob_target_name,
+                stream,
+                max_connections=max_connections,
+                use_byte_buffer=True)
+            self.logger.info('{} SUCCESS: blob_target_name={}, container={}'.format(
+                log_prefix, blob_target_name, self.CONTAINER))
+            return True
+        except Exception as error:
+            message = '{} ERROR: blob_target_name={}, container={}\n{}'.format(
+                log_prefix, blob_target_name, self.CONTAINER, error)
+            self.logger.error(message)
+            raise Exception(message)
+
     def _download_from_blobstore(self, blob_to_download_name, blob_download_target_path, max_connections=2):
         log_prefix = '[AZURE STORAGE CONTAINER] [DOWNLOAD]'
         self.logger.info('{} Started to download the tarball to target {}.'.format(
@@ -574,8 +610,19 @@ class AzureClient(BaseClient):
             self.logger.error(message)
             raise Exception(message)
 
-    def _download_from_blobstore_and_pipe_to_process(self, process, blob_to_download_name, segment_size):
-        self.block_blob_service.get_blob_to_stream(
-            self.CONTAINER, blob_to_download_name, process.stdin,
-            snapshot=None, start_range=0, end_range=segment_size - 1)
+    def _get_blob_size(self, blob_name):
+        return self.block_blob_service.get_blob_properties(
+            self.CONTAINER, blob_name).properties.content_length
+
+    def _get_blob_range(self, blob_name, offset, length):
+        # The end of the range is inclusive. The ranges are already fetched in parallel, so one connection each.
+        return self.block_blob_service.get_blob_to_bytes(
+            self.CONTAINER, blob_name, start_range=offset, end_range=offset + length - 1,
+            max_connections=1).content
+
+    def _download_from_blobstore_and_pipe_to_process(self, process, blob_to_download_name, segment_size,
+                                                     max_connections=None):
+        blob_size = self._get_blob_size(blob_to_download_name)
+        self._download_blob_in_ranges(blob_to_download_name, blob_size, process.stdin.write,
+                                      max_concurrency=max_connections)
         return True
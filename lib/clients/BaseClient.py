@@ -8,38 +8,79 @@ import sys
 import time
 import types
 import random
+import threading
+import functools
+import collections
+import io
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from retrying import retry
 from ..logger import create_logger
 from ..config import initialize
+from .. import constants
+from .. import encryption
+from .. import compression
+from ..utils.shards import split_directory_into_shards
+from ..utils.cancellation import CancellationToken, CancellableStream, OperationCancelled, terminate_process_group
+from ..utils import wait_strategies
+from ..utils.status_poller import StatusPoller
+from ..utils.device_inventory import DeviceInventory
+from ..utils.device_watcher import DeviceWatcher
+from ..utils.last_operation_writer import LastOperationWriter
+
+# The time in seconds the volumes attached to an instance are reused from the inventory of an operation
+ATTACHED_VOLUMES_TTL = 60
+# The default of the maximum time in seconds the device of an attached volume may take to appear on the machine
+DEVICE_TIMEOUT = 60
+
+
+def abortable(method):
+    """Mark a method as a checkpoint for a scheduled abortion: if SIGINT/SIGTERM was received, the abortion (clean-up
+    and exit) happens right before the method executes.
+
+    Basically, these are the methods used in the backup.py or restore.py scripts. This ensures a 'safe' abortion in
+    terms of 'correctly cleaning up created resources'. All other methods ignore the demand to abort, as it may not
+    be safe in their current state. Overrides of abortable methods in subclasses are checkpoints as well.
+
+    Long transfers do not run to completion: they are cancelled between chunks/parts (see CancellationToken) and the
+    abortion happens as soon as the cancelled method returns.
+    """
+    @functools.wraps(method)
+    def checkpoint(self, *args, **kwargs):
+        self._abort_if_scheduled()
+        try:
+            return method(self, *args, **kwargs)
+        except Exception:
+            # The error may be wrapped by the IaaS client, hence the token decides whether it was a cancellation
+            if self.cancellation_token.cancelled:
+                self._abort_if_scheduled()
+            raise
+    checkpoint.abortable = True
+    return checkpoint
 
 
 class BaseClient:
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        abortable_methods = [name for name, method in vars(BaseClient).items() if getattr(method, 'abortable', False)]
+        for name in abortable_methods:
+            method = vars(cls).get(name)
+            if callable(method) and not getattr(method, 'abortable', False):
+                setattr(cls, name, abortable(method))
+
     def __init__(self, operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time,
                  poll_maximum_time):
         self.OPERATION = operation_name
         # Skipping some parameters for blob operation.
         if operation_name != 'blob_operation':
-            self.GUID = configuration['backup_guid']
-            self.BLOB_PREFIX = self.GUID
             self.INSTANCE_ID = configuration['instance_id']
-            self.SECRET = configuration['secret']
-            self.JOB_NAME = configuration['job_name']
-            self.tags = {
-                'created_by': 'service-fabrik-backup-restore',
-                'instance_id': self.INSTANCE_ID,
-                'job_name': self.JOB_NAME
-                }
-            if operation_name == 'backup':
-                self.TRIGGER = configuration['trigger']
-                self.tags['trigger'] = self.TRIGGER
-        else:
-            self.BLOB_PREFIX = 'aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaa' + str(time.time())
-        
+        self.__configure_operation(configuration)
+
         self.CONTAINER = configuration['container']
-        self.TYPE = configuration['type']
         self.DIRECTORY_PERSISTENT = directory_persistent
         self.DIRECTORY_WORK_LIST = directory_work_list
         self.DIRECTORY_DATA = '/var/vcap/data'
+        # Deprecated: the devices are read by device_inventory; kept for the scripts reading these attributes
         self.FILE_MOUNTS = '/proc/mounts'
         self.DEVICE_PATH_TEMPLATE = '/sys/bus/scsi/devices/{}:*:*:{}/block'
         self.SNAPSHOT_PREFIX = 'sf-snapshot'
@@ -50,12 +91,22 @@ class BaseClient:
             self.DIRECTORY_PERSISTENT) > 0, 'Directory of the persistent volume not given.'
         assert len(self.DIRECTORY_WORK_LIST) > 0, 'Directory Worklist not given.'
         assert len(self.CONTAINER) > 0, 'No container given.'
-        if operation_name != 'blob_operation':
-            assert len(self.SECRET) > 0, 'No encryption secret given.'
-            assert len(self.JOB_NAME) > 0, 'No service job name given.'
+        self.ENCRYPTION = configuration.get('encryption') or encryption.DEFAULT_ENGINE
+        assert self.ENCRYPTION in encryption.ENGINES, 'Unknown encryption engine {}.'.format(self.ENCRYPTION)
+        codec = configuration.get('compression') or compression.DEFAULT_CODEC
+        assert codec in compression.CODECS, 'Unknown compression codec {}.'.format(codec)
+        self.COMPRESSION = compression.resolve_codec(codec)
+        self.COMPRESSION_LEVEL = int(configuration['compression_level']) \
+            if configuration.get('compression_level') is not None else None
+        self.SHARDS = int(configuration['shards']) if configuration.get('shards') is not None else os.cpu_count()
+        # Start the service job as soon as the volumes are detached, instead of after the whole clean-up
+        self.EARLY_SERVICE_RESTART = bool(configuration.get('early_service_restart'))
+        self.DEVICE_TIMEOUT = float(configuration['device_timeout']) \
+            if configuration.get('device_timeout') is not None else DEVICE_TIMEOUT
 
         # Handling abort signals
         self.__ABORT = False
+        self.cancellation_token = CancellationToken()
         signal.signal(signal.SIGINT, self.__schedule_abortion)
         signal.signal(signal.SIGTERM, self.__schedule_abortion)
 
@@ -64,6 +115,12 @@ class BaseClient:
         self.LAST_OPERATION_DIRECTORY = os.getenv(
             'SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY')
         self.LOG_DIRECTORY = os.getenv('SF_BACKUP_RESTORE_LOG_DIRECTORY')
+        # Uploads may report their progress from several threads, which the writer serializes
+        self.__last_operation_writer = LastOperationWriter(
+            os.path.join(self.LAST_OPERATION_DIRECTORY, self.OPERATION + '.lastoperation.json'),
+            os.path.join(self.LAST_OPERATION_DIRECTORY, self.OPERATION + '.lastoperation.blue.json'),
+            os.path.join(self.LAST_OPERATION_DIRECTORY, self.OPERATION + '.lastoperation.green.json'))
+        self.last_operation_state = None
         self.last_operation(
             'Initializing Backup & Restore Library ...', 'processing')
         self.logger = create_logger(self)
@@ -75,11 +132,103 @@ class BaseClient:
             'poll_delay_time': poll_delay_time if poll_delay_time is not None else 10,
             'poll_maximum_time': poll_maximum_time if poll_maximum_time is not None else 300
         }
+        self.transfer_configuration = self.__get_transfer_configuration(configuration)
+        wait_strategy = configuration.get('wait_strategy') or wait_strategies.DEFAULT_WAIT_STRATEGY
+        assert wait_strategy in wait_strategies.WAIT_STRATEGIES, 'Unknown wait strategy {}.'.format(wait_strategy)
+        self.wait_strategy = wait_strategies.create_wait_strategy(
+            wait_strategy, self.configuration['poll_delay_time'],
+            configuration.get('wait_history_file') or os.path.join(self.LAST_OPERATION_DIRECTORY or '.',
+                                                                   'wait_history.json'),
+            type(self).__name__)
+        self.__status_pollers = {}
+        self.__status_pollers_lock = threading.Lock()
+        # The registries of created resources are updated from several threads, e.g. by create_snapshots
+        self.__resources_lock = threading.RLock()
         self.__snapshots_ids = []
         self.__volumes_ids = []
         self.__volumes_attached_ids = []
         self.__mounted_devices = []
         self.__devices = {}
+        # The inventory of the volumes attached to instances: instance id -> (retrieval time, volumes)
+        self.__attached_volumes = {}
+        self.__attached_volumes_generation = 0
+        # The mounts, disks and device links of this machine, read from /proc and /sys instead of by shell commands
+        self.device_inventory = DeviceInventory()
+        self.device_watcher = DeviceWatcher()
+
+    def __configure_operation(self, configuration):
+        # The parameters which differ between the operations of a client kept by the agent daemon
+        if self.OPERATION != 'blob_operation':
+            self.GUID = configuration['backup_guid']
+            self.BLOB_PREFIX = self.GUID
+            self.SECRET = configuration['secret']
+            self.JOB_NAME = configuration['job_name']
+            self.tags = {
+                'created_by': 'service-fabrik-backup-restore',
+                'instance_id': self.INSTANCE_ID,
+                'job_name': self.JOB_NAME
+                }
+            if self.OPERATION == 'backup':
+                self.TRIGGER = configuration['trigger']
+                self.tags['trigger'] = self.TRIGGER
+            assert len(self.SECRET) > 0, 'No encryption secret given.'
+            assert len(self.JOB_NAME) > 0, 'No service job name given.'
+        else:
+            self.BLOB_PREFIX = 'aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaa' + str(time.time())
+        self.TYPE = configuration['type']
+
+    def reconfigure(self, configuration):
+        """Prepare the client for another operation of the same kind and instance, e.g. in the agent daemon.
+
+        The operation specific parameters (backup guid, secret, job name, trigger, type) are taken from the
+        configuration, whereas the IaaS connections, the container and the availability zone are kept. The log and
+        last operation files are reset like for a new client, and so are the registries of created resources: the
+        resources left by an earlier operation (e.g. the snapshot of a backup) are not cleaned up by this one. An
+        abortion scheduled during an earlier operation does not cancel this one.
+
+        :param configuration: the configuration of the operation (like for create_iaas_client)
+
+        :Example:
+            ::
+
+                iaas_client.reconfigure(parse_options('backup'))
+        """
+        self.__configure_operation(configuration)
+        self.__ABORT = False
+        self.cancellation_token.reset()
+        with self.__resources_lock:
+            self.__snapshots_ids = []
+            self.__volumes_ids = []
+            self.__volumes_attached_ids = []
+            self.__mounted_devices = []
+        self._invalidate_attached_volumes()
+        initialize(self.OPERATION)
+        self.last_operation(
+            'Initializing Backup & Restore Library ...', 'processing')
+        self.output_json = dict()
+        self.json_output()
+
+    def refresh_credentials(self, configuration):
+        """Read the credentials again (e.g. from credhub) and create the sessions of the IaaS connections anew, e.g.
+        before the tokens of a client kept by the agent daemon expire.
+
+        The operation, the last operation and the output files are not touched. Clients without sessions do nothing.
+
+        :param configuration: the configuration the client was created with (like for create_iaas_client)
+
+        :Example:
+            ::
+
+                iaas_client.refresh_credentials(parse_options('backup'))
+        """
+        pass
+
+    def __get_transfer_configuration(self, configuration):
+        transfer_configuration = {}
+        for name, default in constants.TRANSFER.items():
+            value = configuration.get(name)
+            transfer_configuration[name] = int(value) if value is not None else default
+        return transfer_configuration
 
     def _get_credentials_from_credhub(self, *args):
         access_token = self._retry(self.__getAccessToken, args)
@@ -111,6 +260,19 @@ class BaseClient:
         return authToken['access_token']
 
     def __schedule_abortion(self, signum, frame):
+        self.schedule_abortion(signum)
+
+    def schedule_abortion(self, signum):
+        """Schedule a safe abortion of the running operation like on SIGINT/SIGTERM: the long operations stop, and the
+        clean-up runs at the next checkpoint. Used by the agent daemon, which handles the signals itself.
+
+        :param signum: the number of the received signal
+
+        :Example:
+            ::
+
+                iaas_client.schedule_abortion(signal.SIGTERM)
+        """
         if self.__ABORT:
             self.logger.info(
                 '[ABORT] REQUEST REJECTED: An abortion has already been scheduled.')
@@ -118,9 +280,12 @@ class BaseClient:
             self.logger.info('[ABORT] REQUEST ACCEPTED: Received SIGINT/SIGTERM ({}). Preparing a safe abortion...'
                              .format(signum), 'aborting')
             self.__ABORT = True
+            self.cancellation_token.cancel()
 
     def __abort(self):
         self.__ABORT = False
+        # The clean-up must not be cancelled
+        self.cancellation_token.reset()
         # Prevent multiple abortion requests
         signal.signal(signal.SIGINT, lambda *args: None)
         signal.signal(signal.SIGTERM, lambda *args: None)
@@ -128,34 +293,21 @@ class BaseClient:
         # Abort
         self.logger.info(
             '[ABORT] It is now safe to abort the execution. Triggering the clean-up...')
-        self.clean_up()
-        self.start_service_job()
-        self.wait_for_service_job_status('running')
+        self.__clean_up_and_start_service_job()
         self.logger.info('[ABORT] Clean-up finished. Aborting now.')
         self.last_operation(
             'SIGINT/SIGTERM received: Abortion completed.', 'aborted')
         sys.exit()
 
-    def __getattribute__(self, attr):
-        method = object.__getattribute__(self, attr)
-        #   Defining the methods which should check (BEFORE they get executed) whether the script was asked to abort its
-        # execution. Basically, this list contains all methods which are used in backup.py or restore.py scripts. This is
-        # done to ensure a 'safe' abortion process in terms of 'correctly cleaning up created resources'. All other methods
-        # except those listed below will ignore the demand to abort as it may possibly be not safe in their current state.
-        methods_allow_aborting = [
-            'get_persistent_volume_for_instance', 'copy_snapshot', 'create_snapshot', 'create_volume',
-            'create_attachment', 'get_mountpoint', 'copy_directory', 'delete_directory', 'create_directory', 'format_device',
-            'mount_device', 'create_and_encrypt_tarball_of_directory', 'create_tarball_of_directory', 'encrypt_file', 'upload_to_blobstore', 'unmount_device', 'delete_attachment',
-            'delete_volume', 'delete_snapshot', 'download_from_blobstore', 'decrypt_and_extract_tarball_of_directory', 'extract_tarball_of_directory', 'decrypt_file'
-        ]
-        if isinstance(method, types.MethodType) and attr in methods_allow_aborting and self.__ABORT:
+    def _abort_if_scheduled(self):
+        if self.__ABORT:
             self.__abort()
-        else:
-            return method
 
     def _retry(self, function, args, throw_exception=None):
         try:
             return self.__retry_rescuer(function, args)
+        except OperationCancelled:
+            raise
         except Exception as error:
             if throw_exception == True:
                 self.logger.error(error)
@@ -164,59 +316,174 @@ class BaseClient:
                 return None
 
     # Retrying configuration parameters currently hard-coded - can be made configurable in future (if needed by anybody)
-    @retry(stop_max_attempt_number=5, stop_max_delay=600000, wait_fixed=10000)
+    @retry(stop_max_attempt_number=5, stop_max_delay=600000, wait_fixed=10000,
+           retry_on_exception=lambda error: not isinstance(error, OperationCancelled))
     def __retry_rescuer(self, function, args):
         try:
             return function(*args)
         except Exception as error:
             self.logger.error(error)
+            if self.cancellation_token.cancelled:
+                raise OperationCancelled('The operation was cancelled: {}'.format(error)) from error
             raise error
 
-    def _wait(self, log_message, success_condition_function, update_function, *success_condition_arguments):
-        timeout = time.time() + self.configuration['poll_maximum_time']
+    def _wait(self, log_message, success_condition_function, update_function, *success_condition_arguments,
+              resource_type=None, start_time=None):
+        """Poll until the success condition is met, with the delays given by the configured wait strategy.
+
+        :param resource_type: (optional) the kind of operation waited for, e.g. 'snapshot.create'; the predictive
+            strategy learns its completion time
+        :param start_time: (optional) the time the wait started at, if it did not start with the polling
+        """
+        start_time = start_time or time.time()
+        timeout = start_time + self.configuration['poll_maximum_time']
+        attempt = 0
         while not success_condition_function(*success_condition_arguments):
-            if time.time() > timeout:
+            now = time.time()
+            if now > timeout:
                 raise Exception('Maximum polling time exceeded.')
             self.logger.info(log_message)
-            time.sleep(self.configuration['poll_delay_time'])
+            time.sleep(self.wait_strategy.get_delay(resource_type, attempt, now - start_time))
+            attempt += 1
             if update_function:
                 update_function()
+        self.wait_strategy.record(resource_type, time.time() - start_time)
+
+    def _wait_natively(self, native_wait_function, log_message, success_condition_function, update_function,
+                       *success_condition_arguments, resource_type=None):
+        """Wait with a provider-native mechanism (e.g. server-side long polling or an SDK poller), then confirm the
+        success condition with _wait. _wait is also the fallback if the native mechanism is not available or fails.
+
+        :param native_wait_function: a function blocking until the operation is done, but at most the given number of
+            seconds
+        """
+        start_time = time.time()
+        try:
+            native_wait_function(self.configuration['poll_maximum_time'])
+        except Exception as error:
+            self.logger.info('[WAIT] Native waiting failed, falling back to polling: {}'.format(error))
+        self._wait(log_message, success_condition_function, update_function, *success_condition_arguments,
+                   resource_type=resource_type, start_time=start_time)
+
+    def _wait_batched(self, fetch_statuses, resource_id, success_condition_function, log_message, resource_type=None,
+                      ignore_errors=False):
+        """Wait like _wait, but poll together with all other waits for resources fetched by the same function, so that
+        several snapshots/volumes in flight are refreshed with one batched request per tick.
+
+        :param fetch_statuses: a function returning a dictionary of the statuses of the given resource ids, e.g. a
+            describe call for several snapshot ids
+        :param resource_id: the id of the resource
+        :param success_condition_function: a function of the status (None if the resource was not found)
+        :param log_message: the message logged while the condition is not met
+        :param resource_type: (optional) the kind of operation waited for, e.g. 'snapshot.create'
+        :param ignore_errors: (optional) keep waiting if fetching the statuses fails
+        :returns: the status
+        """
+        with self.__status_pollers_lock:
+            poller = self.__status_pollers.get(fetch_statuses.__name__)
+            if poller is None:
+                poller = StatusPoller(fetch_statuses, self.wait_strategy, self.logger)
+                self.__status_pollers[fetch_statuses.__name__] = poller
+        start_time = time.time()
+        future = poller.watch(resource_id, success_condition_function, log_message, resource_type, ignore_errors)
+        try:
+            status = future.result(timeout=self.configuration['poll_maximum_time'])
+        except TimeoutError:
+            poller.unwatch(future)
+            raise Exception('Maximum polling time exceeded.')
+        self.wait_strategy.record(resource_type, time.time() - start_time)
+        return status
 
     def _add_volume_device(self, volume_id, device):
-        self.__devices[volume_id] = device
+        with self.__resources_lock:
+            self.__devices[volume_id] = device
 
     def _remove_volume_device(self, volume_id):
-        self.__devices.pop(volume_id, None)
+        with self.__resources_lock:
+            self.__devices.pop(volume_id, None)
 
     def _add_snapshot(self, snapshot_id):
-        self.__snapshots_ids.append(snapshot_id)
+        with self.__resources_lock:
+            if snapshot_id not in self.__snapshots_ids:
+                self.__snapshots_ids.append(snapshot_id)
 
     def _remove_snapshot(self, snapshot_id):
-        if snapshot_id in self.__snapshots_ids:
-            self.__snapshots_ids.remove(snapshot_id)
+        with self.__resources_lock:
+            if snapshot_id in self.__snapshots_ids:
+                self.__snapshots_ids.remove(snapshot_id)
+
+    def keep_snapshot(self, snapshot_id):
+        """Keep a snapshot created by this client, i.e. stop tracking it as a resource of the running operation, so
+        that clean_up does not delete it (e.g. the snapshot a backup consists of).
+
+        :param snapshot_id: the id of the snapshot
+
+        :Example:
+            ::
+
+                iaas_client.keep_snapshot('948fb2e4-6e7f-11e6-8b77-86f30ca893d3')
+        """
+        self._remove_snapshot(snapshot_id)
 
     def _add_volume(self, volume_id):
-        self.__volumes_ids.append(volume_id)
+        with self.__resources_lock:
+            self.__volumes_ids.append(volume_id)
 
     def _remove_volume(self, volume_id):
-        if volume_id in self.__volumes_ids:
-            self.__volumes_ids.remove(volume_id)
+        with self.__resources_lock:
+            if volume_id in self.__volumes_ids:
+                self.__volumes_ids.remove(volume_id)
 
     def _add_attachment(self, volume_id, instance_id):
-        self.__volumes_attached_ids.append((volume_id, instance_id))
+        with self.__resources_lock:
+            self.__volumes_attached_ids.append((volume_id, instance_id))
+        self._invalidate_attached_volumes(instance_id)
 
     def _remove_attachment(self, volume_id, instance_id):
-        if volume_id in self.__volumes_attached_ids:
-            self.__volumes_attached_ids.remove((volume_id, instance_id))
+        with self.__resources_lock:
+            if (volume_id, instance_id) in self.__volumes_attached_ids:
+                self.__volumes_attached_ids.remove((volume_id, instance_id))
+        self._invalidate_attached_volumes(instance_id)
+
+    def _get_attached_volumes(self, instance_id):
+        # The attached volumes from the inventory, retrieved again once they are older than ATTACHED_VOLUMES_TTL
+        # seconds or an attachment of the instance was created/deleted. Failed retrievals (empty lists) are not kept.
+        with self.__resources_lock:
+            entry = self.__attached_volumes.get(instance_id)
+            if entry is not None and time.time() - entry[0] < ATTACHED_VOLUMES_TTL:
+                return list(entry[1])
+            generation = self.__attached_volumes_generation
+        retrieval_time = time.time()
+        volumes = self.get_attached_volumes_for_instance(instance_id)
+        with self.__resources_lock:
+            # Not kept if the inventory was invalidated during the retrieval
+            if volumes and generation == self.__attached_volumes_generation:
+                self.__attached_volumes[instance_id] = (retrieval_time, list(volumes))
+        return volumes
+
+    def _invalidate_attached_volumes(self, instance_id=None):
+        # The devices of this machine change with the attachments as well
+        self.device_inventory.invalidate()
+        with self.__resources_lock:
+            self.__attached_volumes_generation += 1
+            if instance_id is None:
+                self.__attached_volumes.clear()
+            else:
+                self.__attached_volumes.pop(instance_id, None)
 
     def _add_mounted_device(self, device):
-        self.__mounted_devices.append(device)
+        with self.__resources_lock:
+            self.__mounted_devices.append(device)
+        self.device_inventory.invalidate()
 
     def _remove_mounted_device(self, device):
-        self.__mounted_devices.remove(device)
+        with self.__resources_lock:
+            self.__mounted_devices.remove(device)
+        self.device_inventory.invalidate()
 
     def _get_free_device(self):
-        sorted_devices = sorted(self.__devices.items(), key=lambda x: x[1])
+        with self.__resources_lock:
+            sorted_devices = sorted(self.__devices.items(), key=lambda x: x[1])
         largest_device = sorted_devices[-1][1]
         return largest_device[:-1] + chr(ord(largest_device[-1:]) + 1)
 
@@ -228,6 +495,18 @@ class BaseClient:
     def _find_volume_device(self, volume_id):
         raise NotImplementedError()
 
+    def _wait_for_device(self, volume_id, find):
+        # Waits until the device of an attached volume appeared, i.e. until find (a lookup in the device inventory)
+        # returns it, for at most DEVICE_TIMEOUT seconds. Returns None if it did not appear in time.
+        def find_in_inventory():
+            self.device_inventory.invalidate()
+            return find()
+        device = self.device_watcher.wait(find_in_inventory, self.DEVICE_TIMEOUT)
+        if not device:
+            self.logger.warning('[DEVICE] The device of volume {} did not appear within {} seconds.'.format(
+                volume_id, self.DEVICE_TIMEOUT))
+        return device
+
     def initialize(self, message=None):
         """Write initial log statements and set the last operation state to 'processing'.
 
@@ -280,9 +559,7 @@ class BaseClient:
                 iaas_client.exit('Something unpredictable happened.')
         """
         self.logger.error(message)
-        self.clean_up()
-        self.start_service_job()
-        self.wait_for_service_job_status('running')
+        self.__clean_up_and_start_service_job()
         self.last_operation(message, 'failed')
         sys.exit()
 
@@ -312,19 +589,8 @@ class BaseClient:
                 iaas_client.last_operation('Creating Volume')
                 iaas_client.last_operation('Backup completed successfully', 'succeeded')
         """
-        SYMLINK = os.path.join(self.LAST_OPERATION_DIRECTORY,
-                               self.OPERATION + '.lastoperation.json')
-        BLUE = os.path.join(self.LAST_OPERATION_DIRECTORY,
-                            self.OPERATION + '.lastoperation.blue.json')
-        GREEN = os.path.join(self.LAST_OPERATION_DIRECTORY,
-                             self.OPERATION + '.lastoperation.green.json')
-
-        def read_link():
-            return os.readlink(SYMLINK)
-
-        def set_link(target):
-            return self.shell('ln -sf {} {}'.format(target, SYMLINK), False)
-
+        # Stages of the same state are written at most every FLUSH_INTERVAL seconds, a change of the state at once
+        state_changed = bool(state) and state != self.last_operation_state
         if state:
             self.last_operation_state = state
         content = json.dumps({
@@ -332,10 +598,7 @@ class BaseClient:
             'stage': stage,
             'updated_at': datetime.datetime.utcfromtimestamp(time.time()).strftime('%Y-%m-%dT%H:%M:%SZ')
         })
-        filename = GREEN if read_link() == BLUE else BLUE
-        with open(filename, 'w') as last_operation_file:
-            last_operation_file.write(content)
-        set_link(filename)
+        self.__last_operation_writer.update(content, flush=state_changed)
 
     def shell(self, command, log_command=True):
         """Execute a shell command.
@@ -418,9 +681,15 @@ class BaseClient:
                     'Waiting for job "{}" to have status "{}"...'.format(self.JOB_NAME, status))
                 time.sleep(self.configuration['poll_delay_time'])
 
-    def clean_up(self):
+    def clean_up(self, on_detached=None):
         """Detach and remove all volumes and snapshots.
 
+        The devices are unmounted first. Then every volume is detached and deleted in a chain of its own, and the
+        snapshots are deleted; the chains and the snapshot deletions run concurrently.
+
+        :param on_detached: (optional) a function called as soon as all volumes are detached, while the volumes and
+            snapshots are still being deleted (e.g. to start the service job early)
+
         :Example:
             ::
 
@@ -428,7 +697,12 @@ class BaseClient:
         """
         self.logger.info(
             '[CLEAN-UP] Begin cleaning up all created resources ...')
-        for device in self.__mounted_devices[:]:
+        with self.__resources_lock:
+            mounted_devices = self.__mounted_devices[:]
+            attachments = self.__volumes_attached_ids[:]
+            volume_ids = self.__volumes_ids[:]
+            snapshot_ids = self.__snapshots_ids[:]
+        for device in mounted_devices:
             self.logger.info(
                 '[CLEAN-UP] Unmounting device with name {}'.format(device))
             self.unmount_device(device)
@@ -436,20 +710,55 @@ class BaseClient:
             self.logger.info(
                 '[CLEAN-UP] Removing work directory {}'.format(directory))
             self.delete_directory(directory)
-        for (volume_id, instance_id) in self.__volumes_attached_ids[:]:
+
+        def delete_attachment(volume_id, instance_id):
             self.logger.info(
                 '[CLEAN-UP] Removing attachment of volume {}'.format(volume_id))
             self.delete_attachment(volume_id, instance_id)
-        for volume_id in self.__volumes_ids[:]:
+
+        def delete_volume(volume_id, detachments):
+            for detachment in detachments:
+                detachment.result()
             self.logger.info(
                 '[CLEAN-UP] Removing volume with id {}'.format(volume_id))
             self.delete_volume(volume_id)
-        for snapshot_id in self.__snapshots_ids[:]:
+
+        def delete_snapshot(snapshot_id):
             self.logger.info(
                 '[CLEAN-UP] Removing snapshot with id {}'.format(snapshot_id))
             self.delete_snapshot(snapshot_id)
+
+        # One worker per task, as the volume deletions wait for their detachments within the pool
+        workers = max(1, len(attachments) + len(volume_ids) + len(snapshot_ids))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            detachments = [(volume_id, executor.submit(delete_attachment, volume_id, instance_id))
+                           for (volume_id, instance_id) in attachments]
+            deletions = [executor.submit(delete_snapshot, snapshot_id) for snapshot_id in snapshot_ids]
+            deletions += [executor.submit(delete_volume, volume_id,
+                                          [detachment for (attached_volume_id, detachment) in detachments
+                                           if attached_volume_id == volume_id])
+                          for volume_id in volume_ids]
+            for volume_id, detachment in detachments:
+                detachment.result()
+            if on_detached:
+                self.logger.info('[CLEAN-UP] All volumes are detached.')
+                on_detached()
+            for deletion in deletions:
+                deletion.result()
         self.logger.info('[CLEAN-UP] ... finished.')
 
+    def __clean_up_and_start_service_job(self):
+        if self.EARLY_SERVICE_RESTART:
+            self.clean_up(on_detached=self.__start_service_job_and_wait)
+        else:
+            self.clean_up()
+            self.__start_service_job_and_wait()
+
+    def __start_service_job_and_wait(self):
+        self.start_service_job()
+        self.wait_for_service_job_status('running')
+
+    @abortable
     def create_directory(self, directory):
         """Create a directory.
 
@@ -462,6 +771,7 @@ class BaseClient:
         """
         return self.shell('mkdir -p {}'.format(directory))
 
+    @abortable
     def delete_directory(self, directory):
         """Delete a directory.
 
@@ -474,6 +784,7 @@ class BaseClient:
         """
         return self.shell('rm -rf {}'.format(directory))
 
+    @abortable
     def copy_directory(self, source, dest):
         """copy a directory.
 
@@ -487,6 +798,7 @@ class BaseClient:
         """
         return self.shell('cp -r {} {}'.format(source, dest))
 
+    @abortable
     def format_device(self, device, filesystem='ext4'):
         """Create an ext4 filesystem on a volume identified by its device name.
 
@@ -500,6 +812,7 @@ class BaseClient:
         """
         return self.shell('mkfs.{} {}'.format(filesystem, device))
 
+    @abortable
     def mount_device(self, device, directory, filesystem='ext4'):
         """Mount a volume to the filesystem.
 
@@ -523,6 +836,7 @@ class BaseClient:
             self._add_mounted_device(device)
         return cmd
 
+    @abortable
     def unmount_device(self, device):
         """Unmount a volume from the filesystem.
 
@@ -539,6 +853,40 @@ class BaseClient:
             self._remove_mounted_device(device)
         return cmd
 
+    def __encrypt_output_of_command(self, command, encrypted_file_name):
+        # Returns True or None (in case of errors) like shell()
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, shell=True)
+            try:
+                with open(encrypted_file_name, 'wb') as encrypted_file:
+                    encryption.encrypt_stream(process.stdout, encrypted_file, self.SECRET)
+            finally:
+                process.stdout.close()
+            if process.wait() != 0:
+                raise Exception('"{}" returned with non zero exit code.'.format(command))
+            return True
+        except Exception as error:
+            self.logger.error('[ENCRYPTION ERROR] {}'.format(error))
+            return None
+
+    def __decrypt_file_into(self, encrypted_file_name, target):
+        # Native and legacy gpg archives are told apart by their header. Returns True or None like shell()
+        try:
+            with open(encrypted_file_name, 'rb') as encrypted_file:
+                encryption.decrypt_stream(encrypted_file, target, self.SECRET)
+            return True
+        except Exception as error:
+            self.logger.error('[DECRYPTION ERROR] {}'.format(error))
+            return None
+
+    def __tar_create_command(self, directory, archive='-', options='', file_list=None):
+        # The codec is recorded in the backup metadata
+        self.output_json['compression'] = self.COMPRESSION
+        self.json_output()
+        return compression.tar_create_command(directory, self.COMPRESSION, self.COMPRESSION_LEVEL, archive, options,
+                                              file_list)
+
+    @abortable
     def create_and_encrypt_tarball_of_directory(self, directory_to_encrypt, encrypted_tarball_name):
         """Create a tarball of a directory and encrypt it with the secret provided at class instantiation.
 
@@ -552,11 +900,16 @@ class BaseClient:
         """
         self.logger.info(
             '[ENCRYPTION] Started creating, encrypting and copying a tarball ...')
-        result = self.shell('tar -cpz -C {} . | gpg --symmetric --no-use-agent --cipher-algo aes256 --passphrase {} -o {}'
-                            .format(directory_to_encrypt, self.SECRET, encrypted_tarball_name), False)
+        tar_command = self.__tar_create_command(directory_to_encrypt)
+        if self.ENCRYPTION == encryption.ENGINE_GPG:
+            result = self.shell('{} | gpg --symmetric --no-use-agent --cipher-algo aes256 --passphrase {} -o {}'
+                                .format(tar_command, self.SECRET, encrypted_tarball_name), False)
+        else:
+            result = self.__encrypt_output_of_command(tar_command, encrypted_tarball_name)
         self.logger.info('[ENCRYPTION] ... finished.')
         return result
 
+    @abortable
     def decrypt_and_extract_tarball_of_directory(self, encrypted_tarball_name, directory_to_extract):
         """Decrypt with the secret provided at class instantiation, and extract an encrypted tarball of a directory.
 
@@ -575,12 +928,17 @@ class BaseClient:
         if self.shell('rm -rf {}/*'.format(directory_to_extract)):
             self.logger.info(
                 '[DECRYPTION] ... finished. Started decrypting and extracting a tarball ...')
-            result = self.shell('gpg --no-use-agent --passphrase {} -d {} | tar -xzf - -C {}/'
-                                .format(self.SECRET, encrypted_tarball_name, directory_to_extract), False)
+            # The codec is detected from the decrypted tarball
+            extracting_writer = compression.ExtractingWriter(directory_to_extract)
+            result = self.__decrypt_file_into(encrypted_tarball_name, extracting_writer)
+            if extracting_writer.close() != 0:
+                self.logger.error('[DECRYPTION ERROR] tar returned with non zero exit code.')
+                result = None
             self.logger.info('[DECRYPTION] ... finished.')
             return result
         return None
 
+    @abortable
     def create_tarball_of_directory(self, directory_to_tar, tarball_name):
         """Create a tarball of a directory.
 
@@ -593,11 +951,11 @@ class BaseClient:
         """
         self.logger.info(
             '[COMPRESSION] Started creating and copying a tarball ...')
-        result = self.shell('tar cvzpf {} -C {} .'
-                            .format(tarball_name, directory_to_tar), False)
+        result = self.shell(self.__tar_create_command(directory_to_tar, tarball_name, 'v'), False)
         self.logger.info('[COMPRESSION] ... finished.')
         return result
 
+    @abortable
     def extract_tarball_of_directory(self, tarball_name, directory_to_extract):
         """Extract an encrypted tarball of a directory.
 
@@ -615,12 +973,14 @@ class BaseClient:
         if self.shell('rm -rf {}/*'.format(directory_to_extract)):
             self.logger.info(
                 '[DECOMPRESSION] Started extracting a tarball ...')
-            result = self.shell('tar -xvf {} -C {}'
-                                .format(tarball_name, directory_to_extract), False)
+            with open(tarball_name, 'rb') as tarball:
+                codec = compression.detect_codec(tarball.read(compression.MAGIC_SIZE))
+            result = self.shell(compression.tar_extract_command(directory_to_extract, codec, tarball_name, 'v'), False)
             self.logger.info('[DECOMPRESSION] ... finished.')
             return result
         return None
 
+    @abortable
     def encrypt_file(self, file_to_encrypt, encrypted_file_name):
         """Encrypt a given file with the secret provided at class instantiation.
 
@@ -634,11 +994,21 @@ class BaseClient:
         """
         self.logger.info(
             '[ENCRYPTION] Started encrypting and copying a file ...')
-        result = self.shell('gpg --symmetric --no-use-agent --cipher-algo aes256 --passphrase {} -o {} {}'
-                            .format(self.SECRET, encrypted_file_name, file_to_encrypt), False)
+        if self.ENCRYPTION == encryption.ENGINE_GPG:
+            result = self.shell('gpg --symmetric --no-use-agent --cipher-algo aes256 --passphrase {} -o {} {}'
+                                .format(self.SECRET, encrypted_file_name, file_to_encrypt), False)
+        else:
+            try:
+                with open(file_to_encrypt, 'rb') as source_file, open(encrypted_file_name, 'wb') as encrypted_file:
+                    encryption.encrypt_stream(source_file, encrypted_file, self.SECRET)
+                result = True
+            except Exception as error:
+                self.logger.error('[ENCRYPTION ERROR] {}'.format(error))
+                result = None
         self.logger.info('[ENCRYPTION] ... finished.')
         return result
 
+    @abortable
     def decrypt_file(self, encrypted_file_name, decrypted_file_name):
         """Decrypt an encrypted file with the secret provided at class instantiation.
 
@@ -656,8 +1026,8 @@ class BaseClient:
         if self.shell('rm -f {}'.format(decrypted_file_name)):
             self.logger.info(
                 '[DECRYPTION] ... finished. Started decrypting a file ...')
-            result = self.shell('gpg --no-use-agent --passphrase {} -d -o {} {}'
-                                .format(self.SECRET, decrypted_file_name, encrypted_file_name), False)
+            with open(decrypted_file_name, 'wb') as decrypted_file:
+                result = self.__decrypt_file_into(encrypted_file_name, decrypted_file)
             self.logger.info('[DECRYPTION] ... finished.')
             return result
         return None
@@ -708,6 +1078,7 @@ class BaseClient:
         """
         raise NotImplementedError()
 
+    @abortable
     def get_persistent_volume_for_instance(self, instance_id):
         """Retrieve the persistent volume attached to an instance.
 
@@ -722,6 +1093,7 @@ class BaseClient:
         """
         raise NotImplementedError()
 
+    @abortable
     def get_mountpoint(self, volume_id, partition=None):
         """Retrieve the device name of an attached volume.
 
@@ -741,6 +1113,27 @@ class BaseClient:
     def _create_snapshot(self):
         raise NotImplementedError()
 
+    def _create_snapshots(self, volume_ids, description='Service-Fabrik: Automated backup'):
+        # Without a multi-volume snapshot call of the IaaS, the volumes are snapshotted concurrently. The snapshots
+        # are not crash-consistent with each other then. If one of them fails, the others are deleted as well.
+        log_prefix = '[SNAPSHOT] [CREATE] [GROUP]'
+        with ThreadPoolExecutor(max_workers=max(1, len(volume_ids))) as executor:
+            futures = [executor.submit(self._create_snapshot, volume_id, description) for volume_id in volume_ids]
+        snapshots = []
+        errors = []
+        for volume_id, future in zip(volume_ids, futures):
+            try:
+                snapshots.append(future.result())
+            except Exception as error:
+                errors.append('volume-id={}: {}'.format(volume_id, error))
+        if errors:
+            for snapshot in snapshots:
+                self.delete_snapshot(snapshot.id)
+            message = '{} ERROR: {}'.format(log_prefix, '\n'.join(errors))
+            self.logger.error(message)
+            raise Exception(message)
+        return snapshots
+
     def _copy_snapshot(self):
         raise NotImplementedError()
 
@@ -765,6 +1158,61 @@ class BaseClient:
     def _download_from_blobstore(self):
         raise NotImplementedError()
 
+    def _upload_stream_to_blobstore(self, stream, blob_target_name):
+        raise NotImplementedError()
+
+    def _get_blob_size(self, blob_name):
+        raise NotImplementedError()
+
+    def _get_blob_range(self, blob_name, offset, length):
+        raise NotImplementedError()
+
+    def _use_ranged_download(self, blob_size):
+        return blob_size is not None and \
+            blob_size >= self.transfer_configuration['download_multipart_threshold'] * constants.MIB
+
+    def _download_blob_in_ranges(self, blob_name, blob_size, write, max_concurrency=None):
+        """Download a blob in byte ranges which are fetched concurrently and passed to write() in order.
+
+        At most download_buffer_size MiB are fetched ahead of the range written next. This bounds the memory used
+        to reorder the ranges, and a slow consumer (e.g. the gpg/tar subprocess) pauses the download.
+
+        :param blob_name: the name of the blob to be downloaded
+        :param blob_size: the size of the blob in bytes
+        :param write: a function consuming the content of the blob chunk by chunk (e.g. file.write)
+        :param max_concurrency: (optional) the number of parallel downloads, default: download_max_concurrency
+        """
+        range_size = self.transfer_configuration['download_range_size'] * constants.MIB
+        max_ranges_ahead = max(1, self.transfer_configuration['download_buffer_size'] * constants.MIB // range_size)
+        max_concurrency = max_concurrency or self.transfer_configuration['download_max_concurrency']
+        self.logger.info('[DOWNLOAD] Downloading {} bytes of {} in ranges of {} MiB with up to {} parallel downloads.'
+                         .format(blob_size, blob_name, range_size // constants.MIB, max_concurrency))
+
+        def get_range(offset, length):
+            self.cancellation_token.raise_if_cancelled()
+            data = self._get_blob_range(blob_name, offset, length)
+            if len(data) != length:
+                raise Exception('Received {} instead of {} bytes at offset {} of {}.'.format(
+                    len(data), length, offset, blob_name))
+            return data
+
+        pending_ranges = collections.deque()
+        offset = 0
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            try:
+                while offset < blob_size or pending_ranges:
+                    self.cancellation_token.raise_if_cancelled()
+                    while offset < blob_size and len(pending_ranges) < max_ranges_ahead:
+                        length = min(range_size, blob_size - offset)
+                        pending_ranges.append(executor.submit(get_range, offset, length))
+                        offset += length
+                    write(pending_ranges.popleft().result())
+            except Exception:
+                for future in pending_ranges:
+                    future.cancel()
+                raise
+
+    @abortable
     def create_snapshot(self, *args):
         """Create a snapshot of a volume.
 
@@ -779,6 +1227,28 @@ class BaseClient:
         """
         return self._retry(self._create_snapshot, args)
 
+    @abortable
+    def create_snapshots(self, *args):
+        """Create snapshots of several volumes (e.g. the data and the WAL disk of a service instance) at once.
+
+        If the IaaS supports it, the snapshots are crash-consistent with each other. Otherwise they are created
+        concurrently. Either all snapshots are created or none is.
+
+        :param volume_ids: the ids of the volumes the snapshots should be created from
+        :returns: the snapshots in the order of the volume ids (in case of success) or None (in case of errors)
+        :rtype: List of Snapshot objects
+
+        :Example:
+            ::
+
+                iaas_client.create_snapshots(['948fb2e4-6e7f-11e6-8b77-86f30ca893d3', 'b2b5a57c-6e7f-11e6-8b77-86f30ca893d3'])
+        """
+        snapshots = self._retry(self._create_snapshots, args)
+        if snapshots is not None:
+            self.output_json['snapshotIds'] = [snapshot.id for snapshot in snapshots]
+        return snapshots
+
+    @abortable
     def copy_snapshot(self, *args):
         """Create a copy of snapshot of a volume.
 
@@ -821,6 +1291,7 @@ class BaseClient:
         """
         return self._retry(self._get_volume, args)
 
+    @abortable
     def delete_snapshot(self, *args):
         """Delete a snapshot of a volume.
 
@@ -833,6 +1304,7 @@ class BaseClient:
         """
         return self._retry(self._delete_snapshot, args)
 
+    @abortable
     def create_volume(self, *args):
         """Create a volume.
 
@@ -849,6 +1321,7 @@ class BaseClient:
         """
         return self._retry(self._create_volume, args)
 
+    @abortable
     def delete_volume(self, *args):
         """Delete a volume (must be detached from all instances!).
 
@@ -861,6 +1334,7 @@ class BaseClient:
         """
         return self._retry(self._delete_volume, args)
 
+    @abortable
     def create_attachment(self, *args):
         """Attach a volume to an instance.
 
@@ -874,8 +1348,13 @@ class BaseClient:
 
                 iaas_client.create_attachment('948fb2e4-6e7f-11e6-8b77-86f30ca893d3', '254989f8-6e81-11e6-8b77-86f30ca893d3')
         """
-        return self._retry(self._create_attachment, args)
+        try:
+            return self._retry(self._create_attachment, args)
+        finally:
+            # Also a failed attachment may have changed the attached volumes
+            self._invalidate_attached_volumes(args[1] if len(args) > 1 else None)
 
+    @abortable
     def delete_attachment(self, *args):
         """Detach a volume from an instance.
 
@@ -887,8 +1366,12 @@ class BaseClient:
 
                 iaas_client.delete_attachment('948fb2e4-6e7f-11e6-8b77-86f30ca893d3', '254989f8-6e81-11e6-8b77-86f30ca893d3')
         """
-        return self._retry(self._delete_attachment, args)
+        try:
+            return self._retry(self._delete_attachment, args)
+        finally:
+            self._invalidate_attached_volumes(args[1] if len(args) > 1 else None)
 
+    @abortable
     def upload_to_blobstore(self, *args, throw_exception=None):
         """Upload a file to the BLOB storage.
 
@@ -905,6 +1388,7 @@ class BaseClient:
         """
         return self._retry(self._upload_to_blobstore, args, throw_exception)
 
+    @abortable
     def download_from_blobstore(self, *args, throw_exception=None):
         """Download a file from the BLOB storage.
 
@@ -921,6 +1405,109 @@ class BaseClient:
         """
         return self._retry(self._download_from_blobstore, args, throw_exception)
 
+    @abortable
+    def backup_directory_to_blobstore(self, directory, blob_name):
+        """Create a tarball of a directory, encrypt it with the secret provided at class instantiation and stream it
+        to the BLOB storage without storing it on the local filesystem first.
+
+        :param directory: the path to the directory to be archived, encrypted and uploaded
+        :param blob_name: the name of the uploaded file in the BLOB storage
+
+        :Example:
+            ::
+
+                iaas_client.backup_directory_to_blobstore('/var/vcap/store/blueprint/files', 'files.tar.gz.gpg')
+        """
+        return self.__backup_tar_command_to_blobstore(self.__tar_create_command(directory), directory, blob_name)
+
+    def __backup_tar_command_to_blobstore(self, command, directory, blob_name):
+        log_prefix = '[ARCHIVE, ENCRYPT, UPLOAD]'
+        base_log = 'directory={}, blob_target_name={}, container={}'.format(
+            directory, blob_name, self.CONTAINER)
+
+        segment_size = 65536  # 64 KiB
+        if self.ENCRYPTION == encryption.ENGINE_GPG:
+            # pipefail: a failing tar must not be hidden behind a successful gpg
+            command = 'set -o pipefail; {} | gpg --batch --symmetric --no-use-agent --cipher-algo aes256 --passphrase {}'.format(
+                command, self.SECRET)
+
+        try:
+            self.logger.info('{} Started to archive, encrypt and upload {}.'.format(
+                log_prefix, blob_name))
+            # A session of its own, so that the pipeline can be terminated as a whole
+            process = subprocess.Popen(
+                command, stdout=subprocess.PIPE, shell=True, executable='/bin/bash', bufsize=segment_size,
+                start_new_session=True)
+            stream = process.stdout
+            if self.ENCRYPTION == encryption.ENGINE_NATIVE:
+                stream = encryption.EncryptingReader(process.stdout, self.SECRET)
+            stream = CancellableStream(stream, self.cancellation_token)
+            try:
+                self._upload_stream_to_blobstore(stream, blob_name)
+            except Exception:
+                terminate_process_group(process)
+                raise
+            finally:
+                stream.close()
+            exitcode = process.wait(timeout=None)
+            if exitcode != 0:
+                raise Exception(
+                    'Worker subprocess for archiving and encrypting returned with non zero exit code.')
+
+            self.logger.info('{} SUCCESS: {}'.format(log_prefix, base_log))
+            return True
+        except Exception as error:
+            message = '{} ERROR: {}\n{}'.format(log_prefix, base_log, error)
+            self.logger.error(message)
+            raise Exception(message)
+
+    @abortable
+    def backup_directory_to_blobstore_sharded(self, directory, blob_name, shards=None):
+        """Back up a directory as several tarballs (shards) which are archived, encrypted and uploaded concurrently.
+
+        The entries of the directory are split into shards of about the same size. Every shard is streamed to the
+        BLOB storage like in backup_directory_to_blobstore. Finally a manifest listing the shards is uploaded as
+        blob_name.
+
+        :param directory: the path to the directory to be archived, encrypted and uploaded
+        :param blob_name: the name of the manifest in the BLOB storage, the shards are named blob_name.shard-<n>
+        :param shards: (optional) the number of shards, default: the number of cores (or the configured number)
+
+        :Example:
+            ::
+
+                iaas_client.backup_directory_to_blobstore_sharded('/var/vcap/store/blueprint/files', 'files.manifest', 4)
+        """
+        log_prefix = '[ARCHIVE, ENCRYPT, UPLOAD] [SHARDED]'
+        shards = shards or self.SHARDS
+        file_lists = [file_list for file_list in split_directory_into_shards(directory, shards) if file_list]
+        shard_names = ['{}.shard-{:03d}'.format(blob_name, index) for index in range(len(file_lists))]
+        self.logger.info('{} Backing up {} in {} shards.'.format(log_prefix, directory, len(file_lists)))
+
+        with tempfile.TemporaryDirectory(dir=self.DIRECTORY_WORK_LIST[0]) as work_directory:
+            commands = []
+            for shard_name, file_list in zip(shard_names, file_lists):
+                file_list_path = os.path.join(work_directory, os.path.basename(shard_name))
+                with open(file_list_path, 'wb') as file_list_file:
+                    file_list_file.write(b'\0'.join(file_list) + b'\0')
+                commands.append(self.__tar_create_command(directory, file_list=file_list_path))
+
+            with ThreadPoolExecutor(max_workers=max(1, len(commands))) as executor:
+                futures = [executor.submit(self.__backup_tar_command_to_blobstore, command, directory, shard_name)
+                           for command, shard_name in zip(commands, shard_names)]
+                for future in futures:
+                    future.result()
+
+        manifest = {
+            'version': 1,
+            'shards': shard_names
+        }
+        self._upload_stream_to_blobstore(io.BytesIO(json.dumps(manifest).encode('utf-8')), blob_name)
+        self.logger.info('{} SUCCESS: directory={}, blob_target_name={}, shards={}, container={}'.format(
+            log_prefix, directory, blob_name, len(shard_names), self.CONTAINER))
+        return True
+
+    @abortable
     def download_from_blobstore_decrypt_extract(self, blob_to_download_name, blob_download_target_path):
         """Download a file from BLOB storage and pipe it to a subprocess for decryption and decompression.
 
@@ -932,25 +1519,23 @@ class BaseClient:
 
                 iaas_client.download_from_blobstore_decrypt_extract('files.tar.gz.enc', '/store/service/data')
         """
+        return self.__download_decrypt_extract(blob_to_download_name, blob_download_target_path)
+
+    def __download_decrypt_extract(self, blob_to_download_name, blob_download_target_path):
         log_prefix = '[DOWNLOAD, DECRYPT, EXTRACT]'
         base_log = 'blob_to_download={}, blob_target_path={}, container={}'.format(
             blob_to_download_name, blob_download_target_path, self.CONTAINER)
 
         segment_size = 65536  # 64 KiB
-        command = 'gpg --batch --cipher-algo aes256 --passphrase {} --decrypt | tar -xzf - -C {}/'.format(
-            self.SECRET, blob_download_target_path)
 
         if self._retry(self.get_container, []):
             try:
                 self.logger.info('{} Started to download, decryt, extract and copy backup to {}.'.format(
                     log_prefix, blob_download_target_path))
-                process = subprocess.Popen(
-                    command, stdin=subprocess.PIPE, shell=True, bufsize=segment_size, universal_newlines=False)
-                args = [process, blob_to_download_name, segment_size]
-                self._retry(
-                    self._download_from_blobstore_and_pipe_to_process, args)
-                process.stdin.close()
-                exitcode = process.wait(timeout=None)
+                # A failed attempt is restarted with a new pipeline, as the former one already consumed a part of
+                # the blob
+                exitcode = self._retry(self.__download_decrypt_extract_attempt,
+                                       [blob_to_download_name, blob_download_target_path, segment_size], True)
                 if exitcode != 0:
                     raise Exception(
                         'Worker subprocess for decryption and extracting returned with non zero exit code.')
@@ -963,6 +1548,58 @@ class BaseClient:
                 self.logger.error(error)
                 raise Exception(error)
 
+    def __download_decrypt_extract_attempt(self, blob_to_download_name, blob_download_target_path, segment_size):
+        # The blob is decrypted on its way into tar, natively or by gpg for legacy archives. tar is started with the
+        # decoder matching the codec detected from the decrypted tarball.
+        extracting_writer = compression.ExtractingWriter(blob_download_target_path, bufsize=segment_size)
+        decrypting_writer = encryption.DecryptingWriter(extracting_writer, self.SECRET)
+        decrypting_process = types.SimpleNamespace(
+            stdin=CancellableStream(decrypting_writer, self.cancellation_token))
+        try:
+            self._download_from_blobstore_and_pipe_to_process(decrypting_process, blob_to_download_name, segment_size)
+            decrypting_process.stdin.close()
+        except Exception:
+            decrypting_writer.abort()
+            extracting_writer.abort()
+            raise
+        finally:
+            exitcode = extracting_writer.close()
+        return exitcode
+
+    def __download_manifest(self, blob_to_download_name):
+        manifest_process = types.SimpleNamespace(stdin=io.BytesIO())
+        self._download_from_blobstore_and_pipe_to_process(manifest_process, blob_to_download_name, 65536)
+        return json.loads(manifest_process.stdin.getvalue().decode('utf-8'))
+
+    @abortable
+    def download_from_blobstore_decrypt_extract_sharded(self, blob_to_download_name, blob_download_target_path):
+        """Restore a backup created by backup_directory_to_blobstore_sharded: download the manifest, then download,
+        decrypt and extract all its shards concurrently.
+
+        :param blob_to_download_name: the name of the manifest in the BLOB storage
+        :param blob_download_target_path: the path of the directory to extract the shards to
+
+        :Example:
+            ::
+
+                iaas_client.download_from_blobstore_decrypt_extract_sharded('files.manifest', '/store/service/data')
+        """
+        log_prefix = '[DOWNLOAD, DECRYPT, EXTRACT] [SHARDED]'
+        # Each attempt downloads the manifest into a new buffer
+        manifest = self._retry(self.__download_manifest, [blob_to_download_name], True)
+        self.logger.info('{} Restoring {} shards to {}.'.format(
+            log_prefix, len(manifest['shards']), blob_download_target_path))
+
+        with ThreadPoolExecutor(max_workers=max(1, len(manifest['shards']))) as executor:
+            futures = [executor.submit(self.__download_decrypt_extract, shard_name,
+                                       blob_download_target_path) for shard_name in manifest['shards']]
+            for future in futures:
+                future.result()
+
+        self.logger.info('{} SUCCESS: blob_to_download={}, blob_target_path={}, container={}'.format(
+            log_prefix, blob_to_download_name, blob_download_target_path, self.CONTAINER))
+        return True
+
     def generate_name_by_prefix(self, prefix):
         return '{}-{}-{}'.format(prefix,
                                  random.randrange(10000, 99999),
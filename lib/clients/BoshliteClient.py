@@ -1,4 +1,5 @@
 import os
+import shutil
 from random import randrange
 from .BaseClient import BaseClient
 from ..models.Snapshot import Snapshot
@@ -45,7 +46,7 @@ class BoshliteClient(BaseClient):
 
     def get_persistent_volume_for_instance(self, instance_id):
         try:
-            device = self.shell('cat /proc/mounts | grep {}'.format(self.DIRECTORY_PERSISTENT)).split(' ')[0][:10]
+            device = self.device_inventory.get_mount_device(self.DIRECTORY_PERSISTENT)[:10]
             volume = Volume(1, 'none', 1, device)
             self._add_volume_device(volume.id, device)
             return volume
@@ -67,7 +68,8 @@ class BoshliteClient(BaseClient):
             self._wait('Waiting for snapshot {} to get ready...'.format(snapshot['id']),
                        lambda id: True,
                        None,
-                       snapshot)
+                       snapshot,
+                       resource_type='snapshot.create')
 
             snapshot = Snapshot(snapshot['id'], snapshot['volume_size'], snapshot['state'])
             self._add_snapshot(snapshot.id)
@@ -90,7 +92,8 @@ class BoshliteClient(BaseClient):
             self._wait('Waiting for snapshot {} to be deleted...'.format(snapshot_id),
                        lambda id: True,
                        None,
-                       snapshot_id)
+                       snapshot_id,
+                       resource_type='snapshot.delete')
 
             self._remove_snapshot(snapshot_id)
             self.logger.info('{} SUCCESS: snapshot-id={}'.format(log_prefix, snapshot_id))
@@ -114,7 +117,8 @@ class BoshliteClient(BaseClient):
             self._wait('Waiting for volume {} to get ready...'.format(volume['id']),
                        lambda vol: True,
                        None,
-                       volume)
+                       volume,
+                       resource_type='volume.create')
 
             volume = Volume(volume['id'], 'none', volume['size'])
             self._add_volume(volume.id)
@@ -137,7 +141,8 @@ class BoshliteClient(BaseClient):
             self._wait('Waiting for volume {} to be deleted...'.format(volume_id),
                        lambda id: True,
                        None,
-                       volume_id)
+                       volume_id,
+                       resource_type='volume.delete')
 
             self._remove_volume(volume_id)
             self.logger.info('{} SUCCESS: volume-id={}'.format(log_prefix, volume_id))
@@ -158,7 +163,8 @@ class BoshliteClient(BaseClient):
             self._wait('Waiting for attachment of volume {} to get ready...'.format(volume_id),
                        lambda vol: True,
                        None,
-                       None)
+                       None,
+                       resource_type='attachment.create')
 
             self._add_volume_device(volume_id, device)
             attachment = Attachment(0, volume_id, instance_id)
@@ -182,7 +188,8 @@ class BoshliteClient(BaseClient):
             self._wait('Waiting for attachment of volume {} to be removed...'.format(volume_id),
                        lambda vol: True,
                        None,
-                       None)
+                       None,
+                       resource_type='attachment.delete')
 
             self._remove_volume_device(volume_id)
             self._remove_attachment(volume_id, instance_id)
@@ -229,6 +236,26 @@ class BoshliteClient(BaseClient):
                 raise Exception(message)
 
 
+    def _upload_stream_to_blobstore(self, stream, blob_target_name):
+        log_prefix = '[OBJECTSTORE] [UPLOAD]'
+
+        if self.container:
+            self.logger.info('{} Started to stream the tarball to the object storage.'.format(log_prefix))
+            try:
+                blob_target_path = os.path.join(self.container, blob_target_name)
+                os.makedirs(os.path.dirname(blob_target_path), exist_ok=True)
+                with open(blob_target_path, 'wb') as blob_target_file:
+                    shutil.copyfileobj(stream, blob_target_file)
+                self.logger.info('{} SUCCESS: blob_target_name={}, container={}'
+                                 .format(log_prefix, blob_target_name, self.CONTAINER))
+                return True
+            except Exception as error:
+                message = '{} ERROR: blob_target_name={}, container={}\n{}'.format(log_prefix,
+                          blob_target_name, self.CONTAINER, error)
+                self.logger.error(message)
+                raise Exception(message)
+
+
     def _download_from_blobstore(self, blob_to_download_name, blob_download_target_path):
         log_prefix = '[OBJECTSTORE] [DOWNLOAD]'
 
@@ -245,3 +272,10 @@ class BoshliteClient(BaseClient):
                           blob_to_download_name, blob_download_target_path, self.CONTAINER, error)
                 self.logger.error(message)
                 raise Exception(message)
+
+
+    def _download_from_blobstore_and_pipe_to_process(self, process, blob_to_download_name, segment_size):
+        with open(os.path.join(self.container, blob_to_download_name), 'rb') as blob_file:
+            shutil.copyfileobj(blob_file, process.stdin, segment_size)
+
+        return True
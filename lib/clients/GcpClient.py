@@ -1,4 +1,3 @@
-from googleapiclient import discovery
 from google.oauth2 import service_account
 from google.cloud import storage
 from google.cloud.storage import Blob
@@ -6,32 +5,50 @@ from .BaseClient import BaseClient
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
+from ..utils.tracking_stream import TrackingStream
+from ..utils.lazy_import import LazyModule
+from ..utils.discovery_cache import DiscoveryDocumentCache, DEFAULT_TTL
+from ..utils.persistent_cache import PersistentCache
+from functools import cached_property
 import json
-import glob
+import os
+import requests
+import time
 import iso8601
 import pytz
 
+# The compute SDK is only imported once the compute client is used (not by blob operations)
+discovery = LazyModule('googleapiclient.discovery')
+
+# The metadata server of the instance the client runs on (GCE_METADATA_HOST is also honored by google-auth)
+METADATA_HOST = '169.254.169.254'
+METADATA_TIMEOUT = 1
+# The time in seconds after which a wait request for an operation returns at the latest
+OPERATION_WAIT_DURATION = 120
+
 class GcpClient(BaseClient):
     def __init__(self, operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time,
                  poll_maximum_time):
         super(GcpClient, self).__init__(operation_name, configuration, directory_persistent, directory_work_list,
                                         poll_delay_time, poll_maximum_time)
 
-        if configuration['credhub_url'] is None:
-            self.__gcpCredentials = json.loads(configuration['credentials'])
-            self.project_id = configuration['projectId']
-        else:
-            gcp_config = self._get_credentials_from_credhub(
-                configuration)
-            self.__gcpCredentials = gcp_config['credentials']
-            self.project_id = gcp_config['projectId']
+        self.__readCredentials(configuration)
 
         self.compute_api_name = 'compute'
         self.compute_api_version = 'v1'
+        # The compute discovery document and the zones of instances are cached on disk instead of being fetched on
+        # every start
+        cache_directory = configuration.get('cache_directory') or self.LAST_OPERATION_DIRECTORY or '.'
+        self.discovery_cache = DiscoveryDocumentCache(
+            cache_directory,
+            int(configuration['discovery_cache_ttl']) if configuration.get('discovery_cache_ttl') is not None
+            else DEFAULT_TTL, self.logger)
+        self.zone_cache = PersistentCache(
+            os.path.join(cache_directory, 'gcp_zones.json'),
+            int(configuration['zone_cache_ttl']) if configuration.get('zone_cache_ttl') is not None else DEFAULT_TTL)
         self.device_path_template = '/dev/disk/by-id/google-{}'
 
-        # +-> Create compute and storage clients
-        self.compute_client = self.create_compute_client()
+        # +-> Create the storage client (the compute client is created on first use)
         self.storage_client = self.create_storage_client()
 
         # +-> Check whether the given container exists and is accessible
@@ -51,12 +68,33 @@ class GcpClient(BaseClient):
                 self.last_operation(msg, 'failed')
                 raise Exception(msg)
 
+    def __readCredentials(self, configuration):
+        if configuration['credhub_url'] is None:
+            self.__gcpCredentials = json.loads(configuration['credentials'])
+            self.project_id = configuration['projectId']
+        else:
+            gcp_config = self._get_credentials_from_credhub(
+                configuration)
+            self.__gcpCredentials = gcp_config['credentials']
+            self.project_id = gcp_config['projectId']
+
+    def refresh_credentials(self, configuration):
+        self.__readCredentials(configuration)
+        self.storage_client = self.create_storage_client()
+        self.container = self._retry(self.get_container, [], True)
+        # The compute client is created again on next use
+        self.__dict__.pop('compute_client', None)
+
+    @cached_property
+    def compute_client(self):
+        return self.create_compute_client()
+
     def create_compute_client(self):
         try:
             credentials = service_account.Credentials.from_service_account_info(
                 self.__gcpCredentials)
             compute_client = discovery.build(
-                self.compute_api_name, self.compute_api_version, credentials=credentials)
+                self.compute_api_name, self.compute_api_version, credentials=credentials, cache=self.discovery_cache)
             return compute_client
         except Exception as error:
             raise Exception(
@@ -72,7 +110,38 @@ class GcpClient(BaseClient):
             raise Exception(
                 'Creation of storage client failed: {}'.format(error))
 
+    def _get_metadata(self, name):
+        response = requests.get(
+            'http://{}/computeMetadata/v1/instance/{}'.format(os.getenv('GCE_METADATA_HOST') or METADATA_HOST, name),
+            headers={'Metadata-Flavor': 'Google'}, timeout=METADATA_TIMEOUT)
+        response.raise_for_status()
+        return response.text
+
+    def _get_availability_zone_from_metadata_server(self, instance_id):
+        # Only answers for the instance the client runs on, which is the instance of all backups and restores
+        try:
+            if self._get_metadata('name') != instance_id:
+                return None
+            # e.g. projects/123456789/zones/europe-west1-b
+            return self._get_metadata('zone').rsplit('/', 1)[-1] or None
+        except Exception as error:
+            self.logger.warning('[GCP] Could not read the zone from the metadata server: {}'.format(error))
+            return None
+
     def _get_availability_zone_of_server(self, instance_id):
+        zone = self._get_availability_zone_from_metadata_server(instance_id)
+        if zone:
+            return zone
+        zone = self.zone_cache.get(instance_id)
+        if zone:
+            return zone
+        zone = self._find_availability_zone_of_server(instance_id)
+        if zone:
+            self.zone_cache.set(instance_id, zone)
+        return zone
+
+    def _find_availability_zone_of_server(self, instance_id):
+        # Scans the instances of all zones of the project, filtered by the name of the instance
         try:
             expression = 'name eq ' + instance_id
             request = self.compute_client.instances().aggregatedList(
@@ -175,25 +244,32 @@ class GcpClient(BaseClient):
                 instance=instance_id
             ).execute()
 
-            volume_list = []
+            devices = {}
             for disk in instance['disks']:
                 device = self._find_volume_device(disk['deviceName'])
-
                 if device is not None:
                     # Assuming the last part of the url is disk-name
-                    # Also, from https://cloud.google.com/compute/docs/regions-zones/
-                    # the disk and instance must belong to the same zone.
-                    # So, we can use instance zone.
-                    disk_name = disk['source'].rsplit('/', 1)[1]
-                    disk_details = self.compute_client.disks().get(
-                        project=self.project_id,
-                        zone=self.availability_zone,
-                        disk=disk_name
-                    ).execute()
-                    volume_list.append(
-                        Volume(disk_details['name'], disk_details['status'], disk_details['sizeGb'], device))
-
-            return volume_list
+                    devices[disk['source'].rsplit('/', 1)[1]] = device
+            if not devices:
+                return []
+
+            # One (filtered) list request for the details of all attached disks instead of one get per disk.
+            # Also, from https://cloud.google.com/compute/docs/regions-zones/
+            # the disk and instance must belong to the same zone.
+            # So, we can use instance zone.
+            disks = {}
+            expression = ' OR '.join('(name = "{}")'.format(disk_name) for disk_name in devices)
+            request = self.compute_client.disks().list(
+                project=self.project_id, zone=self.availability_zone, filter=expression)
+            while request is not None:
+                response = request.execute()
+                for disk_details in response.get('items', []):
+                    disks[disk_details['name']] = disk_details
+                request = self.compute_client.disks().list_next(
+                    previous_request=request, previous_response=response)
+
+            return [Volume(disks[disk_name]['name'], disks[disk_name]['status'], disks[disk_name]['sizeGb'], device)
+                    for disk_name, device in devices.items() if disk_name in disks]
         except Exception as error:
             self.logger.error(
                 '[GCP] ERROR: Unable to find or access attached volume for instance_id {}.{}'.format(
@@ -202,10 +278,10 @@ class GcpClient(BaseClient):
 
     def get_persistent_volume_for_instance(self, instance_id):
         try:
-            device = self.shell(
-                'cat {} | grep {}'.format(self.FILE_MOUNTS, self.DIRECTORY_PERSISTENT)).split(' ')[0][:8]
+            device = self.device_inventory.get_disk_of(
+                self.device_inventory.get_mount_device(self.DIRECTORY_PERSISTENT)).path
 
-            for volume in self.get_attached_volumes_for_instance(instance_id):
+            for volume in self._get_attached_volumes(instance_id):
                 if volume.device == device:
                     self._add_volume_device(volume.id, device)
                     return volume
@@ -232,11 +308,14 @@ class GcpClient(BaseClient):
             snapshot_creation_operation = self.compute_client.disks().createSnapshot(
                 project=self.project_id, zone=self.availability_zone, disk=volume_id, body=snapshot_body).execute()
 
-            self._wait('Waiting for snapshot {} to get ready...'.format(snapshot_name),
-                       (lambda operation_id, zonal_operation: self.get_operation_status(
-                           operation_id, zonal_operation) == 'DONE'),
-                       None,
-                       snapshot_creation_operation['name'], True)
+            self._wait_natively(lambda timeout: self._wait_for_operation(
+                                    snapshot_creation_operation['name'], True, timeout),
+                                'Waiting for snapshot {} to get ready...'.format(snapshot_name),
+                                (lambda operation_id, zonal_operation: self.get_operation_status(
+                                    operation_id, zonal_operation) == 'DONE'),
+                                None,
+                                snapshot_creation_operation['name'], True,
+                                resource_type='snapshot.create')
 
             snapshot = self._get_snapshot(snapshot_name)
             if snapshot.status == 'READY':
@@ -268,11 +347,14 @@ class GcpClient(BaseClient):
             snapshot_deletion_operation = self.compute_client.snapshots().delete(
                 project=self.project_id, snapshot=snapshot_id).execute()
 
-            self._wait('Waiting for snapshot {} to be deleted...'.format(snapshot_id),
-                       (lambda operation_id, zonal_operation: self.get_operation_status(
-                           operation_id, zonal_operation) == 'DONE'),
-                       None,
-                       snapshot_deletion_operation['name'], False)
+            self._wait_natively(lambda timeout: self._wait_for_operation(
+                                    snapshot_deletion_operation['name'], False, timeout),
+                                'Waiting for snapshot {} to be deleted...'.format(snapshot_id),
+                                (lambda operation_id, zonal_operation: self.get_operation_status(
+                                    operation_id, zonal_operation) == 'DONE'),
+                                None,
+                                snapshot_deletion_operation['name'], False,
+                                resource_type='snapshot.delete')
 
             snapshot_exists = self.snapshot_exists(snapshot_id)
 
@@ -319,11 +401,14 @@ class GcpClient(BaseClient):
             disk_creation_operation = self.compute_client.disks().insert(
                 project=self.project_id, zone=self.availability_zone, body=disk_body).execute()
 
-            self._wait('Waiting for volume {} to get ready...'.format(disk_name),
-                       (lambda operation_id, zonal_operation: self.get_operation_status(
-                           operation_id, zonal_operation) == 'DONE'),
-                       None,
-                       disk_creation_operation['name'], True)
+            self._wait_natively(lambda timeout: self._wait_for_operation(
+                                    disk_creation_operation['name'], True, timeout),
+                                'Waiting for volume {} to get ready...'.format(disk_name),
+                                (lambda operation_id, zonal_operation: self.get_operation_status(
+                                    operation_id, zonal_operation) == 'DONE'),
+                                None,
+                                disk_creation_operation['name'], True,
+                                resource_type='volume.create')
 
             volume = self._get_volume(disk_name)
 
@@ -352,11 +437,14 @@ class GcpClient(BaseClient):
             disk_deletion_operation = self.compute_client.disks().delete(
                 project=self.project_id, zone=self.availability_zone, disk=volume_id).execute()
 
-            self._wait('Waiting for disk {} to be deleted...'.format(volume_id),
-                       (lambda operation_id, zonal_operation: self.get_operation_status(
-                           operation_id, zonal_operation) == 'DONE'),
-                       None,
-                       disk_deletion_operation['name'], True)
+            self._wait_natively(lambda timeout: self._wait_for_operation(
+                                    disk_deletion_operation['name'], True, timeout),
+                                'Waiting for disk {} to be deleted...'.format(volume_id),
+                                (lambda operation_id, zonal_operation: self.get_operation_status(
+                                    operation_id, zonal_operation) == 'DONE'),
+                                None,
+                                disk_deletion_operation['name'], True,
+                                resource_type='volume.delete')
 
             volume_exists = self.volume_exists(volume_id)
 
@@ -397,15 +485,20 @@ class GcpClient(BaseClient):
             disk_attach_operation = self.compute_client.instances().attachDisk(
                 project=self.project_id, zone=self.availability_zone, instance=instance_id, body=attached_disk_body).execute()
 
-            self._wait('Waiting for attachment of volume {} to get ready...'.format(volume_id),
-                       (lambda operation_id, zonal_operation: self.get_operation_status(
-                           operation_id, zonal_operation) == 'DONE'),
-                       None,
-                       disk_attach_operation['name'], True)
+            self._wait_natively(lambda timeout: self._wait_for_operation(
+                                    disk_attach_operation['name'], True, timeout),
+                                'Waiting for attachment of volume {} to get ready...'.format(volume_id),
+                                (lambda operation_id, zonal_operation: self.get_operation_status(
+                                    operation_id, zonal_operation) == 'DONE'),
+                                None,
+                                disk_attach_operation['name'], True,
+                                resource_type='attachment.create')
 
             # Here volume_id is the device name.
             # Raise exception if device returned in None,
             # as it might mean that disk was not attached properly
+            self._wait_for_device(volume_id, lambda: self.device_inventory.get_link_target(
+                self.device_path_template.format(volume_id)))
             device = self._find_volume_device(volume_id)
             if device is not None:
                 self.logger.info(
@@ -449,11 +542,14 @@ class GcpClient(BaseClient):
             disk_detach_operation = self.compute_client.instances().detachDisk(
                 project=self.project_id, zone=self.availability_zone, instance=instance_id, deviceName=volume_id).execute()
 
-            self._wait('Waiting for attachment of volume {} to be deleted...'.format(volume_id),
-                       (lambda operation_id, zonal_operation: self.get_operation_status(
-                           operation_id, zonal_operation) == 'DONE'),
-                       None,
-                       disk_detach_operation['name'], True)
+            self._wait_natively(lambda timeout: self._wait_for_operation(
+                                    disk_detach_operation['name'], True, timeout),
+                                'Waiting for attachment of volume {} to be deleted...'.format(volume_id),
+                                (lambda operation_id, zonal_operation: self.get_operation_status(
+                                    operation_id, zonal_operation) == 'DONE'),
+                                None,
+                                disk_detach_operation['name'], True,
+                                resource_type='attachment.delete')
 
             self._remove_volume_device(volume_id)
             self._remove_attachment(volume_id, instance_id)
@@ -476,16 +572,11 @@ class GcpClient(BaseClient):
         # /dev/disk/by-id/google-* tree of a Linux operating system running within the instance.
         # Here, volume_id parameter is actually a deviceName for GCP.
         try:
-            device = None
-            device_path = glob.glob(
+            device = self.device_inventory.get_link_target(
                 self.device_path_template.format(volume_id))
-            if len(device_path) != 1:
-                raise Exception(
-                    'Expected number of device path not matching 1 != {} for disk {}'.format(
-                        len(device_path), volume_id))
-
-            device = self.shell(
-                'readlink -e {}'.format(device_path[0])).rstrip()
+            if not device:
+                raise Exception('Device path {} not found for disk {}'.format(
+                    self.device_path_template.format(volume_id), volume_id))
             return device
         except Exception as error:
             self.logger.error(
@@ -531,6 +622,43 @@ class GcpClient(BaseClient):
             self.logger.error(message)
             raise Exception(message)
 
+    def _upload_stream_to_blobstore(self, stream, blob_target_name, chunk_size=(1 << 26)):
+        """Upload a stream of unknown size to blobstore.
+        :type chunk_size: int
+        :param chunk_size: The stream is uploaded with a resumable upload, chunk by chunk.
+                           This must be a multiple of 256 KB per the API specification (default: 64 MiB).
+        """
+        log_prefix = '[Google Cloud Storage] [UPLOAD]'
+        if self.container:
+            self.logger.info(
+                '{} Started to stream the tarball to the object storage.'.format(log_prefix))
+            try:
+                blob = Blob(blob_target_name, self.container,
+                            chunk_size=chunk_size)
+                blob.upload_from_file(TrackingStream(stream))
+                self.logger.info('{} SUCCESS: blob_target_name={}, container={}'
+                                 .format(log_prefix, blob_target_name, self.CONTAINER))
+                return True
+            except Exception as error:
+                message = '{} ERROR: blob_target_name={}, container={}\n{}'.format(
+                    log_prefix, blob_target_name, self.CONTAINER, error)
+                self.logger.error(message)
+                raise Exception(message)
+        else:
+            message = '{} ERROR: blob_target_name={}, container={}\n{}'.format(
+                log_prefix, blob_target_name, self.CONTAINER, "Container not found or accessible")
+            self.logger.error(message)
+            raise Exception(message)
+
+    def _get_blob_size(self, blob_name):
+        blob = Blob(blob_name, self.container)
+        blob.reload()
+        return blob.size
+
+    def _get_blob_range(self, blob_name, offset, length):
+        # The end of the range is inclusive
+        return Blob(blob_name, self.container).download_as_bytes(start=offset, end=offset + length - 1)
+
     def _download_from_blobstore(self, blob_to_download_name, blob_download_target_path, chunk_size=None):
         """Download file from blobstore.
         :type chunk_size: int
@@ -544,9 +672,14 @@ class GcpClient(BaseClient):
             self.logger.info('{} Started to download the tarball to target.'.format(
                 log_prefix, blob_download_target_path))
             try:
-                blob = Blob(blob_to_download_name,
-                            self.container, chunk_size=chunk_size)
-                blob.download_to_filename(blob_download_target_path)
+                blob_size = self._get_blob_size(blob_to_download_name)
+                if self._use_ranged_download(blob_size):
+                    with open(blob_download_target_path, 'wb') as downloaded_file:
+                        self._download_blob_in_ranges(blob_to_download_name, blob_size, downloaded_file.write)
+                else:
+                    blob = Blob(blob_to_download_name,
+                                self.container, chunk_size=chunk_size)
+                    blob.download_to_filename(blob_download_target_path)
                 self.logger.info('{} SUCCESS: blob_to_download={}, blob_target_name={}, container={}'
                                  .format(log_prefix, blob_to_download_name, self.CONTAINER,
                                          blob_download_target_path))
@@ -562,6 +695,30 @@ class GcpClient(BaseClient):
             self.logger.error(message)
             raise Exception(message)
 
+    def _download_from_blobstore_and_pipe_to_process(self, process, blob_to_download_name, segment_size):
+        blob_size = self._get_blob_size(blob_to_download_name)
+        self._download_blob_in_ranges(blob_to_download_name, blob_size, process.stdin.write)
+        return True
+
+    def _wait_for_operation(self, operation_id, zonal_operation, timeout):
+        """Wait for an operation with the long polling of the Compute Engine API. The wait requests return as soon as
+        the operation is done, but after about 2 minutes at the latest. A wait request is only sent if it cannot
+        overrun the timeout; the rest of the time is left to the polling of _wait_natively.
+        """
+        deadline = time.time() + timeout
+        while deadline - time.time() >= OPERATION_WAIT_DURATION:
+            if zonal_operation:
+                result = self.compute_client.zoneOperations().wait(
+                    project=self.project_id,
+                    zone=self.availability_zone,
+                    operation=operation_id).execute()
+            else:
+                result = self.compute_client.globalOperations().wait(
+                    project=self.project_id,
+                    operation=operation_id).execute()
+            if result['status'] == 'DONE':
+                return
+
     def get_operation_status(self, operation_id, zonal_operation):
         """Get the operations status.
         The function returns the status of the operation and it can take values as PENDING, RUNNING, or DONE.
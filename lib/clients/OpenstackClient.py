@@ -1,15 +1,22 @@
 import time
 import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from keystoneauth1.identity.v3 import Password as KeystonePassword
 from keystoneauth1.session import Session as KeystoneSession
-from novaclient.client import Client as NovaClient
-from cinderclient.client import Client as CinderClient
 from swiftclient.client import Connection as SwiftClient
 from swiftclient.service import SwiftService, SwiftUploadObject
 from .BaseClient import BaseClient
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
+from ..utils.lazy_import import LazyAttribute
+
+# The compute and block storage SDKs are only imported once their clients are used
+NovaClient = LazyAttribute('novaclient.client', 'Client')
+CinderClient = LazyAttribute('cinderclient.client', 'Client')
 
 
 class OpenstackClient(BaseClient):
@@ -17,21 +24,15 @@ class OpenstackClient(BaseClient):
                  poll_maximum_time):
         super(OpenstackClient, self).__init__(operation_name, configuration, directory_persistent, directory_work_list,
                                               poll_delay_time, poll_maximum_time)      
-        if configuration['credhub_url'] is None:
-            self.__setCredentials(configuration)
-        else:
-            self.logger.info('fetching creds from credhub')
-            credentials = self._get_credentials_from_credhub(configuration)
-            self.__setCredentials(credentials)
+        self.__readCredentials(configuration)
 
         # The SAP certificiates required to establish a secure connection to
         # OpenStack are already pre-installed on the VMs (/etc/ssl/certs)
         certificates_path = os.getenv('SF_BACKUP_RESTORE_CERTS')
         self.__certificatesPath = '/etc/ssl/certs' if certificates_path is None else certificates_path
-        self.nova = self.create_nova_client()
-        self.cinder = self.create_cinder_client()
         self.swift = self.create_swift_client()
         self.swift.service = self.create_swift_service(self.swift.get_auth()[0])
+        self.__threadSwiftClients = threading.local()
 
         # +-> Check whether the given container exists
         self.container = self.get_container()
@@ -47,6 +48,14 @@ class OpenstackClient(BaseClient):
             self.last_operation(msg, 'failed')
             raise Exception(msg)
 
+    def __readCredentials(self, configuration):
+        if configuration['credhub_url'] is None:
+            self.__setCredentials(configuration)
+        else:
+            self.logger.info('fetching creds from credhub')
+            credentials = self._get_credentials_from_credhub(configuration)
+            self.__setCredentials(credentials)
+
     def __setCredentials(self, credentials):
         self.__keystoneCredentials = {
             'username': credentials['username'],
@@ -57,6 +66,19 @@ class OpenstackClient(BaseClient):
             'project_name': credentials['tenant_name']
         }
     
+    def refresh_credentials(self, configuration):
+        self.__readCredentials(configuration)
+        self.swift = self.create_swift_client()
+        self.swift.service = self.create_swift_service(self.swift.get_auth()[0])
+        self.__threadSwiftClients = threading.local()
+        container = self.get_container()
+        if not container:
+            raise Exception('Could not find or access the given container.')
+        self.container = container
+        # The nova and cinder clients are created again with a new keystone session on next use
+        self.__dict__.pop('nova', None)
+        self.__dict__.pop('cinder', None)
+
     def create_keystone_session(self):
         try:
             auth = KeystonePassword(**self.__keystoneCredentials)
@@ -67,6 +89,14 @@ class OpenstackClient(BaseClient):
             raise Exception('Connection to Keystone failed: {}'.format(error))
 
 
+    @cached_property
+    def nova(self):
+        return self.create_nova_client()
+
+    @cached_property
+    def cinder(self):
+        return self.create_cinder_client()
+
     def create_nova_client(self):
         return NovaClient(version='2',
                                  session=self.create_keystone_session())
@@ -91,6 +121,27 @@ class OpenstackClient(BaseClient):
             raise Exception('Connection to Swift failed: {}'.format(error))
 
 
+    def create_thread_swift_client(self):
+        # Reuses the token of the main connection, swiftclient authenticates again once it expired
+        return SwiftClient(auth_version='3',
+                           os_options=self.__keystoneCredentials,
+                           authurl=self.__keystoneCredentials['auth_url'],
+                           user=self.__keystoneCredentials['username'],
+                           key=self.__keystoneCredentials['password'],
+                           cacert=self.__certificatesPath,
+                           preauthurl=self.swift.url,
+                           preauthtoken=self.swift.token)
+
+    def __getThreadSwiftClient(self):
+        # A swiftclient Connection keeps the response of its last request, hence each thread downloading byte
+        # ranges needs its own connection
+        swift = getattr(self.__threadSwiftClients, 'swift', None)
+        if swift is None:
+            swift = self.create_thread_swift_client()
+            self.__threadSwiftClients.swift = swift
+        return swift
+
+
     def create_swift_service(self, storage_url):
         try:
             return SwiftService(options={
@@ -145,21 +196,52 @@ class OpenstackClient(BaseClient):
             return None
 
 
+    def _get_resources(self, get, resource_ids):
+        # Cinder cannot filter by a list of ids: every resource is fetched by its id, the gets of a tick concurrently.
+        # Resources which do not exist (anymore) are left out, other errors are raised.
+        if not resource_ids:
+            return []
+
+        def get_or_none(resource_id):
+            try:
+                return get(resource_id)
+            except Exception as error:
+                if getattr(error, 'code', None) == 404:
+                    return None
+                raise
+
+        with ThreadPoolExecutor(max_workers=len(resource_ids)) as executor:
+            return [resource for resource in executor.map(get_or_none, resource_ids) if resource is not None]
+
+    def _get_snapshots(self, snapshot_ids):
+        return {snapshot.id: Snapshot(snapshot.id, snapshot.size, snapshot.created_at, snapshot.status)
+                for snapshot in self._get_resources(self.cinder.volume_snapshots.get, snapshot_ids)}
+
+    def _get_volumes(self, volume_ids):
+        return {volume.id: Volume(volume.id, volume.status, volume.size)
+                for volume in self._get_resources(self.cinder.volumes.get, volume_ids)}
+
+
     def get_attached_volumes_for_instance(self, instance_id):
         try:
             volumes = self.nova.volumes.get_server_volumes(instance_id)
-            return [Volume(volume.id, 'none', self.cinder.volumes.get(volume.id).size, volume.device)
-                    for volume in volumes]
+            # Cinder cannot list the volumes of a server, hence the sizes of the few attached volumes are fetched by
+            # their ids, concurrently
+            sizes = self._get_volumes([volume.id for volume in volumes])
+            return [Volume(volume.id, 'none', sizes[volume.id].size, volume.device) for volume in volumes]
         except Exception as error:
             self.logger.error('[NOVA] Error while getting attached volumes for instance {}.\n{}'.format(instance_id, error))
             return []
 
 
     def get_persistent_volume_for_instance(self, instance_id):
-        device = self.shell('cat /proc/mounts | grep {}'.format(self.DIRECTORY_PERSISTENT)).split(' ')[0][:-1]
-        # Cut the last letter which marks the partition as we only need the 'plain' device name
+        disk = self.device_inventory.get_disk_of(self.device_inventory.get_mount_device(self.DIRECTORY_PERSISTENT))
+        if not disk:
+            return None
+        # The disk of the mounted partition, as we only need the 'plain' device name
+        device = disk.path
 
-        for volume in self.get_attached_volumes_for_instance(instance_id):
+        for volume in self._get_attached_volumes(instance_id):
             if volume.device == device:
                 self._add_volume_device(volume.id, device)
                 return volume
@@ -179,10 +261,10 @@ class OpenstackClient(BaseClient):
                 description='Service-Fabrik: Automated backup'
             )
 
-            self._wait('Waiting for snapshot {} to get ready...'.format(snapshot.id),
-                       lambda snap: self._get_snapshot(snap.id).status == 'available',
-                       None,
-                       snapshot)
+            self._wait_batched(self._get_snapshots, snapshot.id,
+                               lambda snap: snap is not None and snap.status == 'available',
+                               'Waiting for snapshot {} to get ready...'.format(snapshot.id),
+                               resource_type='snapshot.create')
 
             snapshot = Snapshot(snapshot.id, snapshot.size, snapshot.created_at, snapshot.status)
             self._add_snapshot(snapshot.id)
@@ -204,10 +286,10 @@ class OpenstackClient(BaseClient):
         try:
             self.cinder.volume_snapshots.delete(snapshot_id)
 
-            self._wait('Waiting for snapshot {} to be deleted...'.format(snapshot_id),
-                       lambda id: not self._get_snapshot(id),
-                       None,
-                       snapshot_id)
+            self._wait_batched(self._get_snapshots, snapshot_id,
+                               lambda snap: not snap,
+                               'Waiting for snapshot {} to be deleted...'.format(snapshot_id),
+                               resource_type='snapshot.delete')
 
             self._remove_snapshot(snapshot_id)
             self.logger.info('{} SUCCESS: snapshot-id={}'.format(log_prefix, snapshot_id))
@@ -237,10 +319,10 @@ class OpenstackClient(BaseClient):
 
             volume = self.cinder.volumes.create(**kwargs)
 
-            self._wait('Waiting for volume {} to get ready...'.format(volume.id),
-                       lambda id: self._get_volume(id).status == 'available',
-                       None,
-                       volume.id)
+            self._wait_batched(self._get_volumes, volume.id,
+                               lambda vol: vol is not None and vol.status == 'available',
+                               'Waiting for volume {} to get ready...'.format(volume.id),
+                               resource_type='volume.create')
 
             volume = Volume(volume.id, 'none', size)
             self._add_volume(volume.id)
@@ -262,10 +344,10 @@ class OpenstackClient(BaseClient):
         try:
             self.cinder.volumes.delete(volume_id)
 
-            self._wait('Waiting for volume {} to be deleted...'.format(volume_id),
-                       lambda id: not self._get_volume(id),
-                       None,
-                       volume_id)
+            self._wait_batched(self._get_volumes, volume_id,
+                               lambda vol: not vol,
+                               'Waiting for volume {} to be deleted...'.format(volume_id),
+                               resource_type='volume.delete')
 
             self._remove_volume(volume_id)
             self.logger.info('{} SUCCESS: volume-id={}'.format(log_prefix, volume_id))
@@ -287,10 +369,10 @@ class OpenstackClient(BaseClient):
         try:
             attachment = self.nova.volumes.create_server_volume(instance_id, volume_id)
 
-            self._wait('Waiting for attachment of volume {} to get ready...'.format(volume_id),
-                       lambda id: self._get_volume(id).status == 'in-use',
-                       None,
-                       volume_id)
+            self._wait_batched(self._get_volumes, volume_id,
+                               lambda vol: vol is not None and vol.status == 'in-use',
+                               'Waiting for attachment of volume {} to get ready...'.format(volume_id),
+                               resource_type='attachment.create')
 
             self._add_volume_device(volume_id, self._find_volume_device(volume_id))
             attachment = Attachment(attachment.id, volume_id, instance_id)
@@ -313,10 +395,10 @@ class OpenstackClient(BaseClient):
         try:
             self.nova.volumes.delete_server_volume(instance_id, volume_id)
 
-            self._wait('Waiting for attachment of volume {} to be removed...'.format(volume_id),
-                       lambda id: self._get_volume(id).status == 'available',
-                       None,
-                       volume_id)
+            self._wait_batched(self._get_volumes, volume_id,
+                               lambda vol: vol is not None and vol.status == 'available',
+                               'Waiting for attachment of volume {} to be removed...'.format(volume_id),
+                               resource_type='attachment.delete')
 
             self._remove_volume_device(volume_id)
             self._remove_attachment(volume_id, instance_id)
@@ -335,11 +417,9 @@ class OpenstackClient(BaseClient):
     def _find_volume_device(self, volume_id):
         self.shell('udevadm trigger', False)
         # create symbol links at /dev/disk/by-id/virtio-<uuid> pointing to the real device name
-        time.sleep(3)
-        result = self.shell('ls /dev/disk/by-id/ | egrep {}'.format(volume_id[:20].replace('-', '-?')), False)
-        if result:
-            result = '/dev/disk/by-id/{}'.format(result.split('\n')[0])
-        return result
+        links = self._wait_for_device(volume_id, lambda: self.device_inventory.find_links(
+            volume_id[:20].replace('-', '-?')))
+        return links[0] if links else None
 
 
     def get_mountpoint(self, volume_id, partition=None):
@@ -393,6 +473,73 @@ class OpenstackClient(BaseClient):
             raise Exception(message)
 
 
+    def _upload_stream_to_blobstore(self, stream, blob_target_name):
+        log_prefix = '[SWIFT] [UPLOAD]'
+        segment_size = (1 << 30) # 1 GiB segment size
+        chunk_size = 65536 # 64 KiB
+
+        def read_segment(first_chunk):
+            # Yield the chunks of one segment, stopping at the segment boundary or at the end of the stream
+            remaining = segment_size - len(first_chunk)
+            yield first_chunk
+            while remaining > 0:
+                chunk = stream.read(min(chunk_size, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+        if self.container:
+            self.logger.info('{} Started to stream the tarball to the object storage.'.format(log_prefix))
+            try:
+                # The size of the stream is unknown, therefore it is stored as a dynamic large object:
+                # numbered segments below a common prefix plus a manifest object pointing to that prefix.
+                # Every upload gets its own prefix, so segments left by a previous upload are never part of it
+                segment_prefix = '{}/stream/{}/'.format(blob_target_name, uuid.uuid4().hex)
+                segment_index = 0
+                chunk = stream.read(chunk_size)
+                while chunk:
+                    self.swift.put_object(self.CONTAINER, '{}{:08d}'.format(segment_prefix, segment_index),
+                                          contents=read_segment(chunk), chunk_size=chunk_size)
+                    self.logger.info('{} Uploaded segment {} of blob_target_name={}'.format(
+                        log_prefix, segment_index, blob_target_name))
+                    segment_index += 1
+                    chunk = stream.read(chunk_size)
+                self.swift.put_object(self.CONTAINER, blob_target_name, contents=b'',
+                                      headers={'X-Object-Manifest': '{}/{}'.format(self.CONTAINER, segment_prefix)})
+                self.logger.info('{} SUCCESS: blob_target_name={}, container={}, segment_size={}, segments={}'
+                                 .format(log_prefix, blob_target_name, self.CONTAINER, segment_size, segment_index))
+                self.__deleteStaleSegments(blob_target_name, segment_prefix)
+                return True
+            except Exception as error:
+                message = '{} ERROR: blob_target_name={}, container={}\n{}'.format(log_prefix,
+                          blob_target_name, self.CONTAINER, error)
+                self.logger.error(message)
+                raise Exception(message)
+
+    def __deleteStaleSegments(self, blob_target_name, segment_prefix):
+        # Remove the segments of previous uploads once the manifest points to the new ones. A failure only leaves
+        # unreferenced segments behind, therefore it does not fail the upload
+        log_prefix = '[SWIFT] [UPLOAD]'
+        try:
+            _, objects = self.swift.get_container(self.CONTAINER, prefix='{}/stream/'.format(blob_target_name),
+                                                  full_listing=True)
+            for swift_object in objects:
+                if not swift_object['name'].startswith(segment_prefix):
+                    self.swift.delete_object(self.CONTAINER, swift_object['name'])
+        except Exception as error:
+            self.logger.warning('{} Could not delete the stale segments of blob_target_name={}\n{}'.format(
+                log_prefix, blob_target_name, error))
+
+    def _get_blob_size(self, blob_name):
+        # For segmented (DLO) objects the manifest reports the size of the concatenated segments
+        return int(self.swift.head_object(self.CONTAINER, blob_name)['content-length'])
+
+    def _get_blob_range(self, blob_name, offset, length):
+        swift = self.__getThreadSwiftClient()
+        return swift.get_object(self.CONTAINER, blob_name,
+                                headers={'Range': 'bytes={}-{}'.format(offset, offset + length - 1)})[1]
+
     def _download_from_blobstore(self, blob_to_download_name, blob_download_target_path):
         log_prefix = '[SWIFT] [DOWNLOAD]'
         segment_size = 65536 # 64 KiB  
@@ -401,10 +548,15 @@ class OpenstackClient(BaseClient):
             self.logger.info('{} Started to download the tarball to target {}.'.format(log_prefix,
                                                                                        blob_download_target_path))
             try:
-                swift_object = self.swift.get_object(self.CONTAINER, blob_to_download_name, resp_chunk_size=segment_size)
+                blob_size = self._get_blob_size(blob_to_download_name)
                 with open(blob_download_target_path, 'wb') as downloaded_file:
-                    for chunk in swift_object[1]:
-                        downloaded_file.write(chunk)
+                    if self._use_ranged_download(blob_size):
+                        self._download_blob_in_ranges(blob_to_download_name, blob_size, downloaded_file.write)
+                    else:
+                        swift_object = self.swift.get_object(self.CONTAINER, blob_to_download_name,
+                                                             resp_chunk_size=segment_size)
+                        for chunk in swift_object[1]:
+                            downloaded_file.write(chunk)
 
                 self.logger.info('{} SUCCESS: blob_to_download={}, blob_target_name={}, container={}'
                                  .format(log_prefix, blob_to_download_name, blob_download_target_path,
@@ -418,6 +570,11 @@ class OpenstackClient(BaseClient):
 
 
     def _download_from_blobstore_and_pipe_to_process(self, process, blob_to_download_name, segment_size):
+        blob_size = self._get_blob_size(blob_to_download_name)
+        if self._use_ranged_download(blob_size):
+            self._download_blob_in_ranges(blob_to_download_name, blob_size, process.stdin.write)
+            return True
+
         swift_object = self.swift.get_object(self.CONTAINER, blob_to_download_name, resp_chunk_size=segment_size)
         for chunk in swift_object[1]:
             process.stdin.write(chunk)
@@ -0,0 +1,143 @@
+import shutil
+import subprocess
+from .utils.cancellation import terminate_process_group
+
+# Compression programs used by tar (-I). pigz writes gzip archives with all cores and falls back to gzip if it is
+# not installed; zstd compresses with all cores (-T0). The magic bytes identify the codec of an archive on restore.
+CODECS = {
+    'gzip': {
+        'compress': 'gzip -{level}',
+        'decompress': 'gzip -d',
+        'magic': b'\x1f\x8b',
+        'default_level': 6
+    },
+    'pigz': {
+        'compress': 'pigz -{level}',
+        'decompress': 'pigz -d',
+        'magic': b'\x1f\x8b',
+        'default_level': 6,
+        'fallback': 'gzip'
+    },
+    'zstd': {
+        'compress': 'zstd -q -T0 -{level}',
+        'decompress': 'zstd -q -d',
+        'magic': b'\x28\xb5\x2f\xfd',
+        'default_level': 3
+    },
+    'lz4': {
+        'compress': 'lz4 -q -{level}',
+        'decompress': 'lz4 -q -d',
+        'magic': b'\x04\x22\x4d\x18',
+        'default_level': 1
+    }
+}
+DEFAULT_CODEC = 'gzip'
+MAGIC_SIZE = 4
+
+
+def _is_installed(codec):
+    return shutil.which(CODECS[codec]['compress'].split()[0]) is not None
+
+
+def resolve_codec(codec):
+    """Return the codec to be used for the given one, i.e. its fallback if the program is not installed.
+
+    :param codec: the name of a codec in CODECS
+    """
+    fallback = CODECS[codec].get('fallback')
+    if fallback and not _is_installed(codec):
+        return fallback
+    return codec
+
+
+def compress_program(codec, level=None):
+    return CODECS[codec]['compress'].format(level=level if level is not None else CODECS[codec]['default_level'])
+
+
+def decompress_program(codec):
+    return CODECS[resolve_codec(codec)]['decompress']
+
+
+def detect_codec(data):
+    """Detect the codec of an archive from its first bytes.
+
+    :param data: at least the first 4 bytes of the archive
+    :returns: the name of the codec, or None for an uncompressed tarball
+    """
+    for codec in ('pigz', 'zstd', 'lz4'):
+        if data[:len(CODECS[codec]['magic'])] == CODECS[codec]['magic']:
+            return resolve_codec(codec)
+    return None
+
+
+def tar_create_command(directory, codec, level=None, archive='-', options='', file_list=None):
+    # With a file list (null separated paths relative to the directory), exactly the listed entries are archived
+    names = '--no-recursion --null -T {}'.format(file_list) if file_list else '.'
+    return 'tar -cp{} -I \'{}\' -f {} -C {} {}'.format(options, compress_program(codec, level), archive, directory,
+                                                     names)
+
+
+def tar_extract_command(directory, codec, archive='-', options=''):
+    if codec is None:
+        return 'tar -x{} -f {} -C {}/'.format(options, archive, directory)
+    return 'tar -x{} -I \'{}\' -f {} -C {}/'.format(options, decompress_program(codec), archive, directory)
+
+
+class ExtractingWriter:
+    """A writable file-like object extracting the tarball written to it into a directory.
+
+    The tar subprocess is started with the first write, once the codec has been detected from the magic bytes.
+
+    :param directory: the directory the tarball is extracted to
+    :param bufsize: (optional) the buffer size of the pipe to tar
+
+    :Example:
+        ::
+
+            writer = ExtractingWriter('/var/vcap/store/blueprint/files')
+            decrypt_stream(encrypted_file, writer, secret)
+            writer.close()
+    """
+
+    def __init__(self, directory, bufsize=-1):
+        self.directory = directory
+        self.bufsize = bufsize
+        self.process = None
+        self.buffer = b''
+        self.codec = None
+
+    def _start(self):
+        self.codec = detect_codec(self.buffer)
+        self.process = subprocess.Popen(tar_extract_command(self.directory, self.codec), stdin=subprocess.PIPE,
+                                        shell=True, bufsize=self.bufsize, start_new_session=True)
+        self.process.stdin.write(self.buffer)
+        self.buffer = b''
+
+    def write(self, data):
+        if self.process:
+            self.process.stdin.write(data)
+            return len(data)
+        self.buffer += data
+        if len(self.buffer) >= MAGIC_SIZE:
+            self._start()
+        return len(data)
+
+    def close(self):
+        """Finish the extraction.
+
+        :returns: the exit code of tar
+        """
+        if not self.process:
+            self._start()
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            # tar exited early, its exit code tells why
+            pass
+        return self.process.wait()
+
+    def abort(self):
+        """Kill tar after an error, e.g. if the download was cancelled."""
+        if self.process:
+            # tar and its compression program are terminated along with the shell
+            terminate_process_group(self.process)
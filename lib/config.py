@@ -1,5 +1,6 @@
 import os
 from argparse import ArgumentParser
+from .utils.last_operation_writer import replace_symlink
 from .utils.merge_dict import merge_dict
 from .logger import init_logger
 
@@ -33,7 +34,10 @@ parameters_credentials = {
     },
     'gcp': {
         'projectId': 'GCP Project id',
-        'credentials': 'GCP Service Account Details'
+        'credentials': 'GCP Service Account Details',
+        'cache_directory': 'the directory the GCP compute API discovery document and the zones of instances are cached in (default: the last operation directory)',
+        'discovery_cache_ttl': 'the time (in seconds) the cached discovery document is used (default: 86400)',
+        'zone_cache_ttl': 'the time (in seconds) the cached zone of an instance is used (default: 86400)'
     },
     'openstack': {
         'tenant_id': 'OpenStack Tenant-ID the VM is deployed in',
@@ -83,6 +87,34 @@ parameters_restore_optional = {
     'agent_ip': 'IP of the agent VM'
 }
 
+parameters_archive = {
+    'encryption': 'the encryption of new backups [possible values: native/gpg] (default: gpg)',
+    'compression': 'the compression of new backups [possible values: gzip/pigz/zstd/lz4] (default: gzip)',
+    'compression_level': 'the compression level of new backups (default: the default level of the codec)',
+    'shards': 'the number of concurrent tar streams of sharded backups (default: number of cores)'
+}
+
+parameters_transfer = {
+    'upload_part_size': 'the size (in MiB) of the parts of multipart uploads to the object storage (default: 16)',
+    'upload_max_concurrency': 'the maximum number of parts uploaded to the object storage in parallel (default: 8)',
+    'upload_buffer_size': 'the maximum size (in MiB) of the parts read for uploads at the same time (default: 1024)',
+    'upload_multipart_threshold': 'the size (in MiB) from which on blobs are uploaded in multiple parts (default: 64)',
+    'download_range_size': 'the size (in MiB) of the byte ranges of ranged downloads from the object storage (default: 16)',
+    'download_max_concurrency': 'the maximum number of byte ranges downloaded in parallel (default: 8)',
+    'download_buffer_size': 'the maximum size (in MiB) of downloaded byte ranges waiting to be written in order (default: 256)',
+    'download_multipart_threshold': 'the size (in MiB) from which on blobs are downloaded in byte ranges (default: 64)'
+}
+
+parameters_wait = {
+    'wait_strategy': 'the polling of IaaS operations (e.g. snapshot creation) [possible values: fixed/exponential/predictive] (default: exponential)',
+    'wait_history_file': 'the file the predictive wait strategy keeps completion times in (default: wait_history.json in the last operation directory)',
+    'device_timeout': 'the maximum time in seconds the device of an attached volume may take to appear on the machine (default: 60)'
+}
+
+parameters_clean_up = {
+    'early_service_restart': 'start the service job as soon as the created volumes are detached, while they and the snapshots are still being deleted'
+}
+
 def _get_parameters_credentials():
     return parameters_credentials
 
@@ -100,6 +132,18 @@ def _get_parameters_restore_optional():
 def _get_parameters_blob_operation():
     return merge_dict(parameters, parameters_blob_operation)
 
+def _get_parameters_archive():
+    return parameters_archive
+
+def _get_parameters_transfer():
+    return parameters_transfer
+
+def _get_parameters_wait():
+    return parameters_wait
+
+def _get_parameters_clean_up():
+    return parameters_clean_up
+
 def remove_old_logs_state():
     """
     Remove all the files in the directories pointed by SF_BACKUP_RESTORE_LOG_DIRECTORY
@@ -149,6 +193,18 @@ def build_parser(type):
         for name, description in credentials.items():
             parser.add_argument('--{}'.format(name), help=description)
 
+    for name, description in _get_parameters_archive().items():
+        parser.add_argument('--{}'.format(name), help=description)
+
+    for name, description in _get_parameters_transfer().items():
+        parser.add_argument('--{}'.format(name), help=description, type=int)
+
+    for name, description in _get_parameters_wait().items():
+        parser.add_argument('--{}'.format(name), help=description)
+
+    for name, description in _get_parameters_clean_up().items():
+        parser.add_argument('--{}'.format(name), help=description, action='store_true')
+
     return parser
 
 def parse_options(type):
@@ -203,7 +259,7 @@ def initialize(operation_name):
             open(path_green, 'w+').close()
         # +-> Create symlink to blue file and clear old log entries
         if operation == operation_name:
-            os.system('ln -sf {} {}'.format(path_blue, path_link))
+            replace_symlink(path_blue, path_link)
             open(path_log, 'w+').close()
 
     init_logger(os.path.join(directory_logfile, operation_name + '.log'))
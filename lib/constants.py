@@ -6,4 +6,17 @@ APIS = {
         'DOMAIN': 'ecs.aliyuncs.com',
         'VERSION': '2014-05-26'
     }
-}
\ No newline at end of file
+}
+MIB = 1024 * 1024
+
+# Default tuning of the transfers from/to the object storage (sizes in MiB)
+TRANSFER = {
+    'upload_part_size': 16,
+    'upload_max_concurrency': 8,
+    'upload_buffer_size': 1024,
+    'upload_multipart_threshold': 64,
+    'download_range_size': 16,
+    'download_max_concurrency': 8,
+    'download_buffer_size': 256,
+    'download_multipart_threshold': 64
+}
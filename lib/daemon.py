@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from .clients.index import create_iaas_client
+from .workflow import create_backup_workflow, create_restore_workflow
+from . import constants
+
+DEFAULT_SOCKET_PATH = '/var/vcap/sys/run/service-fabrik-backup-restore/agent.sock'
+DEFAULT_REFRESH_INTERVAL = 1800
+MAX_REQUEST_SIZE = 1024 * 1024
+
+
+class AgentDaemon:
+    """Keep IaaS clients warm between operations and run backups, restores and blob operations requested over a
+    local Unix socket.
+
+    A client is created (importing the SDK, authenticating, testing the access to the container, ...) by the first
+    request of an operation and reused by the following ones, which only pass their operation specific parameters
+    to BaseClient.reconfigure. While the daemon is idle, the credentials (e.g. credhub, keystone or Azure AD tokens) of
+    clients refreshed longer than refresh_interval seconds ago are refreshed by BaseClient.refresh_credentials, before
+    a request has to wait for it. The snapshot kept by a successful backup is no resource of the client anymore, so a
+    later failed request of the same client does not delete it in its clean-up.
+
+    The protocol is one JSON object per connection and line, answered by one JSON object:
+
+        {"operation": "backup", "configuration": {...}, "blob_name": "...", "directory_work": "/tmp/backup"}
+        {"operation": "restore", "configuration": {...}, "blob_name": "...", "sharded": false}
+        {"operation": "blob_operation", "configuration": {...}, "action": "upload", "source": "...", "target": "..."}
+        {"operation": "ping"}
+
+    The answer is {"state": "succeeded", "output": {...}} with the output_json of the client, or
+    {"state": "failed", "error": "..."}. Requests are run one after another in the main thread, as a VM runs one
+    backup or restore at a time anyway. SIGINT/SIGTERM stop the daemon, and the client running a request (if any)
+    aborts it safely like the agent does.
+
+    :param socket_path: the path of the Unix socket
+    :param configuration: the configuration shared by all requests (iaas, credentials, container, ...), which is
+        updated by the configuration of every request
+    :param directory_persistent: the path of the persistent directory
+    :param directory_work_list: the directories to work with during the operations
+    :param poll_delay_time: (optional) see create_iaas_client
+    :param poll_maximum_time: (optional) see create_iaas_client
+    :param refresh_interval: (optional) the maximum age of an idle client in seconds
+    :param create_client: (optional) the factory of the clients
+
+    :Example:
+        ::
+
+            AgentDaemon('/var/vcap/sys/run/agent.sock', configuration, '/var/vcap/store', ['/tmp/backup']).serve()
+    """
+
+    def __init__(self, socket_path, configuration, directory_persistent, directory_work_list, poll_delay_time=None,
+                 poll_maximum_time=None, refresh_interval=DEFAULT_REFRESH_INTERVAL, create_client=create_iaas_client):
+        self.socket_path = socket_path
+        self.configuration = configuration
+        self.directory_persistent = directory_persistent
+        self.directory_work_list = directory_work_list
+        self.poll_delay_time = poll_delay_time
+        self.poll_maximum_time = poll_maximum_time
+        self.refresh_interval = refresh_interval
+        self.create_client = create_client
+        # (operation, instance id, container) -> (client, configuration, time of the creation or last refresh)
+        self.clients = {}
+        self.server = None
+        self.running = False
+        # The client running a request
+        self.busy_client = None
+
+    def __get_key(self, operation, configuration):
+        return operation, configuration.get('instance_id'), configuration.get('container')
+
+    def __handle_signal(self, signum, frame):
+        self.stop()
+        if self.busy_client is not None:
+            self.busy_client.schedule_abortion(signum)
+
+    def __install_signal_handlers(self):
+        # Signal handlers can only be installed by the main thread
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.__handle_signal)
+            signal.signal(signal.SIGTERM, self.__handle_signal)
+
+    def __create_client(self, operation, configuration):
+        client = self.create_client(operation, configuration, self.directory_persistent, self.directory_work_list,
+                                    self.poll_delay_time, self.poll_maximum_time)
+        # Every client installs its own signal handlers
+        self.__install_signal_handlers()
+        self.clients[self.__get_key(operation, configuration)] = (client, configuration, time.time())
+        return client
+
+    def get_client(self, operation, configuration):
+        """Get the warm client of an operation, reconfigured for the given configuration, or create it."""
+        key = self.__get_key(operation, configuration)
+        if key in self.clients:
+            client = self.clients[key][0]
+            client.reconfigure(configuration)
+            return client
+        return self.__create_client(operation, configuration)
+
+    def refresh_clients(self):
+        """Refresh the credentials of all clients refreshed longer than refresh_interval seconds ago."""
+        for key, (client, configuration, refreshed) in list(self.clients.items()):
+            if time.time() - refreshed >= self.refresh_interval:
+                try:
+                    client.refresh_credentials(configuration)
+                    self.clients[key] = (client, configuration, time.time())
+                except Exception as error:
+                    # Tried again when the daemon is idle next time
+                    print('[DAEMON] ERROR: Could not refresh the {} client: {}'.format(key[0], error),
+                          file=sys.stderr)
+
+    def handle(self, request):
+        """Run a request and return the answer.
+
+        :param request: the request (a dictionary)
+        :returns: the answer (a dictionary)
+        """
+        operation = request.get('operation')
+        if operation == 'ping':
+            return {'state': 'succeeded', 'clients': [key[0] for key in self.clients]}
+        if operation not in ('backup', 'restore', constants.OPERATIONS['BLOB_OPERATION']):
+            return {'state': 'failed', 'error': 'Unknown operation {}.'.format(operation)}
+        configuration = dict(self.configuration)
+        configuration.update(request.get('configuration') or {})
+        try:
+            client = self.get_client(operation, configuration)
+        except (Exception, SystemExit) as error:
+            return {'state': 'failed', 'error': 'Could not create the {} client: {}'.format(operation, error)}
+        self.busy_client = client
+        try:
+            client.initialize()
+            if operation == 'backup':
+                results = create_backup_workflow(client, configuration['instance_id'], request['blob_name'],
+                                                 request['directory_work'],
+                                                 copy_snapshot=request.get('copy_snapshot', False),
+                                                 timeout=request.get('timeout')).run()
+                # The snapshot is part of the backup now
+                client.keep_snapshot(results.get('copy_snapshot', results['snapshot']).id)
+            elif operation == 'restore':
+                create_restore_workflow(client, request['blob_name'], self.directory_persistent,
+                                        sharded=request.get('sharded', False), timeout=request.get('timeout')).run()
+            else:
+                self.__run_blob_operation(client, request)
+            client.finalize()
+            return {'state': 'succeeded', 'output': client.output_json}
+        except Exception as error:
+            client.logger.error('[DAEMON] ERROR: {} failed: {}'.format(operation, error))
+            # Unlike BaseClient.exit, the daemon keeps running
+            client.clean_up()
+            client.last_operation(str(error), 'failed')
+            return {'state': 'failed', 'error': str(error)}
+        finally:
+            self.busy_client = None
+
+    def __run_blob_operation(self, client, request):
+        action = request.get('action')
+        if action == 'upload':
+            result = client.upload_to_blobstore(request['source'], request['target'], throw_exception=True)
+        elif action == 'download':
+            result = client.download_from_blobstore(request['source'], request['target'], throw_exception=True)
+        else:
+            raise Exception('Unknown blob operation {}.'.format(action))
+        if not result:
+            raise Exception('The {} of {} failed.'.format(action, request['source']))
+
+    def __serve_connection(self, connection):
+        with connection, connection.makefile('rwb') as stream:
+            line = stream.readline(MAX_REQUEST_SIZE)
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if not isinstance(request, dict):
+                    raise ValueError('The request is not a JSON object.')
+                answer = self.handle(request)
+            except ValueError as error:
+                answer = {'state': 'failed', 'error': 'Invalid request: {}'.format(error)}
+            stream.write(json.dumps(answer).encode('utf-8') + b'\n')
+            stream.flush()
+
+    def serve(self, idle_timeout=1.0):
+        """Accept requests until stop() is called.
+
+        :param idle_timeout: (optional) the interval in seconds in which idle clients are refreshed
+        """
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        # Only the user of the daemon (root on the service VMs) may request operations
+        os.chmod(self.socket_path, 0o600)
+        self.server.listen()
+        self.server.settimeout(idle_timeout)
+        self.__install_signal_handlers()
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    connection, address = self.server.accept()
+                except socket.timeout:
+                    self.refresh_clients()
+                    continue
+                connection.settimeout(None)
+                self.__serve_connection(connection)
+        finally:
+            self.server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def stop(self):
+        self.running = False
+
+
+def send_request(request, socket_path=DEFAULT_SOCKET_PATH):
+    """Send a request to the agent daemon and wait for the answer.
+
+    :param request: the request (a dictionary)
+    :param socket_path: (optional) the path of the Unix socket of the daemon
+    :returns: the answer (a dictionary)
+
+    :Example:
+        ::
+
+            send_request({'operation': 'restore', 'configuration': {'backup_guid': guid, ...}, 'blob_name': blob_name})
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        with connection.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode('utf-8') + b'\n')
+            stream.flush()
+            return json.loads(stream.readline().decode('utf-8'))
+
+
+def main():
+    # The shared configuration (iaas, credentials, container, ...) is read from a JSON file, as it contains secrets
+    parser = argparse.ArgumentParser(description='Backup & Restore agent daemon')
+    parser.add_argument('--configuration', required=True, help='a JSON file with the configuration shared by all '
+                                                               'requests (iaas, credentials, container, ...)')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='the path of the Unix socket')
+    parser.add_argument('--directory_persistent', default='/var/vcap/store', help='the persistent directory')
+    parser.add_argument('--directory_work', action='append', help='a directory to work with (repeatable)')
+    parser.add_argument('--refresh_interval', type=int, default=DEFAULT_REFRESH_INTERVAL,
+                        help='the maximum age of idle clients in seconds (default: {})'.format(DEFAULT_REFRESH_INTERVAL))
+    options = parser.parse_args()
+    with open(options.configuration) as configuration_file:
+        configuration = json.load(configuration_file)
+    AgentDaemon(options.socket, configuration, options.directory_persistent, options.directory_work or ['/tmp'],
+                refresh_interval=options.refresh_interval).serve()
+
+
+if __name__ == '__main__':
+    main()
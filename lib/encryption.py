@@ -0,0 +1,300 @@
+import collections
+import os
+import struct
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+# Archive format (version 1):
+#
+#   header: MAGIC | version (1 byte) | log2(scrypt n), scrypt r, scrypt p (1 byte each) | chunk size (4 bytes)
+#           | salt (16 bytes) | nonce prefix (7 bytes)
+#   chunks: AES-256-GCM(plaintext chunk) | tag (16 bytes), every chunk but the last holds chunk size bytes
+#
+# The key is derived from the secret with scrypt. The nonce of a chunk is the nonce prefix, the index of the chunk
+# (4 bytes) and a flag marking the last chunk (1 byte), so chunks cannot be reordered, dropped or cut off unnoticed.
+# The header is authenticated as associated data of every chunk.
+MAGIC = b'SFBR'
+VERSION = 1
+HEADER_FORMAT = '>4sBBBBI16s7s'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+SCRYPT_LOG2_N = 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+ENGINE_NATIVE = 'native'
+ENGINE_GPG = 'gpg'
+ENGINES = (ENGINE_NATIVE, ENGINE_GPG)
+# Backups of the native engine cannot be restored by older agents or plain gpg, hence deployments opt in to it
+DEFAULT_ENGINE = ENGINE_GPG
+
+
+class EncryptionError(Exception):
+    pass
+
+
+def is_native_archive(data):
+    """Check whether the first bytes of an archive belong to the native format (and not to a legacy gpg archive).
+
+    :param data: at least the first 4 bytes of the archive
+    """
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _derive_key(secret, salt, log2_n, r, p):
+    kdf = Scrypt(salt=salt, length=32, n=2 ** log2_n, r=r, p=p, backend=default_backend())
+    return kdf.derive(secret.encode('utf-8'))
+
+
+def _nonce(prefix, index, final):
+    return prefix + struct.pack('>IB', index, 1 if final else 0)
+
+
+def _default_max_workers():
+    return os.cpu_count() or 1
+
+
+class EncryptingReader:
+    """A readable file-like object returning the encrypted content of a plaintext stream.
+
+    The chunks are encrypted in parallel; at most twice max_workers chunks are held in memory.
+
+    :param stream: the plaintext stream, e.g. the stdout of a tar subprocess
+    :param secret: the secret the key is derived from
+    :param chunk_size: (optional) the size of the plaintext chunks
+    :param max_workers: (optional) the number of threads encrypting chunks, default: number of cores
+
+    :Example:
+        ::
+
+            upload(EncryptingReader(process.stdout, secret))
+    """
+
+    def __init__(self, stream, secret, chunk_size=DEFAULT_CHUNK_SIZE, max_workers=None):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        salt = os.urandom(16)
+        self.nonce_prefix = os.urandom(7)
+        self.header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, SCRYPT_LOG2_N, SCRYPT_R, SCRYPT_P, chunk_size,
+                                  salt, self.nonce_prefix)
+        self.aesgcm = AESGCM(_derive_key(secret, salt, SCRYPT_LOG2_N, SCRYPT_R, SCRYPT_P))
+        self.max_workers = max_workers or _default_max_workers()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.pending_chunks = collections.deque()
+        self.buffer = bytearray(self.header)
+        self.next_plaintext = self._read_plaintext()
+        self.index = 0
+        self.finished = False
+
+    def _read_plaintext(self):
+        chunks = []
+        remaining = self.chunk_size
+        while remaining > 0:
+            chunk = self.stream.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    def _submit_chunks(self):
+        while not self.finished and len(self.pending_chunks) < 2 * self.max_workers:
+            plaintext = self.next_plaintext
+            # A chunk is the last one if the stream ends after it, hence read one chunk ahead
+            self.next_plaintext = self._read_plaintext() if len(plaintext) == self.chunk_size else b''
+            final = not self.next_plaintext
+            nonce = _nonce(self.nonce_prefix, self.index, final)
+            self.pending_chunks.append(self.executor.submit(self.aesgcm.encrypt, nonce, plaintext, self.header))
+            self.index += 1
+            self.finished = final
+
+    def read(self, size=-1):
+        while (size is None or size < 0 or len(self.buffer) < size) and (self.pending_chunks or not self.finished):
+            self._submit_chunks()
+            self.buffer += self.pending_chunks.popleft().result()
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self):
+        for future in self.pending_chunks:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+
+
+class DecryptingWriter:
+    """A writable file-like object decrypting the archive written to it into a target file object.
+
+    Native archives are decrypted in parallel chunks; at most twice max_workers chunks are held in memory. Legacy
+    archives created with gpg are detected by their header and passed to a gpg subprocess, whose output is copied
+    to the target by a thread. The secret is passed to gpg through a pipe, not on the command line. close() must be
+    called to decrypt the last chunk and verify the archive is complete.
+
+    :param target: the file object the plaintext is written to
+    :param secret: the secret the key is derived from
+    :param max_workers: (optional) the number of threads decrypting chunks, default: number of cores
+
+    :Example:
+        ::
+
+            with open(archive, 'rb') as encrypted_file:
+                writer = DecryptingWriter(process.stdin, secret)
+                shutil.copyfileobj(encrypted_file, writer)
+                writer.close()
+    """
+
+    def __init__(self, target, secret, max_workers=None):
+        self.target = target
+        self.secret = secret
+        self.max_workers = max_workers or _default_max_workers()
+        self.executor = None
+        self.gpg_process = None
+        self.gpg_output_thread = None
+        self.gpg_output_error = None
+        self.pending_chunks = collections.deque()
+        self.buffer = bytearray()
+        self.header = None
+        self.index = 0
+
+    def _read_header(self):
+        magic, version, log2_n, r, p, chunk_size, salt, self.nonce_prefix = struct.unpack(
+            HEADER_FORMAT, bytes(self.buffer[:HEADER_SIZE]))
+        if version != VERSION:
+            raise EncryptionError('Unsupported archive version {}.'.format(version))
+        self.header = bytes(self.buffer[:HEADER_SIZE])
+        self.encrypted_chunk_size = chunk_size + TAG_SIZE
+        self.aesgcm = AESGCM(_derive_key(self.secret, salt, log2_n, r, p))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        del self.buffer[:HEADER_SIZE]
+
+    def _start_gpg(self):
+        passphrase_read, passphrase_write = os.pipe()
+        try:
+            self.gpg_process = subprocess.Popen(
+                ['gpg', '--batch', '--quiet', '--no-tty', '--passphrase-fd', str(passphrase_read), '--decrypt'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, pass_fds=(passphrase_read,))
+        finally:
+            os.close(passphrase_read)
+        with os.fdopen(passphrase_write, 'w') as passphrase:
+            passphrase.write(self.secret)
+        self.gpg_output_thread = threading.Thread(target=self._copy_gpg_output, daemon=True)
+        self.gpg_output_thread.start()
+
+    def _copy_gpg_output(self):
+        try:
+            data = self.gpg_process.stdout.read(DEFAULT_CHUNK_SIZE)
+            while data:
+                self.target.write(data)
+                data = self.gpg_process.stdout.read(DEFAULT_CHUNK_SIZE)
+        except Exception as error:
+            self.gpg_output_error = error
+            # Unblock gpg, it fails with a broken pipe
+            self.gpg_process.stdout.close()
+
+    def _decrypt(self, index, chunk, final):
+        try:
+            return self.aesgcm.decrypt(_nonce(self.nonce_prefix, index, final), chunk, self.header)
+        except Exception:
+            raise EncryptionError('Chunk {} of the archive could not be authenticated: wrong secret, corrupted or '
+                                  'truncated archive.'.format(index))
+
+    def _submit_chunk(self, chunk, final):
+        if len(self.pending_chunks) >= 2 * self.max_workers:
+            self.target.write(self.pending_chunks.popleft().result())
+        self.pending_chunks.append(self.executor.submit(self._decrypt, self.index, chunk, final))
+        self.index += 1
+
+    def write(self, data):
+        if self.gpg_process:
+            self.gpg_process.stdin.write(data)
+            return len(data)
+        self.buffer += data
+        if self.header is None:
+            if len(self.buffer) < len(MAGIC):
+                return len(data)
+            if not is_native_archive(self.buffer):
+                self._start_gpg()
+                self.gpg_process.stdin.write(bytes(self.buffer))
+                self.buffer = bytearray()
+                return len(data)
+            if len(self.buffer) < HEADER_SIZE:
+                return len(data)
+            self._read_header()
+        # The last chunk is decrypted on close(), as only then it is known to be the last one
+        while len(self.buffer) > self.encrypted_chunk_size:
+            self._submit_chunk(bytes(self.buffer[:self.encrypted_chunk_size]), False)
+            del self.buffer[:self.encrypted_chunk_size]
+        return len(data)
+
+    def close(self):
+        if self.gpg_process:
+            self.gpg_process.stdin.close()
+            self.gpg_output_thread.join()
+            if self.gpg_output_error:
+                raise self.gpg_output_error
+            if self.gpg_process.wait() != 0:
+                raise EncryptionError('gpg failed to decrypt the legacy archive.')
+            return
+        try:
+            if self.header is None:
+                raise EncryptionError('The archive is truncated: no header found.')
+            self._submit_chunk(bytes(self.buffer), True)
+            self.buffer = bytearray()
+            while self.pending_chunks:
+                self.target.write(self.pending_chunks.popleft().result())
+        finally:
+            if self.executor:
+                for future in self.pending_chunks:
+                    future.cancel()
+                self.executor.shutdown(wait=True)
+
+    def abort(self):
+        """Stop the decryption after an error, without waiting for the pending chunks or gpg."""
+        if self.gpg_process:
+            self.gpg_process.kill()
+            self.gpg_process.wait()
+        if self.executor:
+            for future in self.pending_chunks:
+                future.cancel()
+            self.executor.shutdown(wait=False)
+
+
+def encrypt_stream(source, target, secret, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Encrypt everything read from the source file object into the target file object.
+
+    :param source: the plaintext file object
+    :param target: the file object the archive is written to
+    :param secret: the secret the key is derived from
+    :param chunk_size: (optional) the size of the plaintext chunks
+    """
+    reader = EncryptingReader(source, secret, chunk_size)
+    try:
+        data = reader.read(chunk_size)
+        while data:
+            target.write(data)
+            data = reader.read(chunk_size)
+    finally:
+        reader.close()
+
+
+def decrypt_stream(source, target, secret, segment_size=DEFAULT_CHUNK_SIZE):
+    """Decrypt a native or legacy gpg archive read from the source file object into the target file object.
+
+    :param source: the file object the archive is read from
+    :param target: the file object the plaintext is written to
+    :param secret: the secret the key is derived from
+    :param segment_size: (optional) the size of the reads from the source
+    """
+    writer = DecryptingWriter(target, secret)
+    data = source.read(segment_size)
+    while data:
+        writer.write(data)
+        data = source.read(segment_size)
+    writer.close()
@@ -1,9 +1,111 @@
+import atexit
 import json
+import queue
 import sys
+import threading
 import logging, logging.handlers
 
+# The maximum number of log records waiting to be written by the background thread
+LOG_QUEUE_SIZE = 10000
+# The maximum time in seconds warnings and errors wait for room in a full queue
+WARNING_TIMEOUT = 1.0
 
-def init_logger(logfile_path, max_bytes=5000000, backup_count=2):
+
+def escape_message(message):
+    try:
+        return json.dumps(message)
+    except:
+        return str(message)
+
+
+class EscapedMessage:
+    """A log message, escaped as JSON string only once the record is formatted, i.e. by the thread writing the logs
+    and only if the level of the message is enabled."""
+    __slots__ = ['message']
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return escape_message(self.message)
+
+
+class BoundedQueue(queue.Queue):
+    """A bounded queue.Queue with a reentrant lock: the SIGINT/SIGTERM handler logs on the thread it interrupted,
+    which may hold the lock while putting a record.
+
+    :param maxsize: the maximum number of items in the queue
+    """
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.mutex = threading.RLock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+        self.all_tasks_done = threading.Condition(self.mutex)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler for a bounded queue. If the queue is full, records below WARNING are dropped (a warning reports
+    how many once there is room again), whereas warnings and errors wait for room up to timeout seconds before they
+    are dropped as well.
+
+    The records are put into the queue as they are: they are formatted by the handlers of the QueueListener.
+    """
+
+    def __init__(self, queue, timeout=WARNING_TIMEOUT):
+        super().__init__(queue)
+        self.timeout = timeout
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        # Called with the lock of the handler held
+        try:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record, timeout=self.timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            try:
+                self.queue.put_nowait(logging.LogRecord(
+                    record.name, logging.WARNING, __file__, 0,
+                    EscapedMessage('{} log messages were dropped, as they were logged faster than written.'.format(
+                        self.dropped)), None, None))
+                self.dropped = 0
+            except queue.Full:
+                pass
+
+
+class BoundedQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Waits for room in the bounded queue instead of failing, so stop() writes all queued records
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        # May be called before the exit as well
+        if self._thread is not None:
+            super().stop()
+
+
+def init_logger(logfile_path, max_bytes=5000000, backup_count=2, queue_size=LOG_QUEUE_SIZE):
+    """Add the handlers writing to stdout and to the log file to the agent logger.
+
+    The records are written by a background thread, so that logging does not wait for I/O (unless warnings or
+    errors find the queue of at most queue_size records full, see BoundedQueueHandler). The records still queued are written when the process
+    exits. With a queue_size of 0, the records are written by the logging thread.
+
+    :param logfile_path: the path of the log file
+    :param max_bytes: (optional) the size from which on the log file is rotated
+    :param backup_count: (optional) the number of rotated log files kept
+    :param queue_size: (optional) the maximum number of records waiting to be written, 0 for synchronous logging
+    :returns: the QueueListener writing the records, None if logging is synchronous or the logger was initialized
+    """
     logger = logging.getLogger('agent')
 
     # +-> Prevent adding handlers more than once
@@ -17,10 +119,19 @@ def init_logger(logfile_path, max_bytes=5000000, backup_count=2):
                                   '%Y-%m-%dT%H:%M:%SZ')
     consoleHandler = logging.StreamHandler(sys.stdout)
     consoleHandler.setFormatter(formatter)
-    logger.addHandler(consoleHandler)
     fileHandler = logging.handlers.RotatingFileHandler(logfile_path, maxBytes=max_bytes, backupCount=backup_count)
     fileHandler.setFormatter(formatter)
-    logger.addHandler(fileHandler)
+    if not queue_size:
+        logger.addHandler(consoleHandler)
+        logger.addHandler(fileHandler)
+        return
+    records = BoundedQueue(queue_size)
+    listener = BoundedQueueListener(records, consoleHandler, fileHandler)
+    listener.start()
+    # Registered after logging's own shutdown, hence run before it
+    atexit.register(listener.stop)
+    logger.addHandler(BoundedQueueHandler(records))
+    return listener
 
 
 def create_logger(iaas_client):
@@ -47,10 +158,10 @@ class Logger:
         self.iaas_client = iaas_client
 
     def escape_message(self, message):
-        try:
-            return json.dumps(message)
-        except:
-            return str(message)
+        # Strings are escaped lazily, other messages right away, as they may change until the record is written
+        if isinstance(message, str):
+            return EscapedMessage(message)
+        return escape_message(message)
 
     def debug(self, message):
         """Logs a message with level 'debug'.
@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+
+def write_file_atomically(path, content):
+    """Write a text file atomically: the content is written to a temporary file in the same directory, which then
+    replaces the file. Concurrent readers (e.g. other backups/restores) find either the old or the new content, never
+    a partial one. The temporary file is removed if the write fails.
+
+    :param path: the path of the file; its directory is created if missing
+    :param content: the new content (a string)
+    :raises OSError: if the file cannot be written
+
+    :Example:
+        ::
+
+            write_file_atomically('/var/vcap/sys/run/service-fabrik-backup-restore/gcp_zones.json', json.dumps(zones))
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'w') as temporary_file:
+            temporary_file.write(content)
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+        raise
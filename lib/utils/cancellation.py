@@ -0,0 +1,68 @@
+import os
+import signal
+import threading
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    """A flag shared between the thread scheduling an abortion (e.g. the signal handler) and the threads running a
+    long operation, which check it between chunks/parts and stop with OperationCancelled.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def reset(self):
+        self.event.clear()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise OperationCancelled('The operation was cancelled.')
+
+
+def terminate_process_group(process):
+    """Terminate a subprocess started with start_new_session=True together with all processes of its group and wait
+    for it. Unlike process.kill(), this also stops the commands of a shell pipeline, e.g. the tar and gpg of
+    'tar | gpg'.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        # The group has exited already
+        pass
+    process.wait()
+
+
+class CancellableStream:
+    """Wraps a stream (e.g. the stdout pipe of a subprocess) and checks a cancellation token on every read and write.
+
+    SDKs uploading or downloading a stream in chunks thereby stop with OperationCancelled at the next chunk.
+    """
+
+    def __init__(self, stream, token):
+        self.stream = stream
+        self.token = token
+
+    def read(self, size=-1):
+        self.token.raise_if_cancelled()
+        return self.stream.read(size)
+
+    def write(self, data):
+        self.token.raise_if_cancelled()
+        return self.stream.write(data)
+
+    def close(self):
+        self.stream.close()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
@@ -0,0 +1,201 @@
+import collections
+import os
+import re
+import threading
+
+# A disk: its kernel name (e.g. nvme1n1), device path, serial number (e.g. the EBS volume id of an NVMe device) or None,
+# SCSI address (host, channel, target, lun) or None and the device paths of its partitions in the order of their numbers
+BlockDevice = collections.namedtuple('BlockDevice', ['name', 'path', 'serial', 'scsi_address', 'partitions'])
+
+
+class DeviceInventory:
+    """An index of the mounts, disks and /dev/disk/by-id links of this machine, read from /proc/mounts, /sys/block and
+    /dev/disk/by-id instead of from the output of cat, lsblk, nvme, ls or readlink.
+
+    The index is built on the first lookup and kept until invalidate() is called, i.e. once an attachment or a mount
+    changed. The refresh is incremental: /proc/mounts is read again, but only disks which were added since the last
+    refresh are read from sysfs and the links only if /dev/disk/by-id changed. A lookup which finds nothing refreshes
+    the index once, as the kernel and udev may need a moment to report a freshly attached device.
+
+    :param root: (optional) the directory containing proc, sys and dev, e.g. of a test tree
+
+    :Example:
+        ::
+
+            inventory = DeviceInventory()
+            disk = inventory.get_disk_of(inventory.get_mount_device('/var/vcap/store'))
+            print(disk.path, disk.serial, disk.scsi_address)
+    """
+
+    def __init__(self, root='/'):
+        self.root = root
+        self.lock = threading.RLock()
+        self.__stale = True
+        self.__mounts = []
+        # Disks by name, with the sysfs inode of the disk: a name reused by another disk gets a new inode
+        self.__disks = {}
+        self.__disk_inodes = {}
+        self.__partitions = {}
+        self.__links = {}
+        self.__links_mtime = None
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def _device_path(self, real_path):
+        # The device path as seen by the machine, also if the tree is not at /
+        return '/' + os.path.relpath(real_path, os.path.realpath(self.root))
+
+    def _read(self, path):
+        try:
+            with open(path) as attribute_file:
+                return attribute_file.read().strip()
+        except OSError:
+            return None
+
+    def invalidate(self):
+        """Refresh the index on the next lookup, e.g. after a device was attached or mounted."""
+        with self.lock:
+            self.__stale = True
+
+    def refresh(self):
+        with self.lock:
+            self.__refresh_mounts()
+            self.__refresh_disks()
+            self.__refresh_links()
+            self.__stale = False
+
+    def __refresh_mounts(self):
+        mounts = []
+        try:
+            with open(self._path('/proc/mounts')) as mounts_file:
+                for line in mounts_file:
+                    fields = line.split()
+                    if len(fields) >= 3:
+                        # Blanks and other special characters are escaped as octal numbers, e.g. \040
+                        device, mountpoint = [re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)),
+                                                     field) for field in fields[:2]]
+                        mounts.append((device, mountpoint, fields[2]))
+        except OSError:
+            pass
+        self.__mounts = mounts
+
+    def __refresh_disks(self):
+        block_directory = self._path('/sys/block')
+        try:
+            names = os.listdir(block_directory)
+        except OSError:
+            names = []
+        disks = {}
+        disk_inodes = {}
+        for name in names:
+            try:
+                inode = os.stat(os.path.join(block_directory, name)).st_ino
+            except OSError:
+                continue
+            disk = self.__disks.get(name)
+            if disk is None or self.__disk_inodes.get(name) != inode:
+                disk = self.__read_disk(os.path.join(block_directory, name), name)
+            disks[name] = disk
+            disk_inodes[name] = inode
+        self.__disks = disks
+        self.__disk_inodes = disk_inodes
+        self.__partitions = {os.path.basename(partition): name
+                             for name, disk in disks.items() for partition in disk.partitions}
+
+    def __read_disk(self, directory, name):
+        # The device of an NVMe namespace is its controller, which has the serial number
+        serial = self._read(os.path.join(directory, 'device', 'serial')) or None
+        scsi_address = None
+        match = re.match(r'^(\d+):(\d+):(\d+):(\d+)$',
+                         os.path.basename(os.path.realpath(os.path.join(directory, 'device'))))
+        if match:
+            scsi_address = tuple(int(number) for number in match.groups())
+        partitions = []
+        try:
+            entries = os.listdir(directory)
+        except OSError:
+            entries = []
+        for entry in entries:
+            number = self._read(os.path.join(directory, entry, 'partition'))
+            if number and number.isdigit():
+                partitions.append((int(number), '/dev/{}'.format(entry)))
+        return BlockDevice(name, '/dev/{}'.format(name), serial, scsi_address,
+                           [partition for number, partition in sorted(partitions)])
+
+    def __refresh_links(self):
+        links_directory = self._path('/dev/disk/by-id')
+        try:
+            mtime = os.stat(links_directory).st_mtime_ns
+            if mtime == self.__links_mtime:
+                return
+            names = os.listdir(links_directory)
+        except OSError:
+            self.__links = {}
+            self.__links_mtime = None
+            return
+        links = {}
+        for name in names:
+            target = os.path.realpath(os.path.join(links_directory, name))
+            if os.path.exists(target):
+                links['/dev/disk/by-id/{}'.format(name)] = self._device_path(target)
+        self.__links = links
+        self.__links_mtime = mtime
+
+    def __lookup(self, find):
+        with self.lock:
+            refreshed = self.__stale
+            if self.__stale:
+                self.refresh()
+            result = find()
+            if not result and not refreshed:
+                self.refresh()
+                result = find()
+            return result
+
+    def get_mount_device(self, mountpoint):
+        """Get the device mounted at a directory (the last mount if several are stacked), None if there is none."""
+        mountpoint = os.path.normpath(mountpoint)
+
+        def find():
+            devices = [device for device, directory, filesystem in self.__mounts if directory == mountpoint]
+            return devices[-1] if devices else None
+        return self.__lookup(find)
+
+    def get_disk_of(self, device):
+        """Get the disk of a device path, which may be a partition or a link to one.
+
+        A device which is unknown to sysfs is assumed to be a partition named like its disk plus its number, e.g.
+        /dev/sdc1 or /dev/nvme1n1p1.
+        """
+        if not device:
+            return None
+        real_path = os.path.realpath(self._path(device))
+        name = os.path.basename(real_path if os.path.exists(real_path) else device)
+
+        def find():
+            disk_name = self.__partitions.get(name, name)
+            return self.__disks.get(disk_name)
+        disk = self.__lookup(find)
+        if disk is None:
+            path = re.sub(r'(?<=\d)p\d+$' if re.search(r'\dp\d+$', device) else r'\d+$', '', device)
+            disk = BlockDevice(os.path.basename(path), path, None, None, [])
+        return disk
+
+    def get_disks(self):
+        return self.__lookup(lambda: sorted(self.__disks.values()))
+
+    def get_disks_at_scsi_address(self, host, lun):
+        """Get the disks with a SCSI host number and LUN, of any channel and target."""
+        return self.__lookup(lambda: sorted(disk for disk in self.__disks.values()
+                                            if disk.scsi_address and disk.scsi_address[0] == int(host)
+                                            and disk.scsi_address[3] == int(lun)))
+
+    def get_link_target(self, link):
+        """Get the device path a /dev/disk/by-id link points to, None if there is no such link."""
+        return self.__lookup(lambda: self.__links.get(link))
+
+    def find_links(self, pattern):
+        """Get the /dev/disk/by-id links with a name matching a regular expression, sorted by name."""
+        return self.__lookup(lambda: sorted(link for link in self.__links
+                                            if re.search(pattern, os.path.basename(link))))
@@ -0,0 +1,103 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+# The directories a device of an attached volume shows up in: the device node (devtmpfs) and its udev links.
+# sysfs (e.g. /sys/bus/scsi/devices) does not report new entries to inotify, which the poll interval covers.
+DEVICE_DIRECTORIES = ['/dev', '/dev/disk/by-id', '/sys/bus/scsi/devices']
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class DeviceWatcher:
+    """Wait for a device to appear, woken up by the inotify events of the directories it shows up in instead of
+    sleeping for a fixed time.
+
+    The condition is checked once the watches are set up (so no device is missed between a check and a watch), on
+    every batch of events and at least every poll_interval seconds, as not every directory reports its changes (e.g.
+    sysfs). Without inotify (e.g. not on Linux), the condition is polled.
+
+    :param directories: (optional) the directories to watch, the missing ones are ignored
+    :param poll_interval: (optional) the maximum time in seconds between two checks of the condition
+
+    :Example:
+        ::
+
+            watcher = DeviceWatcher()
+            device = watcher.wait(lambda: inventory.get_link_target('/dev/disk/by-id/google-disk'), 30)
+    """
+
+    libc = None
+
+    def __init__(self, directories=None, poll_interval=1):
+        self.directories = directories if directories is not None else DEVICE_DIRECTORIES
+        self.poll_interval = poll_interval
+
+    def _open(self):
+        # Returns the inotify file descriptor watching the directories, None if inotify is not available
+        if DeviceWatcher.libc is None:
+            DeviceWatcher.libc = _load_libc() or False
+        if not DeviceWatcher.libc:
+            return None
+        file_descriptor = DeviceWatcher.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if file_descriptor < 0:
+            return None
+        watches = 0
+        for directory in self.directories:
+            if os.path.isdir(directory) and DeviceWatcher.libc.inotify_add_watch(
+                    file_descriptor, os.fsencode(directory), IN_CREATE | IN_MOVED_TO | IN_ATTRIB | IN_DELETE) >= 0:
+                watches += 1
+        if not watches:
+            os.close(file_descriptor)
+            return None
+        return file_descriptor
+
+    def _drain(self, file_descriptor):
+        # The events only wake up the check of the condition
+        try:
+            while os.read(file_descriptor, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, find, timeout):
+        """Wait until a function finds the device.
+
+        :param find: a function returning the device, or None (or anything false) as long as it did not appear
+        :param timeout: the maximum time in seconds to wait
+        :returns: the result of the function, None if the device did not appear in time
+        """
+        deadline = time.time() + timeout
+        file_descriptor = self._open()
+        try:
+            while True:
+                result = find()
+                if result:
+                    return result
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                if file_descriptor is None:
+                    time.sleep(min(self.poll_interval, remaining))
+                elif select.select([file_descriptor], [], [], min(self.poll_interval, remaining))[0]:
+                    self._drain(file_descriptor)
+        finally:
+            if file_descriptor is not None:
+                os.close(file_descriptor)
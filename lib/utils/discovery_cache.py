@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+import time
+from .atomic_file import write_file_atomically
+
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class DiscoveryDocumentCache:
+    """A file cache of Google API discovery documents, passed as cache to googleapiclient.discovery.build.
+
+    google-api-python-client 1.x fetches the discovery document of an API (e.g. about 1 MB for compute v1) on every
+    build, as its own file cache only works with oauth2client < 4. This cache keeps one file per discovery URL, which
+    contains the name and version of the API, so a client of another API version never gets a stale document. A
+    document older than ttl seconds is fetched again; unreadable, corrupt or unwritable cache files only cost the
+    fetch.
+
+    :param directory: the directory of the cache files
+    :param ttl: (optional) the time in seconds a cached document is used
+    :param logger: (optional) a logger
+
+    :Example:
+        ::
+
+            cache = DiscoveryDocumentCache('/var/vcap/sys/run/service-fabrik-backup-restore')
+            compute_client = discovery.build('compute', 'v1', credentials=credentials, cache=cache)
+    """
+
+    def __init__(self, directory, ttl=DEFAULT_TTL, logger=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.logger = logger
+
+    def _get_path(self, url):
+        return os.path.join(self.directory,
+                            'discovery-{}.json'.format(hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]))
+
+    def get(self, url):
+        path = self._get_path(url)
+        try:
+            if time.time() - os.path.getmtime(path) >= self.ttl:
+                return None
+            with open(path, 'r') as cache_file:
+                content = cache_file.read()
+            json.loads(content)
+            return content
+        except (OSError, ValueError):
+            return None
+
+    def set(self, url, content):
+        try:
+            write_file_atomically(self._get_path(url), content)
+        except OSError as error:
+            if self.logger:
+                self.logger.warning('[DISCOVERY] Could not cache the discovery document of {}: {}'.format(url, error))
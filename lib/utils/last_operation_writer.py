@@ -0,0 +1,116 @@
+import atexit
+import os
+import threading
+import time
+
+# The minimum time in seconds between two writes of the last operation file, unless the state changes
+FLUSH_INTERVAL = 0.5
+
+
+def replace_symlink(target, link):
+    """Point a symbolic link to a target atomically: readers find either the old or the new target, never no link
+    (unlike `ln -sf`, which removes the link before creating it again).
+
+    :param target: the target of the link
+    :param link: the path of the link
+    """
+    temporary_link = '{}.{}.tmp'.format(link, os.getpid())
+    if os.path.lexists(temporary_link):
+        os.remove(temporary_link)
+    os.symlink(target, temporary_link)
+    os.replace(temporary_link, link)
+
+
+class LastOperationWriter:
+    """Write the contents of the last operation file, i.e. alternately into a blue and a green file, to which a symbolic
+    link then points.
+
+    As every INFO message updates the last operation, updates are coalesced: an update is written at once if the last
+    write is at least flush_interval seconds ago, otherwise a background thread writes the latest update once the
+    interval has passed. Updates with flush (e.g. a change of the state) and flush() write at once; pending updates are
+    flushed when the process exits as well.
+
+    The lock is reentrant, as a signal handler may update the last operation while its thread is writing. Such an
+    update is written right after the interrupted write.
+
+    :param link: the path of the last operation file (the symbolic link)
+    :param blue: the path of the blue file
+    :param green: the path of the green file
+    :param flush_interval: (optional) the minimum time in seconds between two writes
+
+    :Example:
+        ::
+
+            writer = LastOperationWriter('backup.lastoperation.json', 'backup.lastoperation.blue.json',
+                                         'backup.lastoperation.green.json')
+            writer.update(json.dumps({'state': 'processing', 'stage': 'Creating volume ...'}))
+            writer.update(json.dumps({'state': 'succeeded', 'stage': 'Backup completed successfully'}), flush=True)
+    """
+
+    def __init__(self, link, blue, green, flush_interval=FLUSH_INTERVAL):
+        self.link = link
+        self.blue = blue
+        self.green = green
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.pending = None
+        self.writing = False
+        self.last_write_time = 0
+        self.thread = None
+        atexit.register(self.flush)
+
+    def _write(self, content):
+        try:
+            current = os.readlink(self.link)
+        except OSError:
+            current = None
+        filename = self.green if current == self.blue else self.blue
+        with open(filename, 'w') as last_operation_file:
+            last_operation_file.write(content)
+        replace_symlink(filename, self.link)
+
+    def _write_pending(self):
+        # Called with the lock held
+        if self.writing:
+            # Reentered by a signal handler: the interrupted write goes on with the new pending update
+            return
+        self.writing = True
+        try:
+            while self.pending is not None:
+                content = self.pending
+                self._write(content)
+                if self.pending is content:
+                    self.pending = None
+                self.last_write_time = time.time()
+        finally:
+            self.writing = False
+
+    def update(self, content, flush=False):
+        """Update the contents of the last operation file.
+
+        :param content: the new contents
+        :param flush: (optional) write at once, even if the last write is less than flush_interval seconds ago
+        """
+        with self.lock:
+            self.pending = content
+            delay = self.last_write_time + self.flush_interval - time.time()
+            if flush or delay <= 0:
+                self._write_pending()
+            elif self.thread is None:
+                self.thread = threading.Thread(target=self._run, args=(delay,), daemon=True)
+                self.thread.start()
+
+    def flush(self):
+        """Write the pending update, if any."""
+        with self.lock:
+            self._write_pending()
+
+    def _run(self, delay):
+        time.sleep(delay)
+        with self.lock:
+            self.thread = None
+            try:
+                self._write_pending()
+            except OSError:
+                # Nobody to report to: logging would update the last operation again. The next update retries.
+                pass
@@ -0,0 +1,73 @@
+import importlib
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """A module imported on the first access of one of its attributes.
+
+    The provider SDKs take a considerable share of the startup time of an operation. Their compute parts are only
+    needed for backups and restores, not for blob operations, and are therefore imported where they are first used.
+    Attributes set on the lazy module (e.g. by unittest.mock.patch) take precedence over the ones of the module.
+
+    :param name: the absolute name of the module
+
+    :Example:
+        ::
+
+            discovery = LazyModule('googleapiclient.discovery')
+            compute_client = discovery.build('compute', 'v1', credentials=credentials)
+    """
+
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self.__module = None
+        self.__lock = threading.Lock()
+
+    def _load(self):
+        if self.__module is None:
+            with self.__lock:
+                if self.__module is None:
+                    self.__module = importlib.import_module(self.__name__)
+        return self.__module
+
+    def __getattr__(self, name):
+        # Only called for attributes which are not set on the lazy module itself
+        if name.startswith('_LazyModule__'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return '<lazy module {!r}{}>'.format(self.__name__, '' if self.__module is None else ' (imported)')
+
+
+class LazyAttribute:
+    """An attribute of a module (typically a class) which is imported on the first call or attribute access.
+
+    :param module: the absolute name of the module
+    :param name: the name of the attribute
+
+    :Example:
+        ::
+
+            AcsClient = LazyAttribute('aliyunsdkcore.client', 'AcsClient')
+            compute_client = AcsClient(access_key_id, secret_access_key, region_name)
+    """
+
+    def __init__(self, module, name):
+        self.__module = LazyModule(module)
+        self.__name = name
+
+    def _load(self):
+        return getattr(self.__module._load(), self.__name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('_LazyAttribute__'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return '<lazy attribute {}.{}>'.format(self.__module.__name__, self.__name)
@@ -0,0 +1,54 @@
+import json
+import threading
+import time
+from .atomic_file import write_file_atomically
+
+
+class PersistentCache:
+    """A cache of JSON values per key, stored in a JSON file and valid for ttl seconds.
+
+    Every update merges into the current file, which other backups/restores may have updated meanwhile. The
+    cache only saves requests, so an unreadable or unwritable file counts as empty.
+
+    :param path: the path of the JSON file
+    :param ttl: the time in seconds a value is valid
+
+    :Example:
+        ::
+
+            cache = PersistentCache('/var/vcap/sys/run/service-fabrik-backup-restore/gcp_zones.json', 86400)
+            cache.set(instance_id, 'europe-west1-b')
+            zone = cache.get(instance_id)
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _is_valid(self, entry):
+        return isinstance(entry, dict) and isinstance(entry.get('time'), (int, float)) and \
+            time.time() - entry['time'] < self.ttl
+
+    def get(self, key):
+        """Get the value of a key, None if there is none or it expired."""
+        with self.lock:
+            entry = self._load().get(key)
+            return entry['value'] if self._is_valid(entry) else None
+
+    def set(self, key, value):
+        with self.lock:
+            entries = {cached_key: entry for cached_key, entry in self._load().items() if self._is_valid(entry)}
+            entries[key] = {'value': value, 'time': time.time()}
+            try:
+                write_file_atomically(self.path, json.dumps(entries))
+            except OSError:
+                pass
@@ -0,0 +1,33 @@
+import heapq
+import os
+
+# Every entry of a tarball starts with a 512 byte header
+TAR_ENTRY_OVERHEAD = 512
+
+
+def split_directory_into_shards(directory, shards):
+    """Split the entries of a directory tree into size-balanced shards.
+
+    Every file, directory and symlink is assigned to one shard (largest first, to the shard with the smallest total
+    size so far). The entries of a shard keep the order of the directory walk.
+
+    :param directory: the path to the directory
+    :param shards: the number of shards
+    :returns: a list of shards, each a list of paths (bytes) relative to the directory, e.g. b'./data/file'
+    """
+    entries = []
+    root = os.fsencode(directory)
+    for path, directories, files in os.walk(root):
+        relative_path = b'.' + path[len(root):] if path != root else b'.'
+        for name in directories + files:
+            entry_path = os.path.join(relative_path, name)
+            size = os.lstat(os.path.join(path, name)).st_size if name in files else 0
+            entries.append((entry_path, size + TAR_ENTRY_OVERHEAD))
+
+    heap = [(0, shard) for shard in range(shards)]
+    assignments = [[] for _ in range(shards)]
+    for index in sorted(range(len(entries)), key=lambda i: entries[i][1], reverse=True):
+        size, shard = heapq.heappop(heap)
+        assignments[shard].append(index)
+        heapq.heappush(heap, (size + entries[index][1], shard))
+    return [[entries[index][0] for index in sorted(assignment)] for assignment in assignments]
@@ -0,0 +1,128 @@
+import threading
+import time
+from concurrent.futures import Future
+
+# Watches whose next poll is due within this number of seconds are polled with the current tick
+COALESCE_WINDOW = 0.1
+
+
+class _Watch:
+    def __init__(self, resource_id, success_condition_function, log_message, resource_type, ignore_errors,
+                 first_delay):
+        self.resource_id = resource_id
+        self.success_condition_function = success_condition_function
+        self.log_message = log_message
+        self.resource_type = resource_type
+        self.ignore_errors = ignore_errors
+        self.start_time = time.time()
+        # A resource may not be visible to the describe requests right after its creation, hence it is first polled
+        # after one delay
+        self.next_poll_time = self.start_time + first_delay
+        self.attempt = 1
+        self.future = Future()
+
+
+class StatusPoller:
+    """Poll the status of several resources of one kind (e.g. snapshots) with one batched request per tick.
+
+    Every wait registers its resource with watch() and gets a future, which is resolved by a background thread as
+    soon as the success condition is met for the fetched status. The thread runs while there are watched resources.
+    A resource is polled for the first time after the first delay of the wait strategy; from then on it is polled
+    with all other resources due, after the shortest delay the wait strategy gives for any of them. New watches wake
+    the thread up to recompute its sleep.
+
+    :param fetch_statuses: a function returning a dictionary of the statuses of the given resource ids; resources
+        which do not exist (anymore) may be missing
+    :param wait_strategy: the wait strategy giving the delays between the ticks
+    :param logger: the logger
+
+    :Example:
+        ::
+
+            poller = StatusPoller(self._describe_snapshots, self.wait_strategy, self.logger)
+            poller.watch(snapshot_id, lambda snapshot: snapshot['State'] == 'completed').result(timeout=300)
+    """
+
+    def __init__(self, fetch_statuses, wait_strategy, logger):
+        self.fetch_statuses = fetch_statuses
+        self.wait_strategy = wait_strategy
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.watches = []
+        self.thread = None
+
+    def watch(self, resource_id, success_condition_function, log_message=None, resource_type=None,
+              ignore_errors=False):
+        """Watch a resource until the success condition is met for its status.
+
+        :param resource_id: the id of the resource
+        :param success_condition_function: a function of the status (None if the resource was not found)
+        :param log_message: (optional) the message logged while the condition is not met
+        :param resource_type: (optional) the kind of operation waited for, passed to the wait strategy
+        :param ignore_errors: (optional) keep waiting if fetching the statuses fails, instead of failing the future
+        :returns: a future resolved with the status
+        """
+        watch = _Watch(resource_id, success_condition_function, log_message, resource_type, ignore_errors,
+                       self.wait_strategy.get_delay(resource_type, 0, 0))
+        with self.lock:
+            self.watches.append(watch)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return watch.future
+
+    def unwatch(self, future):
+        with self.lock:
+            self.watches = [watch for watch in self.watches if watch.future is not future]
+
+    def _run(self):
+        while True:
+            # Cleared before the watches are copied, so that a watch added meanwhile cuts the next wait short
+            self.wakeup.clear()
+            with self.lock:
+                watches = list(self.watches)
+                if not watches:
+                    self.thread = None
+                    return
+            due = [watch for watch in watches if watch.next_poll_time <= time.time() + COALESCE_WINDOW]
+            if due:
+                self._tick(due)
+                now = time.time()
+                delay = min(self.wait_strategy.get_delay(watch.resource_type, watch.attempt, now - watch.start_time)
+                            for watch in due)
+                for watch in due:
+                    watch.attempt += 1
+                    watch.next_poll_time = now + delay
+            with self.lock:
+                watches = list(self.watches)
+            if watches:
+                self.wakeup.wait(max(0, min(watch.next_poll_time for watch in watches) - time.time()))
+
+    def _tick(self, watches):
+        resource_ids = list(dict.fromkeys(watch.resource_id for watch in watches))
+        try:
+            statuses = self.fetch_statuses(resource_ids)
+        except Exception as error:
+            self.logger.error('[POLLER] ERROR: Unable to get the status of {}.\n{}'.format(resource_ids, error))
+            for watch in watches:
+                if not watch.ignore_errors:
+                    self._finish(watch, error=error)
+            return
+        for watch in watches:
+            status = statuses.get(watch.resource_id)
+            try:
+                if watch.success_condition_function(status):
+                    self._finish(watch, status=status)
+                elif watch.log_message:
+                    self.logger.info(watch.log_message)
+            except Exception as error:
+                self._finish(watch, error=error)
+
+    def _finish(self, watch, status=None, error=None):
+        self.unwatch(watch.future)
+        if error is not None:
+            watch.future.set_exception(error)
+        else:
+            watch.future.set_result(status)
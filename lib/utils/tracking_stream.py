@@ -0,0 +1,34 @@
+import io
+import os
+
+
+class TrackingStream:
+    """Wraps a non-seekable stream (e.g. the stdout pipe of a subprocess) and keeps track of the position.
+
+    Some SDKs (e.g. google-resumable-media) call tell() on the stream to compute the byte ranges of the chunks they
+    upload. Pipes do not support tell(), so the number of bytes read so far is counted here instead. Seeking is only
+    supported to the current position.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if (whence == os.SEEK_SET and offset == self.position) or (whence == os.SEEK_CUR and offset == 0):
+            return self.position
+        raise io.UnsupportedOperation('Stream is not seekable.')
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.stream.close()
@@ -0,0 +1,141 @@
+import json
+import random
+import statistics
+import threading
+from .atomic_file import write_file_atomically
+
+WAIT_STRATEGY_FIXED = 'fixed'
+WAIT_STRATEGY_EXPONENTIAL = 'exponential'
+WAIT_STRATEGY_PREDICTIVE = 'predictive'
+WAIT_STRATEGIES = (WAIT_STRATEGY_FIXED, WAIT_STRATEGY_EXPONENTIAL, WAIT_STRATEGY_PREDICTIVE)
+DEFAULT_WAIT_STRATEGY = WAIT_STRATEGY_EXPONENTIAL
+
+
+class FixedWaitStrategy:
+    """Poll every delay seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def get_delay(self, resource_type, attempt, elapsed):
+        return self.delay
+
+    def record(self, resource_type, duration):
+        pass
+
+
+class ExponentialBackoffWaitStrategy:
+    """Poll after 1, 2, 4, ... seconds up to maximum_delay seconds.
+
+    Short operations (e.g. attachments) are noticed within a second or two, long ones are polled every maximum_delay
+    seconds. The delays are shortened by a random jitter of up to 50 %, which spreads the polls of concurrent waits.
+    """
+
+    def __init__(self, maximum_delay, initial_delay=1, factor=2, jitter=0.5):
+        self.maximum_delay = maximum_delay
+        self.initial_delay = initial_delay
+        self.factor = factor
+        self.jitter = jitter
+
+    def get_delay(self, resource_type, attempt, elapsed):
+        delay = min(self.maximum_delay, self.initial_delay * self.factor ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+    def record(self, resource_type, duration):
+        pass
+
+
+class WaitHistory:
+    """The completion times of the last operations per key, stored in a JSON file.
+
+    A new completion time is added to the history as currently stored, so the runs sharing the file do not drop each
+    other's times. Without a readable or writable file, the polling just falls back to the other strategies.
+    """
+
+    def __init__(self, path, history_size=20):
+        self.path = path
+        self.history_size = history_size
+        self.lock = threading.Lock()
+        self.durations = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as history_file:
+                durations = json.load(history_file)
+            return durations if isinstance(durations, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def get_expected_duration(self, key):
+        with self.lock:
+            durations = self.durations.get(key)
+            return statistics.median(durations) if durations else None
+
+    def add(self, key, duration):
+        with self.lock:
+            self.durations = self._load()
+            self.durations[key] = (self.durations.get(key, []) + [round(duration, 1)])[-self.history_size:]
+            try:
+                write_file_atomically(self.path, json.dumps(self.durations))
+            except OSError:
+                pass
+
+
+class PredictiveWaitStrategy:
+    """Poll sparsely while an operation is far from its expected completion time and densely around it.
+
+    The expected completion time of a resource type (e.g. 'snapshot.create') is the median of the last completion
+    times on the same provider. Until it is reached, the wait is halved repeatedly (up to maximum_delay seconds);
+    afterwards the delay grows with the time the operation is overdue. Without history, the fallback strategy is used.
+
+    :param history: the WaitHistory of completion times
+    :param provider: the name of the provider, e.g. 'AwsClient'
+    :param fallback: the strategy used for resource types without history
+    :param minimum_delay: (optional) the shortest delay in seconds
+    :param maximum_delay: (optional) the longest delay in seconds
+    """
+
+    def __init__(self, history, provider, fallback, minimum_delay=1, maximum_delay=300):
+        self.history = history
+        self.provider = provider
+        self.fallback = fallback
+        self.minimum_delay = minimum_delay
+        self.maximum_delay = maximum_delay
+
+    def _get_key(self, resource_type):
+        return '{}/{}'.format(self.provider, resource_type)
+
+    def get_delay(self, resource_type, attempt, elapsed):
+        expected_duration = self.history.get_expected_duration(self._get_key(resource_type)) \
+            if resource_type else None
+        if expected_duration is None:
+            return self.fallback.get_delay(resource_type, attempt, elapsed)
+        if elapsed < expected_duration:
+            delay = (expected_duration - elapsed) / 2
+        else:
+            delay = (elapsed - expected_duration) / 2
+        return max(self.minimum_delay, min(self.maximum_delay, delay))
+
+    def record(self, resource_type, duration):
+        if resource_type:
+            self.history.add(self._get_key(resource_type), duration)
+
+
+def create_wait_strategy(name, poll_delay_time, history_file, provider):
+    """Create the wait strategy used by BaseClient._wait.
+
+    :param name: the name of the strategy, one of WAIT_STRATEGIES
+    :param poll_delay_time: the delay of the fixed strategy, and the longest delay of the exponential strategy
+    :param history_file: the path of the completion time history of the predictive strategy
+    :param provider: the name of the provider the history is kept for
+    """
+    if name == WAIT_STRATEGY_FIXED:
+        return FixedWaitStrategy(poll_delay_time)
+    exponential_strategy = ExponentialBackoffWaitStrategy(poll_delay_time, initial_delay=min(1, poll_delay_time))
+    if name == WAIT_STRATEGY_EXPONENTIAL:
+        return exponential_strategy
+    if name == WAIT_STRATEGY_PREDICTIVE:
+        return PredictiveWaitStrategy(WaitHistory(history_file), provider, exponential_strategy,
+                                      minimum_delay=min(1, poll_delay_time),
+                                      maximum_delay=max(300, poll_delay_time))
+    raise ValueError('Unknown wait strategy {}.'.format(name))
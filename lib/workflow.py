@@ -0,0 +1,319 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class WorkflowError(Exception):
+    pass
+
+
+class Step:
+    """A step of a workflow.
+
+    :param name: the unique name of the step
+    :param action: a function of the results of the steps so far (a dictionary by step name), returning the result
+        of this step
+    :param requires: (optional) the names of the steps which have to be completed before this step starts
+    :param compensation: (optional) a function of the results, undoing the step if a later step fails
+    :param timeout: (optional) the maximum number of seconds the step may take
+    :param best_effort: (optional) whether a failure (or timeout) of the step is only logged, e.g. for the tear-down
+        of temporary resources; the step counts as completed with the result None and the workflow goes on
+    """
+
+    def __init__(self, name, action, requires=(), compensation=None, timeout=None, best_effort=False):
+        self.name = name
+        self.action = action
+        self.requires = tuple(requires)
+        self.compensation = compensation
+        self.timeout = timeout
+        self.best_effort = best_effort
+
+
+class Workflow:
+    """Run steps as soon as the steps they require are completed, independent steps concurrently.
+
+    If a step fails (or exceeds its timeout) and is not best-effort, no further steps are started. Once the running steps are finished,
+    the compensations of all completed steps are run in the reverse order of completion and a WorkflowError is
+    raised. A step exceeding its timeout cannot be interrupted; it is left running in the background. Before the
+    compensations undo what such a step may still use (e.g. unmount the device an upload reads), the steps are
+    cancelled with the cancellation token and waited for.
+
+    :param steps: the list of Step objects
+    :param max_workers: (optional) the maximum number of steps running concurrently, default: the number of steps
+    :param logger: (optional) a logger
+    :param cancellation_token: (optional) the CancellationToken of the client the steps run with
+
+    :Example:
+        ::
+
+            workflow = Workflow([
+                Step('snapshot', lambda results: iaas_client.create_snapshot(volume.id),
+                     compensation=lambda results: iaas_client.delete_snapshot(results['snapshot'].id)),
+                Step('upload', lambda results: iaas_client.backup_directory_to_blobstore(directory, blob_name))
+            ])
+            results = workflow.run()
+    """
+
+    def __init__(self, steps, max_workers=None, logger=None, cancellation_token=None):
+        self.steps = {}
+        for step in steps:
+            if step.name in self.steps:
+                raise WorkflowError('Step {} is declared twice.'.format(step.name))
+            self.steps[step.name] = step
+        for step in steps:
+            unknown = [name for name in step.requires if name not in self.steps]
+            if unknown:
+                raise WorkflowError('Step {} requires the unknown steps {}.'.format(step.name, unknown))
+        self.__check_cycles()
+        self.max_workers = max_workers or max(1, len(steps))
+        self.logger = logger
+        self.cancellation_token = cancellation_token
+
+    def __check_cycles(self):
+        visited = set()
+        path = []
+
+        def visit(name):
+            if name in path:
+                raise WorkflowError('The steps {} depend on each other.'.format(path[path.index(name):]))
+            if name in visited:
+                return
+            path.append(name)
+            for required in self.steps[name].requires:
+                visit(required)
+            path.pop()
+            visited.add(name)
+
+        for name in self.steps:
+            visit(name)
+
+    def __log(self, message, error=False):
+        if self.logger:
+            (self.logger.error if error else self.logger.info)('[WORKFLOW] {}'.format(message))
+
+    def run(self, results=None):
+        """Run the workflow.
+
+        :param results: (optional) initial results, e.g. of steps run before
+        :returns: the results of all steps (a dictionary by step name)
+        """
+        results = dict(results or {})
+        pending = [step for step in self.steps.values() if step.name not in results]
+        running = {}
+        completed = []
+        timed_out = []
+        failure = None
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while (pending and failure is None) or running:
+                if failure is None:
+                    for step in [step for step in pending if all(name in results for name in step.requires)]:
+                        pending.remove(step)
+                        self.__log('Starting step {}.'.format(step.name))
+                        deadline = time.time() + step.timeout if step.timeout is not None else None
+                        running[executor.submit(step.action, dict(results))] = (step, deadline)
+                deadlines = [deadline for (step, deadline) in running.values() if deadline is not None]
+                timeout = max(0, min(deadlines) - time.time()) if deadlines else None
+                done, not_done = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step, deadline = running.pop(future)
+                    try:
+                        results[step.name] = future.result()
+                        completed.append(step)
+                        self.__log('Step {} completed.'.format(step.name))
+                    except Exception as error:
+                        if not step.best_effort:
+                            self.__log('Step {} failed: {}'.format(step.name, error), error=True)
+                            failure = failure or (step, error)
+                            continue
+                        self.__log('Step {} failed, going on: {}'.format(step.name, error), error=True)
+                        results[step.name] = None
+                        completed.append(step)
+                    except BaseException as error:
+                        self.__log('Step {} failed: {}'.format(step.name, error), error=True)
+                        failure = failure or (step, error)
+                for future in not_done:
+                    step, deadline = running[future]
+                    if deadline is not None and time.time() >= deadline:
+                        running.pop(future)
+                        timed_out.append(future)
+                        error = WorkflowError('Step {} exceeded its timeout of {} seconds.'.format(
+                            step.name, step.timeout))
+                        self.__log(str(error), error=True)
+                        if step.best_effort:
+                            results[step.name] = None
+                            completed.append(step)
+                        else:
+                            failure = failure or (step, error)
+        finally:
+            # Steps which exceeded their timeout are not waited for
+            executor.shutdown(wait=False)
+
+        if failure is not None:
+            self.__cancel(timed_out)
+            self.__compensate(completed, results)
+            step, error = failure
+            if isinstance(error, SystemExit):
+                # The abortion of a client (after SIGTERM/SIGINT) in a step
+                raise error
+            raise WorkflowError('Step {} failed: {}'.format(step.name, error)) from error
+        return results
+
+    def __cancel(self, timed_out):
+        running = [future for future in timed_out if not future.done()]
+        if not running:
+            return
+        self.__log('Cancelling {} steps which exceeded their timeout.'.format(len(running)))
+        # A token cancelled already (e.g. by SIGTERM) is left to the abortion of the client
+        cancel = self.cancellation_token is not None and not self.cancellation_token.cancelled
+        if cancel:
+            self.cancellation_token.cancel()
+        wait(running)
+        if cancel:
+            # The compensations run with the same client
+            self.cancellation_token.reset()
+
+    def __compensate(self, completed, results):
+        for step in reversed(completed):
+            if step.compensation is None:
+                continue
+            self.__log('Compensating step {}.'.format(step.name))
+            try:
+                step.compensation(results)
+            except Exception as error:
+                self.__log('Compensation of step {} failed: {}'.format(step.name, error), error=True)
+
+
+def _succeeded(result, description):
+    # The client methods return None (or False) instead of raising an exception if they fail
+    if result is None or result is False:
+        raise WorkflowError('{} failed.'.format(description))
+    return result
+
+
+def create_backup_workflow(iaas_client, instance_id, blob_name, directory_work, copy_snapshot=False, timeout=None):
+    """Create the workflow of an online backup: the persistent volume is snapshotted, a volume created from the
+    snapshot is mounted to directory_work and its content is uploaded to the BLOB storage.
+
+    With copy_snapshot (e.g. to keep an encrypted copy on AWS), the snapshot is copied while the volume created from
+    the original snapshot is attached, mounted and uploaded; the original snapshot is deleted afterwards. The work
+    directory is cleaned up while the volume is detached and deleted. The tear-down after the upload is best-effort:
+    once the backup is uploaded, a failing tear-down step is logged and does not undo the backup (e.g. by deleting
+    its snapshot); the resources left behind are cleaned up by BaseClient.clean_up.
+
+    :param iaas_client: the IaaS client
+    :param instance_id: the IaaS id of the instance
+    :param blob_name: the name of the blob in the BLOB storage
+    :param directory_work: the directory the volume is mounted to
+    :param copy_snapshot: (optional) whether to keep a copy of the snapshot instead of the snapshot
+    :param timeout: (optional) the timeout of every step in seconds
+    :returns: the workflow; its result 'snapshot' (or 'copy_snapshot') is the snapshot of the backup
+
+    :Example:
+        ::
+
+            results = create_backup_workflow(iaas_client, instance_id, 'files.tar.gz.gpg', '/tmp/backup').run()
+    """
+    steps = [
+        Step('volume', lambda results: _succeeded(
+             iaas_client.get_persistent_volume_for_instance(instance_id), 'Finding the persistent volume'),
+             timeout=timeout),
+        Step('snapshot', lambda results: _succeeded(
+             iaas_client.create_snapshot(results['volume'].id), 'Creating the snapshot'),
+             requires=['volume'],
+             compensation=lambda results: iaas_client.delete_snapshot(results['snapshot'].id),
+             timeout=timeout),
+        Step('create_volume', lambda results: _succeeded(
+             iaas_client.create_volume(results['volume'].size, results['snapshot'].id), 'Creating the volume'),
+             requires=['snapshot'],
+             compensation=lambda results: iaas_client.delete_volume(results['create_volume'].id),
+             timeout=timeout),
+        Step('create_attachment', lambda results: _succeeded(
+             iaas_client.create_attachment(results['create_volume'].id, instance_id), 'Attaching the volume'),
+             requires=['create_volume'],
+             compensation=lambda results: iaas_client.delete_attachment(results['create_volume'].id, instance_id),
+             timeout=timeout),
+        Step('create_directory', lambda results: _succeeded(
+             iaas_client.create_directory(directory_work), 'Creating the work directory'),
+             timeout=timeout),
+        Step('mountpoint', lambda results: _succeeded(
+             iaas_client.get_mountpoint(results['create_volume'].id, '1'), 'Finding the device of the volume'),
+             requires=['create_attachment'],
+             timeout=timeout),
+        Step('mount_device', lambda results: _succeeded(
+             iaas_client.mount_device(results['mountpoint'], directory_work), 'Mounting the volume'),
+             requires=['mountpoint', 'create_directory'],
+             compensation=lambda results: iaas_client.unmount_device(results['mountpoint']),
+             timeout=timeout),
+        Step('upload', lambda results: _succeeded(
+             iaas_client.backup_directory_to_blobstore(directory_work, blob_name), 'Uploading the backup'),
+             requires=['mount_device'],
+             timeout=timeout),
+        Step('unmount_device', lambda results: iaas_client.unmount_device(results['mountpoint']),
+             requires=['upload'],
+             timeout=timeout, best_effort=True),
+        Step('delete_directory', lambda results: iaas_client.delete_directory(directory_work),
+             requires=['unmount_device'],
+             timeout=timeout, best_effort=True),
+        Step('delete_attachment', lambda results: iaas_client.delete_attachment(results['create_volume'].id,
+                                                                                instance_id),
+             requires=['unmount_device'],
+             timeout=timeout, best_effort=True),
+        Step('delete_volume', lambda results: iaas_client.delete_volume(results['create_volume'].id),
+             requires=['delete_attachment'],
+             timeout=timeout, best_effort=True)
+    ]
+    if copy_snapshot:
+        steps += [
+            Step('copy_snapshot', lambda results: _succeeded(
+                 iaas_client.copy_snapshot(results['snapshot'].id), 'Copying the snapshot'),
+                 requires=['snapshot'],
+                 compensation=lambda results: iaas_client.delete_snapshot(results['copy_snapshot'].id),
+                 timeout=timeout),
+            Step('delete_snapshot', lambda results: iaas_client.delete_snapshot(results['snapshot'].id),
+                 requires=['copy_snapshot', 'delete_volume'],
+                 timeout=timeout, best_effort=True)
+        ]
+    return Workflow(steps, logger=iaas_client.logger, cancellation_token=iaas_client.cancellation_token)
+
+
+def create_restore_workflow(iaas_client, blob_name, directory_persistent, sharded=False, timeout=None):
+    """Create the workflow of a restore from the BLOB storage: the service job is stopped, the backup is downloaded
+    and extracted into directory_persistent and the service job is started again. If the download fails, the service
+    job is started nevertheless.
+
+    :param iaas_client: the IaaS client
+    :param blob_name: the name of the blob (or manifest of a sharded backup) in the BLOB storage
+    :param directory_persistent: the directory the backup is extracted to
+    :param sharded: (optional) whether the backup was created by backup_directory_to_blobstore_sharded
+    :param timeout: (optional) the timeout of every step in seconds
+    :returns: the workflow
+
+    :Example:
+        ::
+
+            create_restore_workflow(iaas_client, 'files.tar.gz.gpg', '/var/vcap/store/blueprint').run()
+    """
+    download = iaas_client.download_from_blobstore_decrypt_extract_sharded if sharded else \
+        iaas_client.download_from_blobstore_decrypt_extract
+
+    def start_service_job(results):
+        iaas_client.start_service_job()
+        return _succeeded(iaas_client.wait_for_service_job_status('running'), 'Starting the service job')
+
+    def stop_service_job(results):
+        iaas_client.stop_service_job()
+        return _succeeded(iaas_client.wait_for_service_job_status('not monitored'), 'Stopping the service job')
+
+    steps = [
+        Step('stop_service_job', stop_service_job,
+             compensation=start_service_job,
+             timeout=timeout),
+        Step('download', lambda results: _succeeded(download(blob_name, directory_persistent),
+                                                    'Downloading the backup'),
+             requires=['stop_service_job'],
+             timeout=timeout),
+        Step('start_service_job', start_service_job,
+             requires=['download'],
+             timeout=timeout)
+    ]
+    return Workflow(steps, logger=iaas_client.logger, cancellation_token=iaas_client.cancellation_token)
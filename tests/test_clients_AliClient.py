@@ -1,16 +1,19 @@
-from tests.utils.utilities import create_start_patcher, stop_all_patchers
+from tests.utils.utilities import create_start_patcher, stop_all_patchers, create_device_tree
 
 from lib.clients.AliClient import AliClient
 from aliyunsdkcore.acs_exception.exceptions import ServerException
 from lib.clients.BaseClient import BaseClient
 from lib.models.Snapshot import Snapshot
 from lib.models.Volume import Volume
+from lib.utils.device_inventory import DeviceInventory
 import unittest.mock
 from unittest.mock import patch
 from unittest.mock import Mock
 
 import oss2
 import os
+import tempfile
+import io
 import pytest
 
 #Test data
@@ -41,6 +44,7 @@ configuration = {
     'region_name' : region_id
 }
 valid_blob_path = '/tmp/valid-blob.txt'
+blob_content = os.urandom(2 * 1024 * 1024 + 10)
 invalid_blob_path = '/tmp/invalid-blob.txt'
 
 
@@ -291,7 +295,27 @@ class Bucket:
         assert blob_target == 'blob'
         if (blob_upload_path == invalid_blob_path):
             raise Exception('Invalid blob upload path')
-    def get_object(self, blob_target, blob_target_path):
+    def init_multipart_upload(self, blob_target, headers):
+        assert blob_target == 'blob'
+        self.parts = []
+        return Mock(upload_id='upload-id')
+    def upload_part(self, blob_target, upload_id, part_number, data):
+        assert upload_id == 'upload-id'
+        assert part_number == len(self.parts) + 1
+        if data == b'invalid':
+            raise Exception('Invalid part')
+        self.parts.append(data)
+        return Mock(etag='etag-{}'.format(part_number))
+    def complete_multipart_upload(self, blob_target, upload_id, parts):
+        assert [part.etag for part in parts] == ['etag-{}'.format(i + 1) for i in range(len(self.parts))]
+    def abort_multipart_upload(self, blob_target, upload_id):
+        self.aborted = upload_id
+    def head_object(self, blob_target):
+        return Mock(content_length=len(blob_content) if blob_target == 'large-blob' else 10)
+    def get_object(self, blob_target, blob_target_path=None, byte_range=None):
+        if byte_range is not None:
+            assert blob_target == 'large-blob'
+            return io.BytesIO(blob_content[byte_range[0]:byte_range[1] + 1])
         assert blob_target_path in (valid_blob_path, invalid_blob_path)
         assert blob_target == 'blob'
         if (blob_target_path == invalid_blob_path):
@@ -318,8 +342,7 @@ class RequestHeader:
         return
 
 def mock_shell(command, log_command=True):
-    if command == ('cat /proc/mounts | grep ' + directory_persistent):
-        return persistent_disk_mount_device_id + '1 ' + directory_persistent + ' ext4 rw,relatime,data=ordered 0 0'
+    return None
 
 def get_device_of_volume(volume_id):
     if volume_id == persistent_disk_id:
@@ -355,6 +378,10 @@ class TestAliClient:
         os.environ['SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY'] = log_dir
         self.aliClient = AliClient(operation_name, configuration, directory_persistent, directory_work_list,
                                    poll_delay_time, poll_maximum_time)
+        self.aliClient.device_inventory = DeviceInventory(create_device_tree(
+            tempfile.mkdtemp(), mounts=[(persistent_disk_mount_device_id + '1', directory_persistent)],
+            disks={os.path.basename(persistent_disk_mount_device_id): {
+                'partitions': [os.path.basename(persistent_disk_mount_device_id) + '1']}}))
 
     @classmethod
     def teardown_class(self):
@@ -398,9 +425,31 @@ class TestAliClient:
         except Exception as error:
             assert "Invalid blob upload path" in str(error)
     
+    def test_ali_uploads_stream_to_blobstore(self):
+        assert self.aliClient._upload_stream_to_blobstore(io.BytesIO(b'content'), 'blob') == True
+        assert self.aliClient.container.parts == [b'content']
+
+    def test_ali_upload_stream_to_blobstore_aborts_on_error(self):
+        pytest.raises(Exception, self.aliClient._upload_stream_to_blobstore, io.BytesIO(b'invalid'), 'blob')
+        assert self.aliClient.container.aborted == 'upload-id'
+
     def test_ali_downloads_from_blobstore(self):
         assert self.aliClient._download_from_blobstore('blob', valid_blob_path) == True
 
+    def test_ali_downloads_from_blobstore_in_ranges(self, tmpdir, monkeypatch):
+        monkeypatch.setitem(self.aliClient.transfer_configuration, 'download_range_size', 1)
+        monkeypatch.setitem(self.aliClient.transfer_configuration, 'download_multipart_threshold', 1)
+        target = str(tmpdir.join('download'))
+        assert self.aliClient._download_from_blobstore('large-blob', target) == True
+        with open(target, 'rb') as downloaded_file:
+            assert downloaded_file.read() == blob_content
+
+    def test_ali_downloads_from_blobstore_and_pipes_to_process(self, monkeypatch):
+        monkeypatch.setitem(self.aliClient.transfer_configuration, 'download_range_size', 1)
+        process = Mock(stdin=io.BytesIO())
+        assert self.aliClient._download_from_blobstore_and_pipe_to_process(process, 'large-blob', 65536) == True
+        assert process.stdin.getvalue() == blob_content
+
     def test_ali_download_to_blobstore_raises_exception(self):
         try:
             self.aliClient._download_from_blobstore('blob', invalid_blob_path)
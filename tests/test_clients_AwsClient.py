@@ -1,4 +1,4 @@
-from tests.utils.utilities import create_start_patcher, stop_all_patchers
+from tests.utils.utilities import create_start_patcher, stop_all_patchers, create_device_tree
 import tests.utils.setup_constants
 import os
 import pytest
@@ -8,10 +8,15 @@ from botocore.config import Config
 import botocore
 from lib.clients.AwsClient import AwsClient
 from lib.clients.BaseClient import BaseClient
+from lib.utils.cancellation import CancellationToken
+from lib.utils.device_inventory import DeviceInventory
 from lib.models.Snapshot import Snapshot
 from lib.models.Volume import Volume
 from pprint import pprint
 import json
+import io
+import threading
+import time
 
 #Test data
 valid_container = 'backup-container'
@@ -25,6 +30,8 @@ invalid_volume = 'invalid-volume'
 valid_volume_size = 40
 valid_volume_state = 'READY'
 valid_volume_device = '/dev/xvda'
+invalid_blob = 'invalid-blob'
+mib = 1024 * 1024
 
 configuration = {
     'credhub_url' : None,
@@ -71,8 +78,6 @@ def loadJsonToVolumeObject(path, volume_id, object):
 
 def mock_shell(command):
     print(command)
-    if command == ('cat /proc/mounts | grep '+ directory_persistent):
-        return valid_volume_device
 
 # Defintions of dummy clients and resources.
 # More details to be added as new tests will be added 
@@ -103,9 +108,56 @@ class Ec2Dummy:
         def load(self):
             pass
 
+    class CreatedVolume:
+        def __init__(self, volume_id):
+            self.id = volume_id
+
+    def create_volume(self, **kwargs):
+        return Ec2Dummy.CreatedVolume('volume-created')
+
+    def create_tags(self, Resources, Tags):
+        pass
+
 class EC2ClientDummy:
     def __init__(self):
-        pass
+        self.describe_calls = []
+        # The ids missing in the next describe response, like new resources right after their creation
+        self.lagging = set()
+
+    def describe_snapshots(self, Filters):
+        self.describe_calls.append(Filters)
+        lagging, self.lagging = self.lagging, set()
+        return {'Snapshots': [{'SnapshotId': snapshot_id, 'State': 'completed', 'VolumeSize': valid_snapshot_size,
+                               'StartTime': None}
+                              for snapshot_id in Filters[0]['Values']
+                              if snapshot_id != invalid_snapshot and snapshot_id not in lagging]}
+
+    def create_snapshots(self, InstanceSpecification, Description, TagSpecifications):
+        self.create_snapshots_call = InstanceSpecification
+        instance = json.load(open('tests/data/aws/instance.init.json'))
+        volumes = json.load(open('tests/data/aws/volumes.init.json'))
+        root_volume_ids = [volume['id'] for volume in instance['volumes_list']
+                           if volumes[volume['id']]['attachments'][0]['Device'] == instance['root_device_name']]
+        # Like EC2, which only accepts data volumes in the exclusion list
+        if set(root_volume_ids) & set(InstanceSpecification['ExcludeDataVolumeIds']):
+            raise Exception('The root volume cannot be excluded by ExcludeDataVolumeIds')
+        return {'Snapshots': [{'SnapshotId': 'snapshot-' + volume['id'], 'VolumeId': volume['id']}
+                              for volume in instance['volumes_list']
+                              if volume['id'] not in InstanceSpecification['ExcludeDataVolumeIds'] and
+                              not (InstanceSpecification['ExcludeBootVolume'] and volume['id'] in root_volume_ids)]}
+
+    def describe_volumes(self, Filters):
+        self.describe_calls.append(Filters)
+        if Filters[0]['Name'] == 'attachment.instance-id':
+            volumes = json.load(open('tests/data/aws/volumes.init.json'))
+            return {'Volumes': [{'VolumeId': volume['id'], 'State': 'in-use', 'Size': volumes[volume['id']]['size'],
+                                 'Attachments': [{'InstanceId': Filters[0]['Values'][0], 'Device': attachment['Device']}
+                                                 for attachment in volumes[volume['id']]['attachments']]}
+                                for volume in json.load(open('tests/data/aws/instance.init.json'))['volumes_list']]}
+        lagging, self.lagging = self.lagging, set()
+        return {'Volumes': [{'VolumeId': volume_id, 'State': 'available', 'Size': valid_volume_size, 'Attachments': []}
+                            for volume_id in Filters[0]['Values']
+                            if volume_id != invalid_volume and volume_id not in lagging]}
 
 class S3Dummy:
     class Bucket:
@@ -124,11 +176,52 @@ class S3Dummy:
         def delete_objects(self,Delete):
             pass
 
+        def upload_file(self, Filename, Key):
+            with open(Filename, 'rb') as f:
+                S3ClientDummy.objects[Key] = f.read()
+
 
 class S3ClientDummy:
+    objects = {}
+    uploads = {}
+
     def __init__(self):
         pass
 
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = 'upload-' + Key
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if Key == invalid_blob:
+            raise Exception('Upload of part failed')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': 'etag-{}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        assert [part['PartNumber'] for part in MultipartUpload['Parts']] == sorted(parts)
+        assert [part['ETag'] for part in MultipartUpload['Parts']] == ['etag-{}'.format(n) for n in sorted(parts)]
+        self.objects[Key] = b''.join(parts[part_number] for part_number in sorted(parts))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = [int(position) for position in Range[len('bytes='):].split('-')]
+        return {'Body': io.BytesIO(self.objects[Key][start:end + 1])}
+
+class ProcessDummy:
+    def __init__(self):
+        self.stdin = io.BytesIO()
+
 class AwsSessionDummy:
     def __init__(self):
         pass
@@ -191,7 +284,207 @@ class TestAwsClient:
         assert not hasattr(self.testAwsClientBlobOps, 'ec2')
         assert not hasattr(self.testAwsClientBlobOps, 'availability_zone')
 
+    def test_create_aws_client_with_invalid_upload_part_size(self):
+        for upload_part_size in (4, 5 * 1024 + 1):
+            with pytest.raises(Exception, match='upload part size'):
+                AwsClient(operation_name_blob_ops, dict(configuration_blob_ops, upload_part_size=upload_part_size),
+                          directory_persistent, directory_work_list, poll_delay_time, poll_maximum_time)
+
+    def test_refresh_credentials(self):
+        s3 = self.testAwsClient.s3
+        ec2 = self.testAwsClient.ec2
+        self.testAwsClient.refresh_credentials(dict(configuration, access_key_id='other-key-id'))
+        try:
+            assert self.testAwsClient._AwsClient__awsCredentials['access_key_id'] == 'other-key-id'
+            assert self.testAwsClient.s3 is not s3
+            assert self.testAwsClient.ec2 is not ec2
+            assert isinstance(self.testAwsClient.ec2.client, EC2ClientDummy)
+            assert self.testAwsClient.container.name == valid_container
+        finally:
+            self.testAwsClient.refresh_credentials(configuration)
+
     def test_get_container_exception(self):
         with pytest.raises(Exception):
             container = self.testAwsClient.s3.Bucket(invalid_container)
             assert container is None
+
+    def test_upload_stream_to_blobstore(self):
+        assert self.testAwsClient._upload_stream_to_blobstore(io.BytesIO(b'content'), 'blob') == True
+        assert S3ClientDummy.objects['blob'] == b'content'
+
+    def test_upload_stream_to_blobstore_in_parts(self, monkeypatch):
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'upload_part_size', 1)
+        content = os.urandom(3 * mib + 10)
+        assert self.testAwsClient._upload_stream_to_blobstore(io.BytesIO(content), 'stream-blob') == True
+        assert S3ClientDummy.objects['stream-blob'] == content
+        assert S3ClientDummy.uploads == {}
+
+    def test_upload_stream_to_blobstore_bounds_buffered_parts(self, monkeypatch):
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'upload_part_size', 1)
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'upload_buffer_size', 2)
+        s3_client = self.testAwsClient.s3.client
+        upload_part = s3_client.upload_part
+        uploading = []
+        max_uploading = []
+        lock = threading.Lock()
+
+        def upload_slow_part(Bucket, Key, UploadId, PartNumber, Body):
+            with lock:
+                uploading.append(PartNumber)
+                max_uploading.append(len(uploading))
+            time.sleep(0.05)
+            with lock:
+                uploading.remove(PartNumber)
+            return upload_part(Bucket, Key, UploadId, PartNumber, Body)
+
+        monkeypatch.setattr(s3_client, 'upload_part', upload_slow_part)
+        content = os.urandom(6 * mib)
+        assert self.testAwsClient._upload_stream_to_blobstore(io.BytesIO(content), 'buffered-blob') == True
+        assert S3ClientDummy.objects['buffered-blob'] == content
+        # At most 2 MiB are kept in memory, although up to 8 parts could be uploaded at the same time
+        assert max(max_uploading) == 2
+
+    def test_upload_to_blobstore_below_threshold(self, tmpdir):
+        tmpdir.join('small').write_binary(b'small content')
+        assert self.testAwsClient._upload_to_blobstore(str(tmpdir.join('small')), 'small-blob') == True
+        assert S3ClientDummy.objects['small-blob'] == b'small content'
+
+    def test_upload_to_blobstore_in_parts(self, tmpdir, monkeypatch):
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'upload_part_size', 1)
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'upload_multipart_threshold', 1)
+        content = os.urandom(5 * mib + 10)
+        tmpdir.join('large').write_binary(content)
+        assert self.testAwsClient._upload_to_blobstore(str(tmpdir.join('large')), 'large-blob') == True
+        assert S3ClientDummy.objects['large-blob'] == content
+
+    def test_upload_to_blobstore_aborts_upload_if_part_fails(self, tmpdir, monkeypatch):
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'upload_part_size', 1)
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'upload_multipart_threshold', 1)
+        tmpdir.join('large').write_binary(os.urandom(3 * mib))
+        with pytest.raises(Exception):
+            self.testAwsClient._upload_to_blobstore(str(tmpdir.join('large')), invalid_blob)
+        assert invalid_blob not in S3ClientDummy.objects
+        assert S3ClientDummy.uploads == {}
+
+    def test_upload_stream_to_blobstore_aborts_upload_if_cancelled(self, monkeypatch):
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'upload_part_size', 1)
+        token = CancellationToken()
+        monkeypatch.setattr(self.testAwsClient, 'cancellation_token', token)
+        stream = io.BytesIO(os.urandom(4 * mib))
+
+        def read(size=-1):
+            # SIGTERM arrives while the second part is read
+            if stream.tell() >= mib:
+                token.cancel()
+            return io.BytesIO.read(stream, size)
+
+        monkeypatch.setattr(stream, 'read', read)
+        with pytest.raises(Exception):
+            self.testAwsClient._upload_stream_to_blobstore(stream, 'cancelled-blob')
+        assert 'cancelled-blob' not in S3ClientDummy.objects
+        assert S3ClientDummy.uploads == {}
+        assert stream.tell() < 4 * mib
+
+    def test_describe_snapshots_and_volumes_in_one_request(self):
+        self.testAwsClient.ec2.client.describe_calls = []
+        snapshots = self.testAwsClient._describe_snapshots([valid_snapshot, invalid_snapshot])
+        assert list(snapshots) == [valid_snapshot]
+        assert snapshots[valid_snapshot]['State'] == 'completed'
+        volumes = self.testAwsClient._describe_volumes([valid_volume, invalid_volume])
+        assert list(volumes) == [valid_volume]
+        assert self.testAwsClient.ec2.client.describe_calls == [
+            [{'Name': 'snapshot-id', 'Values': [valid_snapshot, invalid_snapshot]}],
+            [{'Name': 'volume-id', 'Values': [valid_volume, invalid_volume]}]
+        ]
+
+    def test_wait_batched_for_deleted_snapshot(self):
+        assert self.testAwsClient._wait_batched(self.testAwsClient._describe_snapshots, invalid_snapshot,
+                                                lambda snap: snap is None, 'Waiting...') is None
+
+    def test_create_snapshots_of_attached_volumes_at_once(self):
+        snapshots = self.testAwsClient._create_snapshots(['valid-volume-1'])
+        assert [snapshot.id for snapshot in snapshots] == ['snapshot-valid-volume-1']
+        assert snapshots[0].status == 'completed'
+        assert self.testAwsClient.ec2.client.create_snapshots_call == {
+            'InstanceId': 'vm-id',
+            'ExcludeBootVolume': True,
+            'ExcludeDataVolumeIds': []
+        }
+
+    def test_create_snapshots_waits_for_snapshot_missing_in_first_describe(self):
+        self.testAwsClient.ec2.client.lagging = {'snapshot-valid-volume-1'}
+        snapshots = self.testAwsClient._create_snapshots(['valid-volume-1'])
+        assert [(snapshot.id, snapshot.status) for snapshot in snapshots] == [('snapshot-valid-volume-1', 'completed')]
+        assert self.testAwsClient.ec2.client.lagging == set()
+
+    def test_create_volume_waits_for_volume_missing_in_first_describe(self):
+        self.testAwsClient.ec2.client.lagging = {'volume-created'}
+        volume = self.testAwsClient._create_volume(valid_volume_size)
+        self.testAwsClient._remove_volume(volume.id)
+        assert (volume.id, volume.size) == ('volume-created', valid_volume_size)
+        assert self.testAwsClient.ec2.client.lagging == set()
+
+    def test_get_attached_volumes_for_instance_at_once(self):
+        self.testAwsClient.ec2.client.describe_calls.clear()
+        volumes = self.testAwsClient.get_attached_volumes_for_instance('vm-id')
+        assert [(volume.id, volume.size, volume.device) for volume in volumes] == [
+            ('valid-volume-root', 10, '/dev/xvda'), ('valid-volume-1', 60, '/dev/sda')]
+        assert self.testAwsClient.ec2.client.describe_calls == [
+            [{'Name': 'attachment.instance-id', 'Values': ['vm-id']}]]
+
+    def test_get_persistent_volume_for_instance(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(self.testAwsClient, 'device_inventory', DeviceInventory(create_device_tree(
+            str(tmpdir), mounts=[(valid_volume_device + '1', directory_persistent)],
+            disks={'xvda': {'partitions': ['xvda1']}})))
+        assert self.testAwsClient.has_nvme_persistent_volume() == False
+        volume = self.testAwsClient.get_persistent_volume_for_instance('vm-id')
+        assert (volume.id, volume.device) == ('valid-volume-1', '/dev/sda')
+
+    def test_get_nvme_mountpoint(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(self.testAwsClient, 'device_inventory', DeviceInventory(create_device_tree(
+            str(tmpdir), mounts=[('/dev/nvme0n1p1', directory_persistent)],
+            disks={'nvme0n1': {'serial': 'vol0aaaaaaaaaaaaaaaa', 'partitions': ['nvme0n1p1']},
+                   'nvme1n1': {'serial': 'vol0123456789abcdef0', 'partitions': ['nvme1n1p1']},
+                   'xvdb': {}})))
+        assert self.testAwsClient.has_nvme_persistent_volume() == True
+        assert self.testAwsClient.get_mountpoint('vol-0123456789abcdef0') == '/dev/nvme1n1p1'
+        assert self.testAwsClient.get_mountpoint('vol-0fffffffffffffff0') is None
+
+    def test_get_upload_part_size(self):
+        assert self.testAwsClient._get_upload_part_size(100 * mib) == 16 * mib
+        assert self.testAwsClient._get_upload_part_size(10000 * 16 * mib) == 16 * mib
+        assert self.testAwsClient._get_upload_part_size(10000 * 16 * mib + 1) == 17 * mib
+        assert self.testAwsClient._get_upload_part_size(5 * 1024 * 1024 * mib) <= 5 * 1024 * mib
+        with pytest.raises(Exception):
+            self.testAwsClient._get_upload_part_size(10000 * 5 * 1024 * mib + 1)
+
+    def test_get_stream_upload_part_size(self):
+        assert self.testAwsClient._get_stream_upload_part_size(1) == 16 * mib
+        assert self.testAwsClient._get_stream_upload_part_size(1000) == 16 * mib
+        assert self.testAwsClient._get_stream_upload_part_size(1001) == 32 * mib
+        # The parts grow at most to the upload buffer size
+        assert self.testAwsClient._get_stream_upload_part_size(7000) == 1024 * mib
+        assert self.testAwsClient._get_stream_upload_part_size(10000) == 1024 * mib
+
+    def test_get_stream_upload_part_size_with_large_buffer(self, monkeypatch):
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'upload_buffer_size', 8 * 1024)
+        assert self.testAwsClient._get_stream_upload_part_size(10000) == 5 * 1024 * mib
+
+    def test_download_from_blobstore_in_ranges(self, tmpdir, monkeypatch):
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'download_range_size', 1)
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'download_multipart_threshold', 1)
+        content = os.urandom(3 * mib + 10)
+        S3ClientDummy.objects['download-blob'] = content
+        target = str(tmpdir.join('download'))
+        assert self.testAwsClient._download_from_blobstore('download-blob', target) == True
+        with open(target, 'rb') as downloaded_file:
+            assert downloaded_file.read() == content
+
+    def test_download_from_blobstore_and_pipe_to_process_in_ranges(self, monkeypatch):
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'download_range_size', 1)
+        monkeypatch.setitem(self.testAwsClient.transfer_configuration, 'download_multipart_threshold', 1)
+        content = os.urandom(3 * mib + 10)
+        S3ClientDummy.objects['download-blob'] = content
+        process = ProcessDummy()
+        assert self.testAwsClient._download_from_blobstore_and_pipe_to_process(process, 'download-blob', 65536) == True
+        assert process.stdin.getvalue() == content
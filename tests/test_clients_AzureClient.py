@@ -0,0 +1,106 @@
+from tests.utils.utilities import create_start_patcher, stop_all_patchers
+import os
+import io
+import random
+import threading
+import time
+import types
+from lib.clients.AzureClient import AzureClient
+from lib.clients.BaseClient import BaseClient
+
+#Test data
+valid_container = 'backup-container'
+mib = 1024 * 1024
+
+configuration_blob_ops = {
+    'credhub_url' : None,
+    'type' : 'online',
+    'container' : valid_container,
+    'client_id' : 'client-id',
+    'client_secret' : 'client-secret',
+    'tenant_id' : 'tenant-id',
+    'resource_group' : 'resource-group',
+    'storageAccount' : 'storage-account',
+    'storageAccessKey' : 'storage-access-key',
+    'subscription_id' : 'subscription-id'
+}
+
+directory_persistent = '/var/vcap/store'
+directory_work_list = '/tmp'
+log_dir = 'tests'
+poll_delay_time = 10
+poll_maximum_time = 60
+operation_name_blob_ops = 'blob_operation'
+
+# Definitions of dummy clients and resources.
+class BlockBlobServiceDummy:
+    def __init__(self, account_name=None, account_key=None):
+        self.blobs = {}
+        self.requested_ranges = []
+        self.lock = threading.Lock()
+
+    def get_container_properties(self, container):
+        if container != valid_container:
+            raise Exception('The specified container does not exist.')
+        return {'name': container}
+
+    def create_blob_from_text(self, container, blob_name, text):
+        pass
+
+    def delete_blob(self, container, blob_name):
+        pass
+
+    def get_blob_properties(self, container, blob_name):
+        return types.SimpleNamespace(properties=types.SimpleNamespace(content_length=len(self.blobs[blob_name])))
+
+    def get_blob_to_bytes(self, container, blob_name, start_range, end_range, max_connections):
+        # Ranges complete out of order
+        time.sleep(random.random() / 100)
+        with self.lock:
+            self.requested_ranges.append((start_range, end_range, max_connections))
+        return types.SimpleNamespace(content=self.blobs[blob_name][start_range:end_range + 1])
+
+class ProcessDummy:
+    def __init__(self):
+        self.stdin = io.BytesIO()
+
+#Tests
+class TestAzureClient:
+    patchers = []
+    @classmethod
+    def setup_class(self):
+        self.patchers.append(create_start_patcher(patch_function='last_operation', patch_object=BaseClient)['patcher'])
+        self.patchers.append(create_start_patcher(
+            patch_function='lib.clients.AzureClient.ServicePrincipalCredentials')['patcher'])
+        self.patchers.append(create_start_patcher(patch_function='lib.clients.AzureClient.BlockBlobService',
+                                                  side_effect=BlockBlobServiceDummy)['patcher'])
+        os.environ['SF_BACKUP_RESTORE_LOG_DIRECTORY'] = log_dir
+        os.environ['SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY'] = log_dir
+
+        self.testAzureClientBlobOps = AzureClient(operation_name_blob_ops, configuration_blob_ops,
+                                                  directory_persistent, directory_work_list, poll_delay_time,
+                                                  poll_maximum_time)
+
+    @classmethod
+    def teardown_class(self):
+        stop_all_patchers(self.patchers)
+
+    def test_create_azure_client_blob_ops(self):
+        assert isinstance(self.testAzureClientBlobOps.block_blob_service, BlockBlobServiceDummy)
+        assert not hasattr(self.testAzureClientBlobOps, 'compute_client')
+
+    def test_download_from_blobstore_and_pipe_to_process_in_ranges(self, monkeypatch):
+        monkeypatch.setitem(self.testAzureClientBlobOps.transfer_configuration, 'download_range_size', 1)
+        monkeypatch.setitem(self.testAzureClientBlobOps.transfer_configuration, 'download_buffer_size', 2)
+        block_blob_service = self.testAzureClientBlobOps.block_blob_service
+        content = os.urandom(3 * mib + 10)
+        block_blob_service.blobs['download-blob'] = content
+        block_blob_service.requested_ranges = []
+        process = ProcessDummy()
+        assert self.testAzureClientBlobOps._download_from_blobstore_and_pipe_to_process(
+            process, 'download-blob', 65536, max_connections=3) == True
+        # The ranges are written in order, also if they complete out of order
+        assert process.stdin.getvalue() == content
+        # The end of a range is inclusive, the last range is the partial rest of the blob
+        assert sorted(block_blob_service.requested_ranges) == [
+            (0, mib - 1, 1), (mib, 2 * mib - 1, 1), (2 * mib, 3 * mib - 1, 1), (3 * mib, 3 * mib + 9, 1)]
@@ -0,0 +1,572 @@
+from tests.utils.utilities import create_start_patcher, stop_all_patchers
+import os
+import signal
+import io
+import subprocess
+import tarfile
+import json
+import threading
+import time
+import random
+import pytest
+from lib.clients.BaseClient import BaseClient
+from lib.encryption import decrypt_stream
+from lib.utils.cancellation import CancellationToken, OperationCancelled
+from lib.models.Snapshot import Snapshot
+from lib.models.Volume import Volume
+
+#Test data
+valid_container = 'backup-container'
+secret = 'xyz'
+configuration = {
+    'credhub_url' : None,
+    'type' : 'online',
+    'backup_guid' : 'backup-guid',
+    'instance_id' : 'vm-id',
+    'secret' : secret,
+    'job_name' : 'service-job-name',
+    'trigger' : 'on-demand-or-scheduled',
+    'container' : valid_container,
+    'encryption' : 'native'
+}
+directory_persistent = '/var/vcap/store'
+directory_work_list = ['/tmp']
+log_dir = 'tests'
+poll_delay_time = 10
+poll_maximum_time = 60
+operation_name = 'backup'
+mib = 1024 * 1024
+
+# Minimal IaaS client keeping its blobs in memory
+class DummyClient(BaseClient):
+    def __init__(self, *args):
+        super(DummyClient, self).__init__(*args)
+        self.blobs = {}
+        self.requested_offsets = []
+
+    def _upload_stream_to_blobstore(self, stream, blob_target_name):
+        self.blobs[blob_target_name] = stream.read()
+        return True
+
+    def get_container(self):
+        return self.blobs
+
+    def get_persistent_volume_for_instance(self, instance_id):
+        return None
+
+    def _download_from_blobstore_and_pipe_to_process(self, process, blob_to_download_name, segment_size):
+        blob_size = self._get_blob_size(blob_to_download_name)
+        self._download_blob_in_ranges(blob_to_download_name, blob_size, process.stdin.write)
+        return True
+
+    def _get_blob_size(self, blob_name):
+        return len(self.blobs[blob_name])
+
+    def _get_blob_range(self, blob_name, offset, length):
+        # Ranges complete out of order
+        time.sleep(random.random() / 100)
+        with self.lock:
+            self.requested_offsets.append(offset)
+        if blob_name == 'failing-blob' and offset > 0:
+            raise Exception('Range request failed')
+        return self.blobs[blob_name][offset:offset + length]
+
+def decrypt(data):
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(data), decrypted, secret)
+    return decrypted.getvalue()
+
+def decrypt_with_gpg(data):
+    return subprocess.run('gpg --batch --passphrase {} -d'.format(secret), shell=True, input=data,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+
+def process_group_members(process_group_id):
+    # The processes of a process group which have not exited yet
+    members = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid)) as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # The state and the process group id
+        if fields[0] != 'Z' and int(fields[2]) == process_group_id:
+            members.append(int(pid))
+    return members
+
+#Tests
+class TestBaseClient:
+    patchers = []
+    @classmethod
+    def setup_class(self):
+        self.patchers.append(create_start_patcher(patch_function='last_operation', patch_object=BaseClient)['patcher'])
+        os.environ['SF_BACKUP_RESTORE_LOG_DIRECTORY'] = log_dir
+        os.environ['SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY'] = log_dir
+
+        self.testClient = DummyClient(operation_name, configuration, directory_persistent, directory_work_list,
+                                      poll_delay_time, poll_maximum_time)
+        self.testClient.lock = threading.Lock()
+        self.testClient.transfer_configuration['download_range_size'] = 1
+        self.testClient.transfer_configuration['download_buffer_size'] = 3
+        self.testClient.transfer_configuration['download_max_concurrency'] = 2
+
+    @classmethod
+    def teardown_class(self):
+        stop_all_patchers(self.patchers)
+
+    def test_backup_directory_to_blobstore(self, tmpdir):
+        tmpdir.join('file.txt').write('content')
+        tmpdir.mkdir('subdirectory').join('other.txt').write('other content')
+        assert self.testClient.backup_directory_to_blobstore(str(tmpdir), 'blob') == True
+        with tarfile.open(fileobj=io.BytesIO(decrypt(self.testClient.blobs['blob'])), mode='r:gz') as tarball:
+            names = tarball.getnames()
+            assert './file.txt' in names
+            assert './subdirectory/other.txt' in names
+            assert tarball.extractfile('./subdirectory/other.txt').read() == b'other content'
+
+    def test_backup_directory_to_blobstore_with_gpg(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(self.testClient, 'ENCRYPTION', 'gpg')
+        tmpdir.join('file.txt').write('content')
+        assert self.testClient.backup_directory_to_blobstore(str(tmpdir), 'gpg-blob') == True
+        with tarfile.open(fileobj=io.BytesIO(decrypt_with_gpg(self.testClient.blobs['gpg-blob'])), mode='r:gz') as tarball:
+            assert tarball.extractfile('./file.txt').read() == b'content'
+
+    def test_download_from_blobstore_decrypt_extract_legacy_gpg_archive(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(self.testClient, 'ENCRYPTION', 'gpg')
+        source = tmpdir.mkdir('source')
+        source.join('file.txt').write('content')
+        assert self.testClient.backup_directory_to_blobstore(str(source), 'gpg-blob') == True
+        monkeypatch.setattr(self.testClient, 'ENCRYPTION', 'native')
+        target = tmpdir.mkdir('target')
+        assert self.testClient.download_from_blobstore_decrypt_extract('gpg-blob', str(target)) == True
+        assert target.join('file.txt').read() == 'content'
+
+    def test_create_and_encrypt_tarball_of_directory(self, tmpdir):
+        source = tmpdir.mkdir('source')
+        source.join('file.txt').write('content')
+        archive = str(tmpdir.join('archive.tar.gz.enc'))
+        assert self.testClient.create_and_encrypt_tarball_of_directory(str(source), archive) == True
+        target = tmpdir.mkdir('target')
+        assert self.testClient.decrypt_and_extract_tarball_of_directory(archive, str(target)) == True
+        assert target.join('file.txt').read() == 'content'
+
+    def test_decrypt_and_extract_tarball_of_directory_with_wrong_secret(self, tmpdir, monkeypatch):
+        source = tmpdir.mkdir('source')
+        source.join('file.txt').write('content')
+        archive = str(tmpdir.join('archive.tar.gz.enc'))
+        assert self.testClient.create_and_encrypt_tarball_of_directory(str(source), archive) == True
+        monkeypatch.setattr(self.testClient, 'SECRET', 'wrong')
+        assert self.testClient.decrypt_and_extract_tarball_of_directory(archive, str(tmpdir.mkdir('target'))) is None
+
+    def test_keeps_deprecated_device_attributes(self):
+        assert self.testClient.FILE_MOUNTS == '/proc/mounts'
+        assert self.testClient.DEVICE_PATH_TEMPLATE.format(2, 0) == '/sys/bus/scsi/devices/2:*:*:0/block'
+
+    def test_encryption_defaults_to_gpg(self):
+        client = DummyClient(operation_name, dict(configuration, encryption=None), directory_persistent,
+                             directory_work_list, poll_delay_time, poll_maximum_time)
+        assert client.ENCRYPTION == 'gpg'
+
+    def test_encrypt_and_decrypt_file(self, tmpdir):
+        # The file is read directly, not by a shell command
+        tmpdir.join('list; rm.txt').write('content')
+        encrypted = str(tmpdir.join('list.txt.enc'))
+        assert self.testClient.encrypt_file(str(tmpdir.join('list; rm.txt')), encrypted) == True
+        assert b'content' not in tmpdir.join('list.txt.enc').read_binary()
+        assert self.testClient.decrypt_file(encrypted, str(tmpdir.join('decrypted.txt'))) == True
+        assert tmpdir.join('decrypted.txt').read() == 'content'
+
+    @pytest.mark.parametrize('codec', ['zstd', 'lz4'])
+    def test_backup_and_restore_with_compression_codec(self, tmpdir, monkeypatch, codec):
+        monkeypatch.setattr(self.testClient, 'COMPRESSION', codec)
+        source = tmpdir.mkdir('source')
+        source.join('file.txt').write('content')
+        assert self.testClient.backup_directory_to_blobstore(str(source), 'codec-blob') == True
+        assert self.testClient.output_json['compression'] == codec
+        # The restore detects the codec
+        monkeypatch.setattr(self.testClient, 'COMPRESSION', 'gzip')
+        target = tmpdir.mkdir('target')
+        assert self.testClient.download_from_blobstore_decrypt_extract('codec-blob', str(target)) == True
+        assert target.join('file.txt').read() == 'content'
+
+        archive = str(tmpdir.join('archive.tar.enc'))
+        monkeypatch.setattr(self.testClient, 'COMPRESSION', codec)
+        assert self.testClient.create_and_encrypt_tarball_of_directory(str(source), archive) == True
+        extracted = tmpdir.mkdir('extracted')
+        assert self.testClient.decrypt_and_extract_tarball_of_directory(archive, str(extracted)) == True
+        assert extracted.join('file.txt').read() == 'content'
+
+    def test_create_and_extract_tarball_of_directory_with_lz4(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(self.testClient, 'COMPRESSION', 'lz4')
+        source = tmpdir.mkdir('source')
+        source.join('file.txt').write('content')
+        tarball = str(tmpdir.join('files.tar.lz4'))
+        assert self.testClient.create_tarball_of_directory(str(source), tarball)
+        target = tmpdir.mkdir('target')
+        assert self.testClient.extract_tarball_of_directory(tarball, str(target))
+        assert target.join('file.txt').read() == 'content'
+
+    def test_backup_and_restore_sharded(self, tmpdir):
+        source = tmpdir.mkdir('source')
+        source.join('file.txt').write('content')
+        source.join('large.bin').write_binary(os.urandom(100000))
+        subdirectory = source.mkdir('subdirectory')
+        for i in range(5):
+            subdirectory.join('other-{}.txt'.format(i)).write('other content {}'.format(i))
+        assert self.testClient.backup_directory_to_blobstore_sharded(str(source), 'sharded-blob', 3) == True
+        manifest = json.loads(self.testClient.blobs['sharded-blob'].decode())
+        assert manifest['shards'] == ['sharded-blob.shard-000', 'sharded-blob.shard-001', 'sharded-blob.shard-002']
+        assert all(shard in self.testClient.blobs for shard in manifest['shards'])
+
+        target = tmpdir.mkdir('target')
+        assert self.testClient.download_from_blobstore_decrypt_extract_sharded('sharded-blob', str(target)) == True
+        assert target.join('file.txt').read() == 'content'
+        assert target.join('large.bin').read_binary() == source.join('large.bin').read_binary()
+        for i in range(5):
+            assert target.join('subdirectory', 'other-{}.txt'.format(i)).read() == 'other content {}'.format(i)
+
+    def test_backup_directory_to_blobstore_raises_exception_if_tar_fails(self, tmpdir):
+        pytest.raises(Exception, self.testClient.backup_directory_to_blobstore,
+                      str(tmpdir.join('missing')), 'blob')
+
+    def test_download_from_blobstore_decrypt_extract(self, tmpdir):
+        source = tmpdir.mkdir('source')
+        source.join('file.txt').write('content')
+        source.mkdir('subdirectory').join('other.txt').write('other content')
+        assert self.testClient.backup_directory_to_blobstore(str(source), 'backup-blob') == True
+        target = tmpdir.mkdir('target')
+        assert self.testClient.download_from_blobstore_decrypt_extract('backup-blob', str(target)) == True
+        assert target.join('file.txt').read() == 'content'
+        assert target.join('subdirectory', 'other.txt').read() == 'other content'
+
+    def test_download_from_blobstore_decrypt_extract_restarts_pipeline_if_download_fails(self, tmpdir, monkeypatch):
+        source = tmpdir.mkdir('source')
+        source.join('large.bin').write_binary(os.urandom(1000000))
+        assert self.testClient.backup_directory_to_blobstore(str(source), 'retried-blob') == True
+        download = self.testClient._download_from_blobstore_and_pipe_to_process
+        attempts = []
+
+        def download_failing_mid_stream(process, blob_to_download_name, segment_size):
+            attempts.append(process)
+            if len(attempts) == 1:
+                process.stdin.write(self.testClient.blobs[blob_to_download_name][:100000])
+                raise Exception('Connection reset')
+            return download(process, blob_to_download_name, segment_size)
+
+        monkeypatch.setattr(self.testClient, '_download_from_blobstore_and_pipe_to_process',
+                            download_failing_mid_stream)
+        monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+        target = tmpdir.mkdir('target')
+        assert self.testClient.download_from_blobstore_decrypt_extract('retried-blob', str(target)) == True
+        assert target.join('large.bin').read_binary() == source.join('large.bin').read_binary()
+        # The second attempt writes into a new pipeline
+        assert len(attempts) == 2
+        assert attempts[0].stdin is not attempts[1].stdin
+
+    def test_download_from_blobstore_decrypt_extract_sharded_restarts_manifest_download(self, tmpdir, monkeypatch):
+        source = tmpdir.mkdir('source')
+        source.join('file.txt').write('content')
+        assert self.testClient.backup_directory_to_blobstore_sharded(str(source), 'retried-manifest', 1) == True
+        download = self.testClient._download_from_blobstore_and_pipe_to_process
+        attempts = []
+
+        def download_failing_mid_stream(process, blob_to_download_name, segment_size):
+            if blob_to_download_name == 'retried-manifest':
+                attempts.append(process)
+                if len(attempts) == 1:
+                    process.stdin.write(self.testClient.blobs[blob_to_download_name][:10])
+                    raise Exception('Connection reset')
+            return download(process, blob_to_download_name, segment_size)
+
+        monkeypatch.setattr(self.testClient, '_download_from_blobstore_and_pipe_to_process',
+                            download_failing_mid_stream)
+        monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+        target = tmpdir.mkdir('target')
+        assert self.testClient.download_from_blobstore_decrypt_extract_sharded('retried-manifest', str(target)) == True
+        assert target.join('file.txt').read() == 'content'
+        assert len(attempts) == 2
+
+    def test_download_blob_in_ranges(self):
+        content = os.urandom(10 * mib + 10)
+        self.testClient.blobs['large-blob'] = content
+        self.testClient.requested_offsets = []
+        written = []
+
+        def write(data):
+            # The reorder buffer holds at most three ranges ahead of the range written next
+            with self.testClient.lock:
+                assert max(self.testClient.requested_offsets) < sum(len(chunk) for chunk in written) + 3 * mib
+            written.append(data)
+
+        self.testClient._download_blob_in_ranges('large-blob', len(content), write)
+        assert b''.join(written) == content
+        assert sorted(self.testClient.requested_offsets) == [i * mib for i in range(11)]
+
+    def test_download_blob_in_ranges_raises_exception_if_range_fails(self):
+        self.testClient.blobs['failing-blob'] = os.urandom(4 * mib)
+        self.testClient.requested_offsets = []
+        written = []
+        pytest.raises(Exception, self.testClient._download_blob_in_ranges, 'failing-blob', 4 * mib, written.append)
+        assert len(written) <= 1
+
+    def test_use_ranged_download(self):
+        assert self.testClient._use_ranged_download(None) == False
+        assert self.testClient._use_ranged_download(63 * mib) == False
+        assert self.testClient._use_ranged_download(64 * mib) == True
+
+    def test_abortable_methods_abort_if_scheduled(self, tmpdir, monkeypatch):
+        aborted = []
+        monkeypatch.setattr(self.testClient, '_BaseClient__abort', lambda: aborted.append(True))
+        self.testClient.get_container()
+        assert aborted == []
+        monkeypatch.setattr(self.testClient, '_BaseClient__ABORT', True)
+        self.testClient.get_container()
+        assert aborted == []
+        self.testClient.create_directory(str(tmpdir.join('directory')))
+        assert aborted == [True]
+        # Overrides in IaaS clients are abortable as well
+        self.testClient.get_persistent_volume_for_instance('vm-id')
+        assert aborted == [True, True]
+        assert DummyClient.get_persistent_volume_for_instance.abortable == True
+
+    def test_backup_directory_to_blobstore_is_cancelled_and_aborted(self, tmpdir, monkeypatch):
+        aborted = []
+        monkeypatch.setattr(self.testClient, '_BaseClient__ABORT', False)
+        monkeypatch.setattr(self.testClient, 'cancellation_token', CancellationToken())
+        monkeypatch.setattr(self.testClient, '_BaseClient__abort', lambda: aborted.append(True))
+        tmpdir.join('file.txt').write('content')
+
+        def upload(stream, blob_target_name):
+            stream.read(1)
+            # SIGTERM arrives during the upload
+            self.testClient._BaseClient__schedule_abortion(15, None)
+            stream.read(1)
+
+        monkeypatch.setattr(self.testClient, '_upload_stream_to_blobstore', upload)
+        pytest.raises(Exception, self.testClient.backup_directory_to_blobstore, str(tmpdir), 'cancelled-blob')
+        assert aborted == [True]
+
+    def test_backup_tar_command_to_blobstore_terminates_pipeline_if_upload_fails(self, tmpdir, monkeypatch):
+        # The stream is read by gpg, not by the native encryption of this process
+        monkeypatch.setattr(self.testClient, 'ENCRYPTION', 'gpg')
+        processes = []
+        members = []
+
+        class RecordingPopen(subprocess.Popen):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                processes.append(self)
+
+        def upload(stream, blob_target_name):
+            # The shell, the subshell, sleep, cat and gpg; sleep does not write, so it would not get a SIGPIPE
+            deadline = time.time() + 5
+            while len(process_group_members(processes[0].pid)) < 4 and time.time() < deadline:
+                time.sleep(0.01)
+            members.extend(process_group_members(processes[0].pid))
+            raise Exception('Upload failed')
+
+        monkeypatch.setattr(subprocess, 'Popen', RecordingPopen)
+        monkeypatch.setattr(self.testClient, '_upload_stream_to_blobstore', upload)
+        pytest.raises(Exception, self.testClient._BaseClient__backup_tar_command_to_blobstore,
+                      '(echo data; sleep 30) | cat', str(tmpdir), 'failed-blob')
+        assert len(members) >= 4
+        deadline = time.time() + 5
+        while process_group_members(processes[0].pid) and time.time() < deadline:
+            time.sleep(0.05)
+        assert process_group_members(processes[0].pid) == []
+
+    def test_download_blob_in_ranges_is_cancelled(self, monkeypatch):
+        token = CancellationToken()
+        monkeypatch.setattr(self.testClient, 'cancellation_token', token)
+        self.testClient.blobs['cancelled-blob'] = os.urandom(10 * mib)
+        written = []
+
+        def write(data):
+            written.append(data)
+            token.cancel()
+
+        pytest.raises(OperationCancelled, self.testClient._download_blob_in_ranges, 'cancelled-blob', 10 * mib, write)
+        assert len(written) == 1
+
+    def test_retry_does_not_retry_cancelled_operation(self, monkeypatch):
+        token = CancellationToken()
+        monkeypatch.setattr(self.testClient, 'cancellation_token', token)
+        calls = []
+
+        def operation():
+            calls.append(True)
+            token.cancel()
+            raise Exception('Wrapped error of the IaaS client')
+
+        pytest.raises(OperationCancelled, self.testClient._retry, operation, [])
+        assert calls == [True]
+
+    def test_wait_uses_wait_strategy(self, monkeypatch):
+        delays = []
+        recorded = []
+        states = iter([False, False, True])
+
+        class RecordingWaitStrategy:
+            def get_delay(self, resource_type, attempt, elapsed):
+                return attempt
+
+            def record(self, resource_type, duration):
+                recorded.append(resource_type)
+
+        monkeypatch.setattr(self.testClient, 'wait_strategy', RecordingWaitStrategy())
+        monkeypatch.setattr(time, 'sleep', delays.append)
+        self.testClient._wait('Waiting...', lambda: next(states), None, resource_type='snapshot.create')
+        assert delays == [0, 1]
+        assert recorded == ['snapshot.create']
+
+    def test_wait_natively(self, monkeypatch):
+        waited = []
+        delays = []
+        monkeypatch.setattr(time, 'sleep', delays.append)
+        self.testClient._wait_natively(waited.append, 'Waiting...', lambda: True, None, resource_type='volume.create')
+        assert waited == [poll_maximum_time]
+        assert delays == []
+
+    def test_wait_natively_falls_back_to_polling(self, monkeypatch):
+        delays = []
+        states = iter([False, True])
+
+        def native_wait(timeout):
+            raise AttributeError('No native waiter')
+
+        monkeypatch.setattr(time, 'sleep', delays.append)
+        self.testClient._wait_natively(native_wait, 'Waiting...', lambda: next(states), None)
+        assert len(delays) == 1
+
+    def test_create_snapshots_concurrently(self, monkeypatch):
+        # Both snapshots have to be in progress at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def create_snapshot(volume_id, description):
+            barrier.wait()
+            return Snapshot('snapshot-' + volume_id, 40, None, 'completed')
+
+        monkeypatch.setattr(self.testClient, '_create_snapshot', create_snapshot)
+        snapshots = self.testClient.create_snapshots(['volume-data', 'volume-wal'])
+        assert [snapshot.id for snapshot in snapshots] == ['snapshot-volume-data', 'snapshot-volume-wal']
+        assert self.testClient.output_json['snapshotIds'] == ['snapshot-volume-data', 'snapshot-volume-wal']
+
+    def test_create_snapshots_deletes_all_snapshots_if_one_fails(self, monkeypatch):
+        deleted = []
+
+        def create_snapshot(volume_id, description):
+            if volume_id == 'volume-wal':
+                raise Exception('Snapshot failed')
+            return Snapshot('snapshot-' + volume_id, 40, None, 'completed')
+
+        monkeypatch.setattr(self.testClient, '_create_snapshot', create_snapshot)
+        monkeypatch.setattr(self.testClient, 'delete_snapshot', deleted.append)
+        with pytest.raises(Exception):
+            self.testClient._create_snapshots(['volume-data', 'volume-wal'])
+        assert deleted == ['snapshot-volume-data']
+
+    def test_clean_up_tears_down_volumes_and_snapshots_concurrently(self, monkeypatch):
+        events = []
+        lock = threading.Lock()
+        # The snapshot deletion and the detachment have to run at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def record(event):
+            with lock:
+                events.append(event)
+
+        def delete_attachment(volume_id, instance_id):
+            barrier.wait()
+            record('detach ' + volume_id)
+            self.testClient._remove_attachment(volume_id, instance_id)
+
+        def delete_volume(volume_id):
+            assert 'detach ' + volume_id in events
+            record('delete ' + volume_id)
+            self.testClient._remove_volume(volume_id)
+
+        def delete_snapshot(snapshot_id):
+            barrier.wait()
+            record('delete ' + snapshot_id)
+            self.testClient._remove_snapshot(snapshot_id)
+
+        monkeypatch.setattr(self.testClient, 'delete_directory', lambda directory: True)
+        monkeypatch.setattr(self.testClient, 'delete_attachment', delete_attachment)
+        monkeypatch.setattr(self.testClient, 'delete_volume', delete_volume)
+        monkeypatch.setattr(self.testClient, 'delete_snapshot', delete_snapshot)
+        self.testClient._add_volume('volume-1')
+        self.testClient._add_attachment('volume-1', 'vm-id')
+        self.testClient._add_snapshot('snapshot-1')
+        self.testClient.clean_up(on_detached=lambda: record('detached'))
+        assert sorted(events) == ['delete snapshot-1', 'delete volume-1', 'detach volume-1', 'detached']
+        assert events.index('detach volume-1') < events.index('detached')
+        assert events.index('detach volume-1') < events.index('delete volume-1')
+        assert self.testClient._BaseClient__volumes_attached_ids == []
+        assert self.testClient._BaseClient__volumes_ids == []
+        assert self.testClient._BaseClient__snapshots_ids == []
+
+    def test_exit_starts_service_job_before_deletions_if_configured(self, monkeypatch):
+        events = []
+        monkeypatch.setattr(self.testClient, 'EARLY_SERVICE_RESTART', True)
+
+        def clean_up(on_detached=None):
+            events.append('detached')
+            on_detached()
+            events.append('deleted')
+
+        monkeypatch.setattr(self.testClient, 'clean_up', clean_up)
+        monkeypatch.setattr(self.testClient, 'start_service_job', lambda: events.append('started'))
+        monkeypatch.setattr(self.testClient, 'wait_for_service_job_status', lambda status: True)
+        with pytest.raises(SystemExit):
+            self.testClient.exit('Something unpredictable happened.')
+        assert events == ['detached', 'started', 'deleted']
+
+    def test_reconfigure_for_another_backup(self):
+        self.testClient.output_json['snapshotId'] = 'snapshot'
+        self.testClient._add_snapshot('snapshot')
+        self.testClient._add_volume('volume')
+        self.testClient._add_attachment('volume', 'vm-id')
+        self.testClient.reconfigure(dict(configuration, backup_guid='other-backup-guid', trigger='scheduled'))
+        try:
+            assert self.testClient.GUID == 'other-backup-guid'
+            assert self.testClient.BLOB_PREFIX == 'other-backup-guid'
+            assert self.testClient.tags['trigger'] == 'scheduled'
+            assert self.testClient.output_json == {}
+            # The resources of the earlier operation are not cleaned up by this one
+            assert self.testClient._BaseClient__snapshots_ids == []
+            assert self.testClient._BaseClient__volumes_ids == []
+            assert self.testClient._BaseClient__volumes_attached_ids == []
+        finally:
+            self.testClient.reconfigure(configuration)
+        assert self.testClient.GUID == 'backup-guid'
+
+    def test_reconfigure_does_not_cancel_next_operation_after_abortion(self):
+        self.testClient.schedule_abortion(signal.SIGTERM)
+        assert self.testClient.cancellation_token.cancelled
+        self.testClient.reconfigure(configuration)
+        assert not self.testClient.cancellation_token.cancelled
+        assert not self.testClient._BaseClient__ABORT
+
+    def test_keep_snapshot(self):
+        self.testClient._add_snapshot('kept-snapshot')
+        self.testClient.keep_snapshot('kept-snapshot')
+        assert 'kept-snapshot' not in self.testClient._BaseClient__snapshots_ids
+
+    def test_attached_volumes_are_reused_until_attachments_change(self, monkeypatch):
+        retrievals = []
+
+        def get_attached_volumes_for_instance(instance_id):
+            retrievals.append(instance_id)
+            return [Volume('volume-id', 'none', 40, '/dev/sdb')]
+
+        monkeypatch.setattr(self.testClient, 'get_attached_volumes_for_instance', get_attached_volumes_for_instance)
+        self.testClient._invalidate_attached_volumes()
+        assert self.testClient._get_attached_volumes('vm-id')[0].device == '/dev/sdb'
+        assert self.testClient._get_attached_volumes('vm-id')[0].id == 'volume-id'
+        assert retrievals == ['vm-id']
+        self.testClient._add_attachment('other-volume-id', 'vm-id')
+        self.testClient._remove_attachment('other-volume-id', 'vm-id')
+        self.testClient._get_attached_volumes('vm-id')
+        assert retrievals == ['vm-id', 'vm-id']
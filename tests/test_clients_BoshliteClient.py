@@ -0,0 +1,61 @@
+from tests.utils.utilities import create_start_patcher, stop_all_patchers
+import os
+import io
+from lib.clients.BoshliteClient import BoshliteClient
+from lib.clients.BaseClient import BaseClient
+
+#Test data
+valid_container = 'backup-container'
+mib = 1024 * 1024
+
+configuration = {
+    'credhub_url' : None,
+    'type' : 'online',
+    'instance_id' : 'vm-id',
+    'container' : valid_container
+}
+
+directory_persistent = '/var/vcap/store'
+directory_work_list = '/tmp'
+log_dir = 'tests'
+poll_delay_time = 10
+poll_maximum_time = 60
+operation_name_blob_ops = 'blob_operation'
+
+# Definitions of dummy resources.
+class ProcessDummy:
+    def __init__(self):
+        self.stdin = io.BytesIO()
+
+#Tests
+class TestBoshliteClient:
+    patchers = []
+    @classmethod
+    def setup_class(self):
+        self.patchers.append(create_start_patcher(patch_function='last_operation', patch_object=BaseClient)['patcher'])
+        os.environ['SF_BACKUP_RESTORE_LOG_DIRECTORY'] = log_dir
+        os.environ['SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY'] = log_dir
+
+        self.testBoshliteClient = BoshliteClient(operation_name_blob_ops, configuration, directory_persistent,
+                                                 directory_work_list, poll_delay_time, poll_maximum_time)
+
+    @classmethod
+    def teardown_class(self):
+        stop_all_patchers(self.patchers)
+
+    def test_create_boshlite_client(self):
+        assert self.testBoshliteClient.container == os.path.join('/tmp/service_fabrik_backup_restore', valid_container)
+        assert os.path.isdir(self.testBoshliteClient.container)
+
+    def test_download_from_blobstore_and_pipe_to_process(self):
+        content = os.urandom(2 * mib + 10)
+        blob_path = os.path.join(self.testBoshliteClient.container, 'download-blob')
+        with open(blob_path, 'wb') as blob_file:
+            blob_file.write(content)
+        try:
+            process = ProcessDummy()
+            assert self.testBoshliteClient._download_from_blobstore_and_pipe_to_process(process, 'download-blob',
+                                                                                        mib) == True
+            assert process.stdin.getvalue() == content
+        finally:
+            os.remove(blob_path)
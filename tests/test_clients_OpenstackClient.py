@@ -1,4 +1,7 @@
 import os
+import io
+import threading
+import time
 import pytest
 import ast
 from tests.utils.utilities import create_start_patcher, stop_all_patchers
@@ -137,6 +140,34 @@ class SwiftClient:
         return [{}]
 
 
+class ThreadSwiftClient:
+    def __init__(self, objects):
+        self.objects = objects
+        self.threads = set()
+
+    def get_object(self, container, name, headers):
+        self.threads.add(threading.get_ident())
+        start, end = [int(position) for position in headers['Range'][len('bytes='):].split('-')]
+        time.sleep(0.01)
+        return {}, self.objects[name][start:end + 1]
+
+
+class SegmentSwiftClient:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def put_object(self, container, name, contents, chunk_size=None, headers=None):
+        self.objects[name] = b''.join(contents) if not isinstance(contents, bytes) else contents
+        if headers:
+            self.manifest = headers['X-Object-Manifest']
+
+    def get_container(self, container, prefix, full_listing):
+        return {}, [{'name': name} for name in sorted(self.objects) if name.startswith(prefix)]
+
+    def delete_object(self, container, name):
+        del self.objects[name]
+
+
 class SwiftService:
     def upload():
         pass
@@ -247,3 +278,70 @@ class TestOpenstackClient:
     def test_delete_attachment_exception(self):
         pytest.raises(Exception, self.osClient._delete_attachment,
                       invalid_disk_name, valid_vm_id)
+
+    def test_get_snapshots_and_volumes_by_id(self, monkeypatch):
+        monkeypatch.setattr(self.osClient.cinder.volume_snapshots, 'list', None, raising=False)
+        monkeypatch.setattr(self.osClient.cinder.volumes, 'list', None, raising=False)
+        snapshots = self.osClient._get_snapshots([valid_snapshot_name, not_found_snapshot_name])
+        assert list(snapshots) == [valid_snapshot_name]
+        assert snapshots[valid_snapshot_name].status == 'available'
+        volumes = self.osClient._get_volumes([valid_disk_name, not_found_disk_name])
+        assert list(volumes) == [valid_disk_name]
+        assert volumes[valid_disk_name].status == 'in-use'
+
+    def test_get_volumes_raises_errors_other_than_not_found(self, monkeypatch):
+        def get(volume_id):
+            raise CinderForbidden(**file_to_dict('tests/data/openstack/cinder.delete.forbidden.txt'))
+
+        monkeypatch.setattr(self.osClient.cinder.volumes, 'get', get)
+        with pytest.raises(CinderForbidden):
+            self.osClient._get_volumes([valid_disk_name])
+
+    def test_get_attached_volumes_for_instance_gets_attached_volumes_only(self, monkeypatch):
+        server_volumes = [CinderVolume(None, {'id': volume_id, 'device': device}, True, None)
+                          for volume_id, device in (('volume-1', '/dev/vdb'), ('volume-2', '/dev/vdc'))]
+        volumes = {volume_id: CinderVolume(None, {'id': volume_id, 'size': size, 'status': 'in-use'}, True, None)
+                   for volume_id, size in (('volume-1', 10), ('volume-2', 20), ('volume-3', 30))}
+        requested = []
+
+        def get(volume_id):
+            requested.append(volume_id)
+            return volumes[volume_id]
+
+        monkeypatch.setattr(self.osClient.nova.volumes, 'get_server_volumes', lambda instance_id: server_volumes,
+                            raising=False)
+        monkeypatch.setattr(self.osClient.cinder.volumes, 'list', None, raising=False)
+        monkeypatch.setattr(self.osClient.cinder.volumes, 'get', get)
+        assert [(volume.id, volume.size, volume.device)
+                for volume in self.osClient.get_attached_volumes_for_instance(valid_vm_id)] == \
+            [('volume-1', 10, '/dev/vdb'), ('volume-2', 20, '/dev/vdc')]
+        assert sorted(requested) == ['volume-1', 'volume-2']
+
+    def test_get_blob_ranges_with_a_connection_per_thread(self, monkeypatch):
+        mib = 1024 * 1024
+        content = os.urandom(8 * mib + 10)
+        connections = []
+
+        def create_thread_swift_client():
+            connections.append(ThreadSwiftClient({'range-blob': content}))
+            return connections[-1]
+
+        monkeypatch.setattr(self.osClient, 'create_thread_swift_client', create_thread_swift_client)
+        monkeypatch.setitem(self.osClient.transfer_configuration, 'download_range_size', 1)
+        downloaded = io.BytesIO()
+        self.osClient._download_blob_in_ranges('range-blob', len(content), downloaded.write, max_concurrency=4)
+        assert downloaded.getvalue() == content
+        # The ranges are requested concurrently, but no connection is shared by several threads
+        assert 1 < len(connections) <= 4
+        assert all(len(connection.threads) == 1 for connection in connections)
+
+    def test_upload_stream_to_blobstore_replaces_segments_of_previous_upload(self, monkeypatch):
+        swift = SegmentSwiftClient({'stream-blob/stream/00000000': b'stale', 'stream-blob/stream/00000001': b'stale',
+                                    'other-blob/stream/00000000': b'other'})
+        monkeypatch.setattr(self.osClient, 'swift', swift)
+        assert self.osClient._upload_stream_to_blobstore(io.BytesIO(b'content'), 'stream-blob') == True
+        segments = [name for name in swift.objects if name.startswith('stream-blob/stream/')]
+        # Only the segment of this upload is left and the manifest points to its own prefix
+        assert len(segments) == 1 and swift.objects[segments[0]] == b'content'
+        assert swift.manifest == '{}/{}'.format(valid_container, segments[0][:-len('00000000')])
+        assert swift.objects['other-blob/stream/00000000'] == b'other'
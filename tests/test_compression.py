@@ -0,0 +1,50 @@
+import subprocess
+import pytest
+from unittest.mock import patch
+from lib import compression
+from lib.compression import ExtractingWriter
+
+def create_tarball(directory, codec, level=None):
+    return subprocess.run(compression.tar_create_command(str(directory), codec, level), shell=True,
+                          stdout=subprocess.PIPE, check=True).stdout
+
+@pytest.mark.parametrize('codec', ['gzip', 'zstd', 'lz4'])
+def test_extracting_writer_detects_codec(tmpdir, codec):
+    source = tmpdir.mkdir('source')
+    source.join('file.txt').write('content')
+    tarball = create_tarball(source, codec)
+    assert compression.detect_codec(tarball) in (codec, 'pigz')
+    target = tmpdir.mkdir('target')
+    writer = ExtractingWriter(str(target))
+    for i in range(0, len(tarball), 3):
+        writer.write(tarball[i:i + 3])
+    assert writer.close() == 0
+    assert target.join('file.txt').read() == 'content'
+
+def test_extracting_writer_extracts_uncompressed_tarball(tmpdir):
+    source = tmpdir.mkdir('source')
+    source.join('file.txt').write('content')
+    tarball = subprocess.run('tar -cp -C {} .'.format(source), shell=True, stdout=subprocess.PIPE, check=True).stdout
+    assert compression.detect_codec(tarball) is None
+    target = tmpdir.mkdir('target')
+    writer = ExtractingWriter(str(target))
+    writer.write(tarball)
+    assert writer.close() == 0
+    assert target.join('file.txt').read() == 'content'
+
+def test_extracting_writer_returns_exit_code_of_tar(tmpdir):
+    writer = ExtractingWriter(str(tmpdir))
+    writer.write(b'\x1f\x8bno gzip at all')
+    assert writer.close() != 0
+
+def test_compress_program():
+    assert compression.compress_program('zstd') == 'zstd -q -T0 -3'
+    assert compression.compress_program('zstd', 19) == 'zstd -q -T0 -19'
+    assert compression.compress_program('gzip') == 'gzip -6'
+
+def test_pigz_falls_back_to_gzip_if_not_installed():
+    with patch('lib.compression.shutil.which', return_value=None):
+        assert compression.resolve_codec('pigz') == 'gzip'
+        assert compression.detect_codec(b'\x1f\x8b\x08\x00') == 'gzip'
+    with patch('lib.compression.shutil.which', return_value='/usr/bin/pigz'):
+        assert compression.resolve_codec('pigz') == 'pigz'
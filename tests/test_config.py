@@ -149,6 +149,38 @@ class TestConfig():
 
         assert configuration['container'] == ops_parameters['blob_operation']['container']
 
+    def test_build_parser_transfer_parameters(self):
+        parser = build_parser('backup')
+        params = create_operation_parameters('backup')
+
+        configuration = vars(parser.parse_args(params))
+        assert configuration['upload_part_size'] is None
+        assert configuration['upload_max_concurrency'] is None
+
+        configuration = vars(parser.parse_args(params + ['--upload_part_size', '64', '--upload_max_concurrency', '16']))
+        assert configuration['upload_part_size'] == 64
+        assert configuration['upload_max_concurrency'] == 16
+
+    def test_build_parser_wait_parameters(self):
+        parser = build_parser('backup')
+        params = create_operation_parameters('backup')
+
+        configuration = vars(parser.parse_args(params))
+        assert configuration['wait_strategy'] is None
+
+        configuration = vars(parser.parse_args(params + ['--wait_strategy', 'predictive']))
+        assert configuration['wait_strategy'] == 'predictive'
+
+    def test_build_parser_clean_up_parameters(self):
+        parser = build_parser('backup')
+        params = create_operation_parameters('backup')
+
+        configuration = vars(parser.parse_args(params))
+        assert configuration['early_service_restart'] is False
+
+        configuration = vars(parser.parse_args(params + ['--early_service_restart']))
+        assert configuration['early_service_restart'] is True
+
     def test_build_parser_exception(self):
         with pytest.raises(Exception) as e:
             build_parser('invalid_type')
@@ -0,0 +1,209 @@
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+import pytest
+from lib.daemon import AgentDaemon, send_request
+from lib.models.Snapshot import Snapshot
+from lib.models.Volume import Volume
+from lib.utils.cancellation import CancellationToken
+
+configuration = {
+    'iaas': 'aws',
+    'type': 'online',
+    'container': 'backup-container'
+}
+
+# Minimal IaaS client recording how it is used by the daemon
+class DaemonClientDummy:
+    created = []
+
+    def __init__(self, operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time,
+                 poll_maximum_time):
+        self.configuration = configuration
+        self.reconfigured = []
+        self.refreshed = []
+        self.cleaned_up = False
+        self.output_json = {}
+        self.logger = self
+        self.cancellation_token = CancellationToken()
+        # Created and deleted snapshots, tracked like by BaseClient
+        self.snapshot_ids = []
+        self.deleted_snapshot_ids = []
+        self.snapshots_created = 0
+        self.abortions = []
+        DaemonClientDummy.created.append(self)
+
+    def reconfigure(self, configuration):
+        self.configuration = configuration
+        self.reconfigured.append(configuration)
+        self.output_json = {}
+        self.snapshot_ids = []
+
+    def refresh_credentials(self, configuration):
+        self.refreshed.append(configuration)
+
+    def initialize(self):
+        pass
+
+    def finalize(self):
+        pass
+
+    def error(self, message):
+        pass
+
+    def info(self, message):
+        pass
+
+    def last_operation(self, stage, state=None):
+        pass
+
+    def clean_up(self):
+        self.cleaned_up = True
+        for snapshot_id in list(self.snapshot_ids):
+            self.delete_snapshot(snapshot_id)
+
+    def keep_snapshot(self, snapshot_id):
+        if snapshot_id in self.snapshot_ids:
+            self.snapshot_ids.remove(snapshot_id)
+
+    def schedule_abortion(self, signum):
+        self.abortions.append(signum)
+
+    def get_persistent_volume_for_instance(self, instance_id):
+        return Volume('volume-persistent', 'none', 40)
+
+    def create_snapshot(self, volume_id):
+        self.snapshots_created += 1
+        snapshot = Snapshot('snapshot-{}'.format(self.snapshots_created), 40, None, 'completed')
+        self.snapshot_ids.append(snapshot.id)
+        return snapshot
+
+    def delete_snapshot(self, snapshot_id):
+        self.keep_snapshot(snapshot_id)
+        self.deleted_snapshot_ids.append(snapshot_id)
+        return True
+
+    def create_volume(self, size, snapshot_id):
+        return Volume('volume', 'none', size)
+
+    def get_mountpoint(self, volume_id, partition=None):
+        return '/dev/sdb1'
+
+    def backup_directory_to_blobstore(self, directory, blob_name):
+        return None if blob_name == 'failing-blob' else True
+
+    def create_attachment(self, *args):
+        return True
+
+    delete_attachment = delete_volume = create_directory = delete_directory = mount_device = unmount_device = \
+        create_attachment
+
+    def upload_to_blobstore(self, source, target, throw_exception=None):
+        if source == 'invalid-file':
+            return None
+        self.output_json['uploaded'] = target
+        return True
+
+def create_client_dummy(*args):
+    return DaemonClientDummy(*args)
+
+@pytest.fixture
+def daemon():
+    DaemonClientDummy.created = []
+    # Unix socket paths are limited to about 100 characters
+    directory = tempfile.mkdtemp()
+    daemon = AgentDaemon(os.path.join(directory, 'agent.sock'), configuration, '/var/vcap/store', ['/tmp'],
+                         create_client=create_client_dummy)
+    thread = threading.Thread(target=daemon.serve, kwargs={'idle_timeout': 0.05}, daemon=True)
+    thread.start()
+    while not daemon.running:
+        time.sleep(0.01)
+    yield daemon
+    daemon.stop()
+    thread.join(timeout=5)
+    os.rmdir(directory)
+
+def upload_request(source):
+    return {
+        'operation': 'blob_operation',
+        'configuration': {'type': 'offline'},
+        'action': 'upload',
+        'source': source,
+        'target': 'blob'
+    }
+
+def test_daemon_reuses_client_between_requests(daemon):
+    assert send_request(upload_request('file'), daemon.socket_path) == {'state': 'succeeded',
+                                                                        'output': {'uploaded': 'blob'}}
+    assert send_request(upload_request('file'), daemon.socket_path)['state'] == 'succeeded'
+    assert len(DaemonClientDummy.created) == 1
+    client = DaemonClientDummy.created[0]
+    assert client.configuration['iaas'] == 'aws'
+    assert client.configuration['type'] == 'offline'
+    assert len(client.reconfigured) == 1
+    assert send_request({'operation': 'ping'}, daemon.socket_path) == {'state': 'succeeded',
+                                                                       'clients': ['blob_operation']}
+
+def test_daemon_cleans_up_failed_request(daemon):
+    answer = send_request(upload_request('invalid-file'), daemon.socket_path)
+    assert answer['state'] == 'failed'
+    assert DaemonClientDummy.created[0].cleaned_up
+
+def test_daemon_rejects_invalid_requests(daemon):
+    assert send_request({'operation': 'unknown'}, daemon.socket_path)['state'] == 'failed'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(daemon.socket_path)
+        connection.sendall(b'no json\n')
+        assert b'"state": "failed"' in connection.makefile('rb').readline()
+    assert DaemonClientDummy.created == []
+
+def test_daemon_keeps_snapshot_of_successful_backup_if_later_backup_fails(daemon):
+    def backup_request(blob_name):
+        return {
+            'operation': 'backup',
+            'configuration': {'instance_id': 'vm-id'},
+            'blob_name': blob_name,
+            'directory_work': '/tmp/backup'
+        }
+
+    assert send_request(backup_request('blob'), daemon.socket_path)['state'] == 'succeeded'
+    client = DaemonClientDummy.created[0]
+    assert client.snapshot_ids == []
+    assert send_request(backup_request('failing-blob'), daemon.socket_path)['state'] == 'failed'
+    assert len(DaemonClientDummy.created) == 1
+    assert client.cleaned_up
+    assert client.deleted_snapshot_ids == ['snapshot-2']
+
+def test_daemon_refreshes_credentials_of_idle_clients(daemon):
+    daemon.refresh_interval = 0
+    send_request(upload_request('file'), daemon.socket_path)
+    client = DaemonClientDummy.created[0]
+    while not client.refreshed:
+        time.sleep(0.01)
+    assert client.refreshed[0]['type'] == 'offline'
+    assert len(DaemonClientDummy.created) == 1
+
+def test_daemon_stops_on_signal_and_aborts_running_request(daemon, monkeypatch):
+    upload = DaemonClientDummy.upload_to_blobstore
+
+    def upload_interrupted_by_signal(client, source, target, throw_exception=None):
+        daemon._AgentDaemon__handle_signal(signal.SIGTERM, None)
+        return upload(client, source, target, throw_exception)
+
+    send_request(upload_request('file'), daemon.socket_path)
+    client = DaemonClientDummy.created[0]
+    assert client.abortions == []
+    monkeypatch.setattr(DaemonClientDummy, 'upload_to_blobstore', upload_interrupted_by_signal)
+    send_request(upload_request('file'), daemon.socket_path)
+    assert client.abortions == [signal.SIGTERM]
+    assert not daemon.running
+    assert daemon.busy_client is None
+
+def test_daemon_stops_on_signal_if_idle(daemon):
+    send_request(upload_request('file'), daemon.socket_path)
+    daemon._AgentDaemon__handle_signal(signal.SIGTERM, None)
+    assert not daemon.running
+    assert DaemonClientDummy.created[0].abortions == []
@@ -0,0 +1,76 @@
+import io
+import os
+import subprocess
+import pytest
+from lib import encryption
+from lib.encryption import EncryptingReader, DecryptingWriter, EncryptionError, encrypt_stream, decrypt_stream
+
+secret = 'xyz'
+chunk_size = 1024
+
+def encrypt(data, secret=secret):
+    encrypted = io.BytesIO()
+    encrypt_stream(io.BytesIO(data), encrypted, secret, chunk_size)
+    return encrypted.getvalue()
+
+def decrypt(data, secret=secret):
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(data), decrypted, secret, 100)
+    return decrypted.getvalue()
+
+@pytest.mark.parametrize('size', [0, 1, chunk_size - 1, chunk_size, chunk_size + 1, 10 * chunk_size, 10 * chunk_size + 7])
+def test_encryption_round_trip(size):
+    data = os.urandom(size)
+    encrypted = encrypt(data)
+    assert encryption.is_native_archive(encrypted)
+    assert size < 16 or data[:16] not in encrypted
+    assert decrypt(encrypted) == data
+
+def test_encrypting_reader_reads_in_pieces():
+    data = os.urandom(5 * chunk_size + 3)
+    reader = EncryptingReader(io.BytesIO(data), secret, chunk_size, max_workers=2)
+    pieces = []
+    piece = reader.read(100)
+    while piece:
+        pieces.append(piece)
+        piece = reader.read(100)
+    reader.close()
+    assert decrypt(b''.join(pieces)) == data
+
+def test_decryption_with_wrong_secret_fails():
+    pytest.raises(EncryptionError, decrypt, encrypt(b'content'), 'wrong')
+
+def test_decryption_of_truncated_archive_fails():
+    encrypted = encrypt(os.urandom(3 * chunk_size))
+    # Cut off after the second chunk, i.e. at a chunk boundary
+    truncated = encrypted[:encryption.HEADER_SIZE + 2 * (chunk_size + encryption.TAG_SIZE)]
+    pytest.raises(EncryptionError, decrypt, truncated)
+    pytest.raises(EncryptionError, decrypt, encrypted[:encryption.HEADER_SIZE - 1])
+
+def test_decryption_of_tampered_archive_fails():
+    encrypted = bytearray(encrypt(os.urandom(3 * chunk_size)))
+    encrypted[encryption.HEADER_SIZE + chunk_size + 20] ^= 1
+    pytest.raises(EncryptionError, decrypt, bytes(encrypted))
+
+def test_decryption_of_legacy_gpg_archive(tmpdir):
+    data = os.urandom(3 * chunk_size)
+    legacy = subprocess.run(['gpg', '--batch', '--symmetric', '--cipher-algo', 'aes256', '--passphrase', secret],
+                            input=data, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    assert not encryption.is_native_archive(legacy)
+    # gpg writes to the file descriptor of the target
+    target = tmpdir.join('decrypted')
+    with open(str(target), 'wb') as decrypted_file:
+        decrypt_stream(io.BytesIO(legacy), decrypted_file, secret, 100)
+    assert target.read_binary() == data
+
+def test_decryption_of_legacy_gpg_archive_into_file_object():
+    data = os.urandom(3 * chunk_size)
+    legacy = subprocess.run(['gpg', '--batch', '--symmetric', '--cipher-algo', 'aes256', '--passphrase', secret],
+                            input=data, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    # The target has no file descriptor, e.g. the ExtractingWriter of a streaming restore
+    assert decrypt(legacy) == data
+
+def test_decryption_of_legacy_gpg_archive_with_wrong_secret_fails():
+    legacy = subprocess.run(['gpg', '--batch', '--symmetric', '--cipher-algo', 'aes256', '--passphrase', secret],
+                            input=b'content', stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    pytest.raises(EncryptionError, decrypt, legacy, 'wrong')
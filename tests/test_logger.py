@@ -0,0 +1,74 @@
+import logging
+import queue
+import time
+from lib.logger import BoundedQueue, BoundedQueueHandler, BoundedQueueListener, EscapedMessage, Logger
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class Client:
+    def last_operation(self, stage, state=None):
+        pass
+
+
+def create_logger(name, records):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(BoundedQueueHandler(records))
+    return logger
+
+
+def test_queued_records_are_formatted_by_listener():
+    records = queue.Queue(10)
+    create_logger('test_logger_listener', records)
+    logger = Logger(Client())
+    logger.logger = logging.getLogger('test_logger_listener')
+    logger.info('Creating volume "sf-disk"')
+    logger.warning({'volume': 'sf-disk'})
+    # Strings are escaped by the listener
+    assert isinstance(records.queue[0].msg, EscapedMessage)
+    handler = ListHandler()
+    listener = BoundedQueueListener(records, handler)
+    listener.start()
+    listener.stop()
+    assert handler.lines == ['INFO "Creating volume \\"sf-disk\\""', 'WARNING {"volume": "sf-disk"}']
+
+def test_full_queue_drops_records_below_warning():
+    records = queue.Queue(2)
+    logger = create_logger('test_logger_full_queue', records)
+    for number in range(5):
+        logger.info(EscapedMessage('message {}'.format(number)))
+    assert records.qsize() == 2
+    records.get_nowait()
+    records.get_nowait()
+    logger.info(EscapedMessage('message 5'))
+    assert [str(record.msg) for record in list(records.queue)] == [
+        '"message 5"', '"3 log messages were dropped, as they were logged faster than written."']
+
+def test_full_queue_drops_warnings_after_timeout():
+    records = BoundedQueue(1)
+    logger = logging.getLogger('test_logger_warning_timeout')
+    logger.propagate = False
+    logger.addHandler(BoundedQueueHandler(records, timeout=0.1))
+    logger.warning(EscapedMessage('first warning'))
+    start = time.time()
+    logger.warning(EscapedMessage('second warning'))
+    assert 0.1 <= time.time() - start < 1
+    assert [str(record.msg) for record in list(records.queue)] == ['"first warning"']
+    assert logger.handlers[0].dropped == 1
+
+def test_bounded_queue_can_be_reentered_by_signal_handler():
+    records = BoundedQueue(10)
+    with records.mutex:
+        # Like a signal handler logging while its thread puts a record
+        records.put_nowait('record')
+    assert records.get_nowait() == 'record'
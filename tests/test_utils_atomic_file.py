@@ -0,0 +1,26 @@
+import os
+import pytest
+from lib.utils.atomic_file import write_file_atomically
+
+
+def test_write_file_atomically(tmpdir):
+    path = str(tmpdir.join('directory', 'file.json'))
+    write_file_atomically(path, '{"first": 1}')
+    write_file_atomically(path, '{"second": 2}')
+    with open(path) as written_file:
+        assert written_file.read() == '{"second": 2}'
+    assert os.listdir(str(tmpdir.join('directory'))) == ['file.json']
+
+def test_write_file_atomically_removes_temporary_file_on_error(tmpdir, monkeypatch):
+    path = str(tmpdir.join('file.json'))
+    write_file_atomically(path, 'old content')
+
+    def replace(source, target):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(os, 'replace', replace)
+    with pytest.raises(OSError):
+        write_file_atomically(path, 'new content')
+    assert os.listdir(str(tmpdir)) == ['file.json']
+    with open(path) as written_file:
+        assert written_file.read() == 'old content'
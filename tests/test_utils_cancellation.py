@@ -0,0 +1,22 @@
+import io
+import pytest
+from lib.utils.cancellation import CancellationToken, CancellableStream, OperationCancelled
+
+def test_cancellation_token():
+    token = CancellationToken()
+    assert token.cancelled == False
+    token.raise_if_cancelled()
+    token.cancel()
+    assert token.cancelled == True
+    pytest.raises(OperationCancelled, token.raise_if_cancelled)
+    token.reset()
+    assert token.cancelled == False
+
+def test_cancellable_stream():
+    token = CancellationToken()
+    stream = CancellableStream(io.BytesIO(b'0123456789'), token)
+    assert stream.read(4) == b'0123'
+    assert stream.tell() == 4
+    token.cancel()
+    pytest.raises(OperationCancelled, stream.read, 4)
+    pytest.raises(OperationCancelled, stream.write, b'data')
@@ -0,0 +1,69 @@
+import os
+from lib.utils.device_inventory import DeviceInventory
+from tests.utils.utilities import create_device_tree
+
+
+def create_tree(root):
+    return create_device_tree(
+        str(root),
+        mounts=[('/dev/root', '/'), ('/dev/nvme1n1p1', '/var/vcap/store'), ('/dev/sdc1', '/var/vcap/data\\040old')],
+        disks={
+            'nvme0n1': {'serial': 'vol0aaaaaaaaaaaaaaaa', 'partitions': ['nvme0n1p1']},
+            'nvme1n1': {'serial': 'vol0123456789abcdef0', 'partitions': ['nvme1n1p1', 'nvme1n1p2']},
+            'sdc': {'scsi_address': '5:0:0:1', 'partitions': ['sdc1']},
+            'sdd': {'scsi_address': '5:0:1:2'}
+        },
+        links={'google-disk-id': 'sdc', 'virtio-1234567890abcdef-part1': 'sdc1'})
+
+
+def test_device_inventory_reads_mounts_and_disks(tmpdir):
+    inventory = DeviceInventory(create_tree(tmpdir))
+    assert inventory.get_mount_device('/var/vcap/store/') == '/dev/nvme1n1p1'
+    assert inventory.get_mount_device('/var/vcap/data old') == '/dev/sdc1'
+    assert inventory.get_mount_device('/tmp/backup') is None
+    disk = inventory.get_disk_of('/dev/nvme1n1p1')
+    assert (disk.path, disk.serial, disk.scsi_address) == ('/dev/nvme1n1', 'vol0123456789abcdef0', None)
+    assert disk.partitions == ['/dev/nvme1n1p1', '/dev/nvme1n1p2']
+    assert inventory.get_disk_of('/dev/sdc').scsi_address == (5, 0, 0, 1)
+    assert [disk.path for disk in inventory.get_disks_at_scsi_address('5', 2)] == ['/dev/sdd']
+    assert inventory.get_disks_at_scsi_address(5, 3) == []
+
+
+def test_device_inventory_resolves_links(tmpdir):
+    inventory = DeviceInventory(create_tree(tmpdir))
+    assert inventory.get_link_target('/dev/disk/by-id/google-disk-id') == '/dev/sdc'
+    assert inventory.get_link_target('/dev/disk/by-id/google-unknown') is None
+    assert inventory.find_links('12345678-?90ab') == ['/dev/disk/by-id/virtio-1234567890abcdef-part1']
+    assert inventory.get_disk_of('/dev/disk/by-id/virtio-1234567890abcdef-part1').path == '/dev/sdc'
+
+
+def test_device_inventory_assumes_partition_names_of_unknown_devices(tmpdir):
+    inventory = DeviceInventory(create_tree(tmpdir))
+    assert inventory.get_disk_of('/dev/xvdk1').path == '/dev/xvdk'
+    assert inventory.get_disk_of('/dev/nvme4n1p1').path == '/dev/nvme4n1'
+    assert inventory.get_disk_of(None) is None
+
+
+def test_device_inventory_refreshes_incrementally(tmpdir):
+    root = create_tree(tmpdir)
+    inventory = DeviceInventory(root)
+    nvme0n1 = inventory.get_disk_of('/dev/nvme0n1')
+    # A new disk is found by a lookup without invalidation, as nothing was found
+    create_device_tree(root, disks={'sde': {'scsi_address': '5:0:0:3'}}, links={'google-new-disk': 'sde'})
+    assert [disk.path for disk in inventory.get_disks_at_scsi_address(5, 3)] == ['/dev/sde']
+    assert inventory.get_link_target('/dev/disk/by-id/google-new-disk') == '/dev/sde'
+    # Known disks are not read again, unless they were replaced
+    with open(os.path.join(root, 'sys', 'devices', 'controller-nvme0n1', 'serial'), 'w') as serial_file:
+        serial_file.write('changed')
+    os.remove(os.path.join(root, 'sys', 'block', 'sdd'))
+    inventory.invalidate()
+    assert inventory.get_disk_of('/dev/nvme0n1') is nvme0n1
+    assert inventory.get_disks_at_scsi_address(5, 2) == []
+    # Like sysfs, the tree gives the new disk another inode
+    os.remove(os.path.join(root, 'sys', 'block', 'nvme0n1'))
+    os.rename(os.path.join(root, 'sys', 'devices', 'nvme0n1'), os.path.join(root, 'sys', 'devices', 'removed'))
+    os.rename(os.path.join(root, 'sys', 'devices', 'controller-nvme0n1'),
+              os.path.join(root, 'sys', 'devices', 'removed-controller'))
+    create_device_tree(root, disks={'nvme0n1': {'serial': 'vol0bbbbbbbbbbbbbbbb'}})
+    inventory.invalidate()
+    assert inventory.get_disk_of('/dev/nvme0n1').serial == 'vol0bbbbbbbbbbbbbbbb'
@@ -0,0 +1,32 @@
+import os
+import threading
+import time
+from lib.utils.device_watcher import DeviceWatcher
+
+
+def create_later(path, delay):
+    timer = threading.Timer(delay, lambda: os.symlink('../sdc', path))
+    timer.start()
+    return timer
+
+
+def test_device_watcher_wakes_up_on_new_device(tmpdir):
+    link = str(tmpdir.join('google-disk-id'))
+    create_later(link, 0.2)
+    start_time = time.time()
+    # The poll interval is longer than the test, so only the inotify event can wake up the watcher
+    assert DeviceWatcher([str(tmpdir)], poll_interval=30).wait(lambda: os.path.lexists(link) and link, 5) == link
+    assert time.time() - start_time < 2
+
+def test_device_watcher_polls_without_watched_directory(tmpdir):
+    link = str(tmpdir.join('google-disk-id'))
+    create_later(link, 0.2)
+    watcher = DeviceWatcher([str(tmpdir.join('missing'))], poll_interval=0.1)
+    assert watcher.wait(lambda: os.path.lexists(link) and link, 5) == link
+
+def test_device_watcher_times_out(tmpdir):
+    checks = []
+    start_time = time.time()
+    assert DeviceWatcher([str(tmpdir)], poll_interval=0.1).wait(lambda: checks.append(1), 0.35) is None
+    assert 0.35 <= time.time() - start_time < 2
+    assert len(checks) >= 3
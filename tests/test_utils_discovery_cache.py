@@ -0,0 +1,55 @@
+import json
+import os
+import time
+from googleapiclient import discovery
+from googleapiclient.http import HttpMockSequence
+from lib.utils.discovery_cache import DiscoveryDocumentCache
+
+url = 'https://www.googleapis.com/discovery/v1/apis/compute/v1/rest'
+document = json.dumps({
+    'name': 'compute',
+    'version': 'v1',
+    'rootUrl': 'https://compute.googleapis.com/',
+    'servicePath': 'compute/v1/',
+    'resources': {
+        'zones': {'methods': {'get': {'id': 'compute.zones.get', 'path': 'projects/{project}/zones/{zone}',
+                                      'httpMethod': 'GET', 'parameters': {}}}}
+    }
+})
+
+
+def test_discovery_cache_returns_cached_document(tmpdir):
+    cache = DiscoveryDocumentCache(str(tmpdir))
+    assert cache.get(url) is None
+    cache.set(url, document)
+    assert cache.get(url) == document
+    assert cache.get(url.replace('v1', 'beta')) is None
+    assert [name for name in os.listdir(str(tmpdir)) if name.endswith('.tmp')] == []
+
+def test_discovery_cache_expires_document(tmpdir):
+    cache = DiscoveryDocumentCache(str(tmpdir), ttl=60)
+    cache.set(url, document)
+    path = cache._get_path(url)
+    os.utime(path, (time.time() - 61, time.time() - 61))
+    assert cache.get(url) is None
+
+def test_discovery_cache_ignores_corrupt_document(tmpdir):
+    cache = DiscoveryDocumentCache(str(tmpdir))
+    with open(cache._get_path(url), 'w') as cache_file:
+        cache_file.write(document[:100])
+    assert cache.get(url) is None
+
+def test_discovery_cache_ignores_unwritable_directory(tmpdir):
+    path = str(tmpdir.join('file'))
+    open(path, 'w').close()
+    cache = DiscoveryDocumentCache(os.path.join(path, 'cache'))
+    cache.set(url, document)
+    assert cache.get(url) is None
+
+def test_discovery_build_uses_cached_document_offline(tmpdir):
+    cache = DiscoveryDocumentCache(str(tmpdir))
+    # The first build fetches the document, the second one must not send any request
+    http = HttpMockSequence([({'status': '200'}, document)])
+    discovery.build('compute', 'v1', http=http, cache=cache)
+    compute_client = discovery.build('compute', 'v1', http=HttpMockSequence([]), cache=cache)
+    assert hasattr(compute_client.zones(), 'get')
@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+from lib.utils.last_operation_writer import LastOperationWriter, replace_symlink
+
+
+def create_writer(tmpdir, flush_interval):
+    paths = [str(tmpdir.join(name)) for name in ['lastoperation.json', 'blue.json', 'green.json']]
+    replace_symlink(paths[1], paths[0])
+    return LastOperationWriter(*paths, flush_interval=flush_interval)
+
+def read(writer):
+    with open(writer.link) as last_operation_file:
+        return last_operation_file.read()
+
+
+def test_replace_symlink(tmpdir):
+    link = str(tmpdir.join('link'))
+    replace_symlink('blue', link)
+    replace_symlink('green', link)
+    assert os.readlink(link) == 'green'
+    assert os.listdir(str(tmpdir)) == ['link']
+
+def test_last_operation_writer_alternates_files(tmpdir):
+    writer = create_writer(tmpdir, 0)
+    writer.update('first')
+    assert (os.readlink(writer.link), read(writer)) == (writer.green, 'first')
+    writer.update('second')
+    assert (os.readlink(writer.link), read(writer)) == (writer.blue, 'second')
+
+def test_last_operation_writer_coalesces_updates(tmpdir):
+    writer = create_writer(tmpdir, 0.3)
+    writer.update('first')
+    writer.update('second')
+    writer.update('third')
+    assert read(writer) == 'first'
+    time.sleep(0.5)
+    assert read(writer) == 'third'
+    assert writer.thread is None
+
+def test_last_operation_writer_flushes(tmpdir):
+    writer = create_writer(tmpdir, 60)
+    writer.update('processing')
+    writer.update('still processing')
+    writer.update('succeeded', flush=True)
+    assert read(writer) == 'succeeded'
+    writer.update('processing again')
+    writer.flush()
+    assert read(writer) == 'processing again'
+
+def test_last_operation_writer_accepts_update_while_writing(tmpdir):
+    writer = create_writer(tmpdir, 0)
+    write = writer._write
+
+    def write_interrupted_by_signal(content):
+        if content == 'processing':
+            # The signal handler logs the abortion on the writing thread
+            writer.update('aborting', flush=True)
+        write(content)
+
+    writer._write = write_interrupted_by_signal
+    thread = threading.Thread(target=writer.update, args=('processing',), kwargs={'flush': True}, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert read(writer) == 'aborting'
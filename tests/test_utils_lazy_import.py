@@ -0,0 +1,35 @@
+import sys
+from unittest.mock import patch
+from lib.utils.lazy_import import LazyModule, LazyAttribute
+
+# A module of the standard library which is not imported by the library or the tests
+module_name = 'colorsys'
+colorsys = LazyModule(module_name)
+
+
+def test_lazy_module_is_imported_on_first_attribute_access():
+    sys.modules.pop(module_name, None)
+    lazy_module = LazyModule(module_name)
+    assert module_name not in sys.modules
+    assert lazy_module.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert module_name in sys.modules
+    assert 'imported' in repr(lazy_module)
+
+def test_lazy_attribute_is_imported_on_first_call():
+    sys.modules.pop(module_name, None)
+    lazy_attribute = LazyAttribute(module_name, 'hsv_to_rgb')
+    assert module_name not in sys.modules
+    assert lazy_attribute(0.0, 1.0, 1.0) == (1.0, 0.0, 0.0)
+    assert LazyAttribute('lib.constants', 'APIS').get('ALI') is not None
+
+def test_lazy_module_attributes_can_be_patched():
+    with patch.object(colorsys, 'rgb_to_hsv', return_value='patched'):
+        assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == 'patched'
+    assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+
+def test_lazy_attribute_can_be_patched_where_it_is_used():
+    with patch('lib.clients.OpenstackClient.NovaClient', return_value='patched'):
+        from lib.clients.OpenstackClient import NovaClient
+        assert NovaClient(version='2') == 'patched'
+    from lib.clients.OpenstackClient import NovaClient
+    assert isinstance(NovaClient, LazyAttribute)
@@ -0,0 +1,34 @@
+import json
+import time
+from lib.utils.persistent_cache import PersistentCache
+
+
+def test_persistent_cache(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    cache = PersistentCache(path, 60)
+    assert cache.get('vm-id') is None
+    cache.set('vm-id', 'europe-west1-b')
+    # Another process sharing the file
+    assert PersistentCache(path, 60).get('vm-id') == 'europe-west1-b'
+    PersistentCache(path, 60).set('another-vm-id', 'europe-west1-c')
+    assert cache.get('vm-id') == 'europe-west1-b'
+    assert cache.get('another-vm-id') == 'europe-west1-c'
+
+def test_persistent_cache_expires_values(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    with open(path, 'w') as cache_file:
+        json.dump({'vm-id': {'value': 'europe-west1-b', 'time': time.time() - 61}}, cache_file)
+    cache = PersistentCache(path, 60)
+    assert cache.get('vm-id') is None
+    cache.set('another-vm-id', 'europe-west1-c')
+    with open(path) as cache_file:
+        assert list(json.load(cache_file)) == ['another-vm-id']
+
+def test_persistent_cache_ignores_corrupt_file(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    with open(path, 'w') as cache_file:
+        cache_file.write('{"vm-id": ')
+    cache = PersistentCache(path, 60)
+    assert cache.get('vm-id') is None
+    cache.set('vm-id', 'europe-west1-b')
+    assert cache.get('vm-id') == 'europe-west1-b'
@@ -0,0 +1,28 @@
+import os
+from lib.utils.shards import split_directory_into_shards, TAR_ENTRY_OVERHEAD
+
+def shard_size(directory, shard):
+    return sum(os.lstat(os.path.join(directory, os.fsdecode(path))).st_size + TAR_ENTRY_OVERHEAD
+               if not os.path.isdir(os.path.join(directory, os.fsdecode(path))) else TAR_ENTRY_OVERHEAD
+               for path in shard)
+
+def test_split_directory_into_shards(tmpdir):
+    tmpdir.join('large').write('x' * 100000)
+    tmpdir.join('medium').write('x' * 60000)
+    subdirectory = tmpdir.mkdir('subdirectory')
+    for i in range(8):
+        subdirectory.join('small-{}'.format(i)).write('x' * 5000)
+    os.symlink('large', str(tmpdir.join('link')))
+
+    shards = split_directory_into_shards(str(tmpdir), 2)
+    entries = sorted(path for shard in shards for path in shard)
+    assert entries == sorted([b'./large', b'./medium', b'./subdirectory', b'./link'] +
+                             [b'./subdirectory/small-' + str(i).encode() for i in range(8)])
+    sizes = [shard_size(str(tmpdir), shard) for shard in shards]
+    assert abs(sizes[0] - sizes[1]) <= 5000 + TAR_ENTRY_OVERHEAD
+
+def test_split_directory_into_more_shards_than_entries(tmpdir):
+    tmpdir.join('file').write('content')
+    shards = split_directory_into_shards(str(tmpdir), 3)
+    assert len(shards) == 3
+    assert sorted(len(shard) for shard in shards) == [0, 0, 1]
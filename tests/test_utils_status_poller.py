@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+import pytest
+from lib.utils.status_poller import StatusPoller
+from lib.utils.wait_strategies import FixedWaitStrategy
+
+logger = logging.getLogger('test_status_poller')
+
+
+class BatchedStatuses:
+    def __init__(self, completed_after):
+        # resource id -> number of fetches after which the resource is completed
+        self.completed_after = completed_after
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def fetch_statuses(self, resource_ids):
+        with self.lock:
+            self.calls.append(sorted(resource_ids))
+            return {resource_id: 'completed' if len(self.calls) > self.completed_after[resource_id] else 'pending'
+                    for resource_id in resource_ids if resource_id in self.completed_after}
+
+
+def test_status_poller_fetches_all_watched_resources_at_once():
+    statuses = BatchedStatuses({'snap-1': 1, 'snap-2': 0})
+    # Both watches are polled for the first time after the first delay
+    poller = StatusPoller(statuses.fetch_statuses, FixedWaitStrategy(0.5), logger)
+    futures = [poller.watch(resource_id, lambda status: status == 'completed') for resource_id in ('snap-1', 'snap-2')]
+    assert [future.result(timeout=5) for future in futures] == ['completed', 'completed']
+    assert statuses.calls == [['snap-1', 'snap-2'], ['snap-1']]
+
+def test_status_poller_polls_new_resource_after_first_delay():
+    statuses = BatchedStatuses({'snap-1': 0})
+    poll_times = []
+
+    def fetch_statuses(resource_ids):
+        poll_times.append(time.time())
+        return statuses.fetch_statuses(resource_ids)
+
+    poller = StatusPoller(fetch_statuses, FixedWaitStrategy(0.5), logger)
+    start = time.time()
+    assert poller.watch('snap-1', lambda status: status == 'completed').result(timeout=5) == 'completed'
+    assert poll_times[0] - start >= 0.5 - 0.1
+
+def test_status_poller_passes_none_for_missing_resources():
+    statuses = BatchedStatuses({})
+    poller = StatusPoller(statuses.fetch_statuses, FixedWaitStrategy(0.01), logger)
+    assert poller.watch('snap-deleted', lambda status: status is None).result(timeout=5) is None
+
+def test_status_poller_fails_watches_on_fetch_error():
+    def fetch_statuses(resource_ids):
+        raise ValueError('Describe failed')
+
+    poller = StatusPoller(fetch_statuses, FixedWaitStrategy(0.01), logger)
+    with pytest.raises(ValueError):
+        poller.watch('snap-1', lambda status: True).result(timeout=5)
+
+def test_status_poller_ignores_fetch_errors_if_asked():
+    responses = iter([ValueError('Throttled'), {'snap-1': 'completed'}])
+
+    def fetch_statuses(resource_ids):
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    poller = StatusPoller(fetch_statuses, FixedWaitStrategy(0.01), logger)
+    future = poller.watch('snap-1', lambda status: status == 'completed', ignore_errors=True)
+    assert future.result(timeout=5) == 'completed'
+
+def test_status_poller_fails_watch_on_condition_error():
+    statuses = BatchedStatuses({})
+    poller = StatusPoller(statuses.fetch_statuses, FixedWaitStrategy(0.01), logger)
+    with pytest.raises(AttributeError):
+        poller.watch('snap-1', lambda status: status.state == 'completed').result(timeout=5)
+
+def test_status_poller_stops_thread_without_watches():
+    statuses = BatchedStatuses({'snap-1': 0})
+    poller = StatusPoller(statuses.fetch_statuses, FixedWaitStrategy(0.01), logger)
+    poller.watch('snap-1', lambda status: status == 'completed').result(timeout=5)
+    thread = poller.thread
+    if thread:
+        thread.join(timeout=5)
+    assert poller.thread is None
@@ -0,0 +1,19 @@
+import io
+import os
+import pytest
+from lib.utils.tracking_stream import TrackingStream
+
+def test_tracking_stream_tell():
+    stream = TrackingStream(io.BytesIO(b'0123456789'))
+    assert stream.tell() == 0
+    assert stream.read(4) == b'0123'
+    assert stream.tell() == 4
+    assert stream.read() == b'456789'
+    assert stream.tell() == 10
+
+def test_tracking_stream_seek():
+    stream = TrackingStream(io.BytesIO(b'0123456789'))
+    stream.read(4)
+    assert stream.seek(4) == 4
+    assert stream.seek(0, os.SEEK_CUR) == 4
+    pytest.raises(io.UnsupportedOperation, stream.seek, 0)
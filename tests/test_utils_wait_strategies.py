@@ -0,0 +1,59 @@
+import json
+from lib.utils.wait_strategies import FixedWaitStrategy, ExponentialBackoffWaitStrategy, WaitHistory, \
+    PredictiveWaitStrategy, create_wait_strategy
+
+def test_fixed_wait_strategy():
+    strategy = FixedWaitStrategy(10)
+    assert [strategy.get_delay('snapshot.create', attempt, 0) for attempt in range(3)] == [10, 10, 10]
+
+def test_exponential_backoff_wait_strategy():
+    strategy = ExponentialBackoffWaitStrategy(10, jitter=0)
+    assert [strategy.get_delay('snapshot.create', attempt, 0) for attempt in range(6)] == [1, 2, 4, 8, 10, 10]
+
+def test_exponential_backoff_wait_strategy_jitter():
+    strategy = ExponentialBackoffWaitStrategy(10)
+    for attempt in range(6):
+        delay = strategy.get_delay('snapshot.create', attempt, 0)
+        assert min(10, 2 ** attempt) / 2 <= delay <= min(10, 2 ** attempt)
+
+def test_wait_history(tmpdir):
+    path = str(tmpdir.join('wait_history.json'))
+    history = WaitHistory(path, history_size=3)
+    assert history.get_expected_duration('AwsClient/snapshot.create') is None
+    for duration in [100, 200, 300, 400]:
+        history.add('AwsClient/snapshot.create', duration)
+    assert history.get_expected_duration('AwsClient/snapshot.create') == 300
+    with open(path) as history_file:
+        assert json.load(history_file) == {'AwsClient/snapshot.create': [200, 300, 400]}
+    # The history survives the process
+    assert WaitHistory(path).get_expected_duration('AwsClient/snapshot.create') == 300
+
+def test_wait_history_ignores_corrupt_file(tmpdir):
+    tmpdir.join('wait_history.json').write('{corrupt')
+    history = WaitHistory(str(tmpdir.join('wait_history.json')))
+    assert history.get_expected_duration('AwsClient/snapshot.create') is None
+    history.add('AwsClient/snapshot.create', 10)
+    assert history.get_expected_duration('AwsClient/snapshot.create') == 10
+
+def test_predictive_wait_strategy(tmpdir):
+    history = WaitHistory(str(tmpdir.join('wait_history.json')))
+    strategy = PredictiveWaitStrategy(history, 'AwsClient', FixedWaitStrategy(10), maximum_delay=300)
+    # Without history, the fallback is used
+    assert strategy.get_delay('snapshot.create', 0, 0) == 10
+    strategy.record('snapshot.create', 2400)
+    assert history.get_expected_duration('AwsClient/snapshot.create') == 2400
+    # Sparse polls early, dense polls around the expected completion
+    assert strategy.get_delay('snapshot.create', 0, 0) == 300
+    assert strategy.get_delay('snapshot.create', 5, 2200) == 100
+    assert strategy.get_delay('snapshot.create', 8, 2399) == 1
+    assert strategy.get_delay('snapshot.create', 9, 2420) == 10
+    # Other resource types and providers have their own history
+    assert strategy.get_delay('attachment.create', 0, 0) == 10
+    other_provider = PredictiveWaitStrategy(history, 'GcpClient', FixedWaitStrategy(10))
+    assert other_provider.get_delay('snapshot.create', 0, 0) == 10
+
+def test_create_wait_strategy(tmpdir):
+    path = str(tmpdir.join('wait_history.json'))
+    assert isinstance(create_wait_strategy('fixed', 10, path, 'AwsClient'), FixedWaitStrategy)
+    assert isinstance(create_wait_strategy('exponential', 10, path, 'AwsClient'), ExponentialBackoffWaitStrategy)
+    assert isinstance(create_wait_strategy('predictive', 10, path, 'AwsClient'), PredictiveWaitStrategy)
@@ -0,0 +1,197 @@
+import threading
+import time
+import pytest
+from lib.workflow import Step, Workflow, WorkflowError, create_backup_workflow, create_restore_workflow
+from lib.models.Snapshot import Snapshot
+from lib.models.Volume import Volume
+from lib.utils.cancellation import CancellationToken
+
+# Minimal IaaS client recording the calls of the workflows
+class RecordingClient:
+    def __init__(self, failing=None, raising=None):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.failing = failing
+        self.raising = raising
+        self.logger = None
+        self.cancellation_token = CancellationToken()
+        # The copy of the snapshot has to run while the backup is uploaded to pass the barrier
+        self.barrier = threading.Barrier(2, timeout=5)
+
+    def record(self, name, result=True):
+        with self.lock:
+            self.calls.append(name)
+        if name == self.raising:
+            raise Exception('{} failed'.format(name))
+        return None if name == self.failing else result
+
+    def get_persistent_volume_for_instance(self, instance_id):
+        return self.record('get_persistent_volume_for_instance', Volume('volume-persistent', 'none', 40))
+
+    def create_snapshot(self, volume_id):
+        return self.record('create_snapshot', Snapshot('snapshot', 40, None, 'completed'))
+
+    def copy_snapshot(self, snapshot_id):
+        self.barrier.wait()
+        return self.record('copy_snapshot', Snapshot('snapshot-copy', 40, None, 'completed'))
+
+    def delete_snapshot(self, snapshot_id):
+        return self.record('delete_snapshot ' + snapshot_id)
+
+    def create_volume(self, size, snapshot_id):
+        return self.record('create_volume', Volume('volume', 'none', size))
+
+    def delete_volume(self, volume_id):
+        return self.record('delete_volume')
+
+    def create_attachment(self, volume_id, instance_id):
+        return self.record('create_attachment')
+
+    def delete_attachment(self, volume_id, instance_id):
+        return self.record('delete_attachment')
+
+    def get_mountpoint(self, volume_id, partition=None):
+        return self.record('get_mountpoint', '/dev/sdb1')
+
+    def create_directory(self, directory):
+        return self.record('create_directory')
+
+    def delete_directory(self, directory):
+        return self.record('delete_directory')
+
+    def mount_device(self, device, directory):
+        return self.record('mount_device')
+
+    def unmount_device(self, device):
+        return self.record('unmount_device')
+
+    def backup_directory_to_blobstore(self, directory, blob_name):
+        if self.failing != 'backup_directory_to_blobstore':
+            self.barrier.wait()
+        return self.record('backup_directory_to_blobstore')
+
+    def stop_service_job(self):
+        return self.record('stop_service_job')
+
+    def start_service_job(self):
+        return self.record('start_service_job')
+
+    def wait_for_service_job_status(self, status):
+        return self.record('wait_for_service_job_status ' + status)
+
+    def download_from_blobstore_decrypt_extract(self, blob_name, directory):
+        return self.record('download_from_blobstore_decrypt_extract')
+
+def test_workflow_runs_steps_after_the_steps_they_require():
+    order = []
+    workflow = Workflow([
+        Step('c', lambda results: order.append('c') or results['a'] + results['b'], requires=['a', 'b']),
+        Step('a', lambda results: order.append('a') or 1),
+        Step('b', lambda results: order.append('b') or 2, requires=['a'])
+    ])
+    assert workflow.run() == {'a': 1, 'b': 2, 'c': 3}
+    assert order == ['a', 'b', 'c']
+
+def test_workflow_runs_independent_steps_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    workflow = Workflow([
+        Step('a', lambda results: barrier.wait() is not None),
+        Step('b', lambda results: barrier.wait() is not None)
+    ])
+    assert workflow.run() == {'a': True, 'b': True}
+
+def test_workflow_compensates_completed_steps_in_reverse_order():
+    compensated = []
+
+    def fail(results):
+        raise Exception('Step failed')
+
+    workflow = Workflow([
+        Step('a', lambda results: 1, compensation=lambda results: compensated.append('a')),
+        Step('b', lambda results: 2, requires=['a'], compensation=lambda results: compensated.append('b')),
+        Step('c', fail, requires=['b'], compensation=lambda results: compensated.append('c')),
+        Step('d', lambda results: 4, requires=['c'], compensation=lambda results: compensated.append('d'))
+    ])
+    with pytest.raises(WorkflowError):
+        workflow.run()
+    assert compensated == ['b', 'a']
+
+def test_workflow_fails_step_exceeding_its_timeout():
+    token = CancellationToken()
+    events = []
+
+    def slow(results):
+        # Like a long transfer, the step stops once it is cancelled
+        token.event.wait(5)
+        events.append('slow cancelled')
+        token.raise_if_cancelled()
+
+    workflow = Workflow([
+        Step('a', lambda results: 1, compensation=lambda results: events.append('a compensated')),
+        Step('slow', slow, requires=['a'], timeout=0.1)
+    ], cancellation_token=token)
+    start = time.time()
+    with pytest.raises(WorkflowError):
+        workflow.run()
+    assert time.time() - start < 1
+    # The compensation does not undo what the step still uses
+    assert events == ['slow cancelled', 'a compensated']
+    assert not token.cancelled
+
+def test_workflow_rejects_invalid_dependencies():
+    with pytest.raises(WorkflowError):
+        Workflow([Step('a', lambda results: 1, requires=['unknown'])])
+    with pytest.raises(WorkflowError):
+        Workflow([Step('a', lambda results: 1, requires=['b']), Step('b', lambda results: 2, requires=['a'])])
+    with pytest.raises(WorkflowError):
+        Workflow([Step('a', lambda results: 1), Step('a', lambda results: 2)])
+
+def test_backup_workflow_copies_snapshot_while_uploading():
+    client = RecordingClient()
+    results = create_backup_workflow(client, 'vm-id', 'blob', '/tmp/backup', copy_snapshot=True).run()
+    assert results['copy_snapshot'].id == 'snapshot-copy'
+    calls = client.calls
+    assert calls.index('create_snapshot') < calls.index('create_volume') < calls.index('create_attachment') < \
+        calls.index('mount_device') < calls.index('backup_directory_to_blobstore') < calls.index('unmount_device') < \
+        calls.index('delete_attachment') < calls.index('delete_volume') < calls.index('delete_snapshot snapshot')
+    assert calls.index('copy_snapshot') < calls.index('delete_snapshot snapshot')
+    assert 'delete_snapshot snapshot-copy' not in calls
+
+def test_backup_workflow_compensates_if_upload_fails():
+    client = RecordingClient(failing='backup_directory_to_blobstore')
+    with pytest.raises(WorkflowError):
+        create_backup_workflow(client, 'vm-id', 'blob', '/tmp/backup').run()
+    calls = client.calls
+    assert calls[calls.index('backup_directory_to_blobstore') + 1:] == \
+        ['unmount_device', 'delete_attachment', 'delete_volume', 'delete_snapshot snapshot']
+
+def test_workflow_goes_on_if_best_effort_step_fails():
+    def fail(results):
+        raise Exception('Step failed')
+
+    workflow = Workflow([
+        Step('a', lambda results: 1),
+        Step('b', fail, requires=['a'], best_effort=True),
+        Step('c', lambda results: 3, requires=['b'])
+    ])
+    assert workflow.run() == {'a': 1, 'b': None, 'c': 3}
+
+def test_backup_workflow_keeps_backup_if_tear_down_fails():
+    client = RecordingClient(raising='delete_volume')
+    results = create_backup_workflow(client, 'vm-id', 'blob', '/tmp/backup', copy_snapshot=True).run()
+    assert results['copy_snapshot'].id == 'snapshot-copy'
+    assert results['delete_volume'] is None
+    calls = client.calls
+    assert calls.count('delete_volume') == 1
+    assert calls.count('unmount_device') == calls.count('delete_attachment') == 1
+    assert 'delete_snapshot snapshot-copy' not in calls
+    # The original snapshot is deleted nevertheless, as the copy is the backup
+    assert calls.index('delete_volume') < calls.index('delete_snapshot snapshot')
+
+def test_restore_workflow_starts_service_job_if_download_fails():
+    client = RecordingClient(failing='download_from_blobstore_decrypt_extract')
+    with pytest.raises(WorkflowError):
+        create_restore_workflow(client, 'blob', '/var/vcap/store').run()
+    assert client.calls == ['stop_service_job', 'wait_for_service_job_status not monitored',
+                            'download_from_blobstore_decrypt_extract', 'start_service_job',
+                            'wait_for_service_job_status running']
@@ -1,3 +1,4 @@
+import os
 from unittest.mock import patch
 
 def create_start_patcher(patch_function, patch_object=None, return_value=None, side_effect=None):
@@ -17,4 +18,39 @@ def create_start_patcher(patch_function, patch_object=None, return_value=None, s
 
 def stop_all_patchers(patchers):
     for patcher in patchers:
-        patcher.stop()
\ No newline at end of file
+        patcher.stop()
+
+
+def create_device_tree(root, mounts=(), disks=None, links=None):
+    """Create the /proc/mounts, /sys/block and /dev/disk/by-id read by DeviceInventory in the directory root.
+
+    :param mounts: the list of (device, mountpoint)
+    :param disks: the disks by name, each a dictionary with the optional keys serial, scsi_address (e.g. '2:0:0:1')
+        and partitions (a list of names)
+    :param links: the /dev/disk/by-id link names with the name of the device they point to
+    """
+    os.makedirs(os.path.join(root, 'proc'), exist_ok=True)
+    with open(os.path.join(root, 'proc', 'mounts'), 'w') as mounts_file:
+        for device, mountpoint in mounts:
+            mounts_file.write('{} {} ext4 rw,relatime 0 0\n'.format(device, mountpoint))
+    os.makedirs(os.path.join(root, 'sys', 'block'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'dev', 'disk', 'by-id'), exist_ok=True)
+    for name, disk in (disks or {}).items():
+        disk_directory = os.path.join(root, 'sys', 'devices', name)
+        device_directory = os.path.join(root, 'sys', 'devices', disk.get('scsi_address') or 'controller-' + name)
+        os.makedirs(disk_directory, exist_ok=True)
+        os.makedirs(device_directory, exist_ok=True)
+        os.symlink(device_directory, os.path.join(disk_directory, 'device'))
+        os.symlink(disk_directory, os.path.join(root, 'sys', 'block', name))
+        if disk.get('serial'):
+            with open(os.path.join(device_directory, 'serial'), 'w') as serial_file:
+                serial_file.write(disk['serial'] + '\n')
+        open(os.path.join(root, 'dev', name), 'w').close()
+        for number, partition in enumerate(disk.get('partitions', []), 1):
+            os.makedirs(os.path.join(disk_directory, partition), exist_ok=True)
+            with open(os.path.join(disk_directory, partition, 'partition'), 'w') as partition_file:
+                partition_file.write('{}\n'.format(number))
+            open(os.path.join(root, 'dev', partition), 'w').close()
+    for link, device in (links or {}).items():
+        os.symlink(os.path.join('..', '..', device), os.path.join(root, 'dev', 'disk', 'by-id', link))
+    return root